@@ -0,0 +1,55 @@
+"""Compare the UTF-8 validators used by the development websocket server.
+
+Run it with `python benchmarks/utf8validator.py` from the root of the repository. `wsaccel` is only measured
+when it is installed.
+"""
+import timeit
+
+from djangofloor.wsgi.utf8validator import DfaUtf8Validator, IncrementalUtf8Validator
+
+__author__ = "Matthieu Gallet"
+
+SIZES = [("1 KB", 1024), ("64 KB", 64 * 1024), ("4 MB", 4 * 1024 * 1024)]
+
+
+def get_validators():
+    validators = [("DFA", DfaUtf8Validator), ("codecs", IncrementalUtf8Validator)]
+    try:
+        # noinspection PyUnresolvedReferences,PyPackageRequirements
+        from wsaccel.utf8validator import Utf8Validator
+    except ImportError:
+        pass
+    else:
+        validators.append(("wsaccel", Utf8Validator))
+    return validators
+
+
+def get_payload(size):
+    text = "Djangofloor — signaux en temps réel 🚀 "
+    data = text.encode("utf-8")
+    return (data * (size // len(data) + 1))[:size].decode("utf-8", "ignore").encode(
+        "utf-8"
+    )
+
+
+def main():
+    print("%-10s %-10s %12s %12s" % ("payload", "validator", "time (ms)", "MB/s"))
+    for size_name, size in SIZES:
+        payload = get_payload(size)
+        for validator_name, validator_cls in get_validators():
+            validator = validator_cls()
+            number = max(1, 2 ** 20 // size) if validator_name != "DFA" else 1
+
+            def run():
+                validator.reset()
+                assert validator.validate(payload)[0]
+
+            duration = min(timeit.repeat(run, number=number, repeat=3)) / number
+            print(
+                "%-10s %-10s %12.3f %12.1f"
+                % (size_name, validator_name, duration * 1000, size / duration / 1e6)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compare the memory used by :class:`WindowInfo` and :class:`CompactWindowInfo` objects.
+
+Run it with `python benchmarks/window_info.py` from the root of the repository. Each websocket connection keeps
+a window info built from its request, and each signal processed by a Celery worker builds one from a dict.
+"""
+import os
+import timeit
+import tracemalloc
+
+from djangofloor.scripts import set_env
+
+__author__ = "Matthieu Gallet"
+
+COUNT = 10000
+
+
+def get_request():
+    from django.conf import settings
+    from django.contrib.auth.models import AnonymousUser
+    from django.http import HttpRequest
+
+    request = HttpRequest()
+    request.window_key = "e4c9dbad-54c6-4bd2-9c5b-c3d3e3cd5d4b"
+    request.user = AnonymousUser()
+    request.session = None
+    request.META["HTTP_USER_AGENT"] = "Mozilla/5.0 (X11; Linux x86_64)"
+    request.COOKIES[settings.SESSION_COOKIE_NAME] = "session"
+    return request
+
+
+def read_all(window_info):
+    # force CompactWindowInfo to run all middlewares
+    window_info.to_dict()
+    return window_info
+
+
+def measure(factory):
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    objects = [factory() for __ in range(COUNT)]
+    size = sum(
+        x.size_diff for x in tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+    )
+    tracemalloc.stop()
+    del objects
+    duration = min(timeit.repeat(factory, number=COUNT, repeat=3)) / COUNT
+    return size / COUNT, duration
+
+
+def main():
+    os.environ["DJANGO_SETTINGS_MODULE"] = "djangofloor.conf.settings"
+    set_env(command_name="djangofloor-django")
+    import django
+
+    django.setup()
+    from djangofloor.wsgi.window_info import CompactWindowInfo, WindowInfo
+
+    request = get_request()
+    values = WindowInfo.from_request(request).to_dict()
+    print("%-20s %-14s %16s %12s" % ("class", "source", "bytes/instance", "time (µs)"))
+    sizes = {}
+    for cls in (WindowInfo, CompactWindowInfo):
+        for source, factory in (
+            ("request", lambda: cls.from_request(request)),
+            ("dict", lambda: cls.from_dict(values)),
+            ("dict, read", lambda: read_all(cls.from_dict(values))),
+        ):
+            size, duration = measure(factory)
+            sizes[(cls, source)] = size
+            print(
+                "%-20s %-14s %16.0f %12.2f"
+                % (cls.__name__, source, size, duration * 1e6)
+            )
+    # each websocket connection keeps the window info built from its request
+    assert sizes[(CompactWindowInfo, "request")] < sizes[(WindowInfo, "request")]
+
+
+if __name__ == "__main__":
+    main()
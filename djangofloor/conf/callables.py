@@ -293,6 +293,35 @@ def cache_setting(settings_dict):
 cache_setting.required_settings = ["USE_REDIS_CACHE", "DEBUG", "CACHE_URL"]
 
 
+def celery_beat_schedule(settings_dict):
+    """Periodic tasks required by DjangoFloor (flush of notification reads and promotion of delayed signals)
+
+    >>> celery_beat_schedule({'DF_NOTIFICATION_READ_WRITE_BEHIND': False, 'DF_NOTIFICATION_READ_FLUSH_INTERVAL': 60,
+    ... 'DF_SIGNAL_SCHEDULER': False, 'DF_SIGNAL_SCHEDULER_INTERVAL': 1})
+    {}
+    """
+    result = {}
+    if settings_dict["DF_NOTIFICATION_READ_WRITE_BEHIND"]:
+        result["djangofloor.flush_notification_reads"] = {
+            "task": "djangofloor.tasks.flush_notification_reads",
+            "schedule": settings_dict["DF_NOTIFICATION_READ_FLUSH_INTERVAL"],
+        }
+    if settings_dict["DF_SIGNAL_SCHEDULER"]:
+        result["djangofloor.promote_delayed_signals"] = {
+            "task": "djangofloor.tasks.promote_delayed_signals",
+            "schedule": settings_dict["DF_SIGNAL_SCHEDULER_INTERVAL"],
+        }
+    return result
+
+
+celery_beat_schedule.required_settings = [
+    "DF_NOTIFICATION_READ_WRITE_BEHIND",
+    "DF_NOTIFICATION_READ_FLUSH_INTERVAL",
+    "DF_SIGNAL_SCHEDULER",
+    "DF_SIGNAL_SCHEDULER_INTERVAL",
+]
+
+
 def url_parse_server_name(settings_dict):
     """Return the public hostname, given the public base URL
 
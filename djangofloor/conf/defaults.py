@@ -38,6 +38,7 @@ from djangofloor.conf.callables import (
     allowed_hosts,
     cache_redis_url,
     cache_setting,
+    celery_beat_schedule,
     celery_redis_url,
     csrf_trusted_origins, databases,
     excluded_django_commands,
@@ -213,6 +214,7 @@ CELERY_ACCEPT_CONTENT = ["json", "yaml", "msgpack"]
 CELERY_APP = "djangofloor"
 CELERY_CREATE_DIRS = True
 CELERY_TASK_SERIALIZER = "json"
+CELERYBEAT_SCHEDULE = CallableSetting(celery_beat_schedule)
 
 # django-npm
 NPM_EXECUTABLE_PATH = "npm"
@@ -253,6 +255,8 @@ WINDOW_INFO_MIDDLEWARES = [
     "djangofloor.middleware.Djangoi18nMiddleware",
     "djangofloor.middleware.BrowserMiddleware",
 ]
+WINDOW_INFO_CLASS = "djangofloor.wsgi.window_info.WindowInfo"
+# use "djangofloor.wsgi.window_info.CompactWindowInfo" to reduce the memory used by each websocket connection
 DF_SERVER_TIMEOUT = 35
 DF_SERVER_GRACEFUL_TIMEOUT = 25
 DF_SERVER_THREADS = 2
@@ -271,10 +275,27 @@ WEBSOCKET_HEARTBEAT = "--HEARTBEAT--"
 WEBSOCKET_SIGNAL_DECODER = "json.JSONDecoder"
 WEBSOCKET_SIGNAL_ENCODER = "django.core.serializers.json.DjangoJSONEncoder"
 WEBSOCKET_REDIS_PREFIX = "ws"
+WEBSOCKET_TRANSPORT = "djangofloor.wsgi.transports.RedisTransport"
+# "djangofloor.wsgi.transports.MemoryTransport" for single-host installs without Redis
+WEBSOCKET_MEMORY_TRANSPORT_DIRECTORY = None  # directory of the Unix sockets used by the MemoryTransport
+WEBSOCKET_REDIS_SHARDS = []
+# list of dicts like WEBSOCKET_REDIS_CONNECTION, used by "djangofloor.wsgi.transports.ShardedRedisTransport"
 WEBSOCKET_REDIS_EXPIRE = 36000
+WEBSOCKET_SIGNED_TOPICS = False  # store topics in the signed websocket token instead of Redis
 WEBSOCKET_CONNECTION_EXPIRE = 3600  # by default, close a connection after one hour
 # (but the client transparently reopen it
 WEBSOCKET_HEADER = "WINDOW_KEY"  # header used in AJAX requests (thus they have the same window identifier)
+WEBSOCKET_DISPATCH_THREADS = 4  # threads used by the aiohttp server for processing signals sent by clients
+WEBSOCKET_DISPATCH_QUEUE_SIZE = 100  # max number of client messages waiting for one of these threads
+WEBSOCKET_INLINE_THREADS = 4  # threads used for running signals and functions registered with queue=INLINE
+WEBSOCKET_INLINE_TIMEOUT = 5  # in seconds, max time to wait for a signal or a function registered with queue=INLINE
+WEBSOCKET_SEND_QUEUE_SIZE = 100  # max number of messages waiting to be sent to a single websocket (aiohttp server)
+WEBSOCKET_SEND_QUEUE_POLICY = "drop-oldest"  # "drop-oldest", "coalesce" or "disconnect"
+WEBSOCKET_SEND_QUEUE_MAX_LAG = 30  # in seconds, max time a send queue can stay full with the "disconnect" policy
+WEBSOCKET_COMPRESSION = True  # negotiate the "permessage-deflate" extension with clients
+WEBSOCKET_COMPRESSION_THRESHOLD = 512  # smaller messages are not compressed (dev server only)
+WEBSOCKET_COMPRESSION_CONTEXT_TAKEOVER = True  # False to reset the compression context for each message
+WEBSOCKET_COMPRESSION_MAX_SIZE = 1048576  # max size of a received message once decompressed (dev server only)
 
 # django-pipeline
 PIPELINE = {
@@ -505,6 +526,25 @@ DF_PIP_NAME = "{DF_MODULE_NAME}"  # anything such that "pip install {DF_PIP_NAME
 # only used in docs
 DF_MIDDLEWARE = []
 DF_REMOTE_USER_HEADER = None  # HTTP_REMOTE_USER
+DF_HTTP_BASIC_AUTH_CACHE_SIZE = 1000  # number of verified HTTP basic credentials kept in memory
+DF_HTTP_BASIC_AUTH_CACHE_TTL = 300  # in seconds, 0 to always check passwords
+DF_NOTIFICATION_INDEX = None
+# index active notifications in memory; None to only enable it when the cache is shared by all processes
+DF_NOTIFICATION_READ_WRITE_BEHIND = False
+# store notification reads in Redis and periodically write them to the database (requires Celery beat)
+DF_NOTIFICATION_READ_FLUSH_INTERVAL = 60  # in seconds
+DF_SIGNAL_SCHEDULER = False
+# store signals delayed by countdown or eta in Redis instead of Celery ETA tasks (requires Celery beat)
+DF_SIGNAL_SCHEDULER_INTERVAL = 1  # in seconds, delay between two checks of due signals
+DF_SIGNAL_SCHEDULER_BATCH_SIZE = 500  # max number of due signals fetched by a single Redis query
+DF_SIGNAL_CLAIM_CHECK_THRESHOLD = 0
+# in bytes, signal arguments larger than this are stored in Redis instead of Celery messages (0 to disable)
+DF_SIGNAL_CLAIM_CHECK_TTL = 3600  # in seconds, lifetime of these arguments after the due time of the signal
+DF_SIGNAL_BATCH_SIZE = 0
+# max number of server signals sent to the same Celery queue in a single task (0 to send one task per signal)
+DF_SIGNAL_BATCH_DELAY = 0.005  # in seconds, max time a server signal waits for other ones
+DF_SIGNAL_MANIFEST = None
+# path of the manifest written by "manage.py signals_manifest": modules defining signals are imported when required
 DF_DEFAULT_GROUPS = [_("Users")]
 DF_TEMPLATE_CONTEXT_PROCESSORS = []
 NPM_FILE_PATTERNS = {
@@ -23,6 +23,40 @@ The callable takes three arguments:
   * the :class:`djangofloor.window_info.WindowInfo` object,
   * the kwarg dict with unmodified arguments.
 
+Inline execution
+----------------
+
+Signals and functions are executed by Celery workers, on the queue given by the `queue` argument.
+Fast and non-blocking code can use the reserved `INLINE` queue name: when called by a client, it is then executed by
+a small thread pool of the websocket server with a timeout, without any round trip to the Celery broker. The result of
+a function is directly sent to the websocket. Inline signals called from Python code (in a view or in a Celery task)
+are processed by the default Celery queue.
+
+.. code-block:: python
+
+  from djangofloor.decorators import INLINE, everyone, function
+
+  @function(path='myproject.add', is_allowed_to=everyone, queue=INLINE)
+  def add(window_info, a: int=0, b: int=0):
+     return a + b
+
+Result memoization
+------------------
+
+Results of pure lookup functions can be stored in the Django cache for `cache_ttl` seconds.
+By default, cached results are shared by all users; the `cache_key` callable adds a fingerprint to the key of the
+cached result (like :meth:`djangofloor.decorators.cache_by_user` or :meth:`djangofloor.decorators.cache_by_perms`).
+It takes the same three arguments as the `is_allowed_to` callable.
+Cached results are directly sent back to the browser, without calling Celery.
+
+.. code-block:: python
+
+  from djangofloor.decorators import cache_by_perms, everyone, function
+
+  @function(path='myproject.countries', is_allowed_to=everyone, cache_ttl=300, cache_key=cache_by_perms)
+  def countries(window_info, prefix: str=''):
+     return [x.name for x in Country.objects.filter(name__startswith=prefix)]
+
 Argument validators
 -------------------
 
@@ -47,19 +81,26 @@ The registered Python code can use py3 annotation for specifying data types.
 
 
 """
+import hashlib
+import importlib
 import io
+import json
 import logging
 import mimetypes
 import os
 import random
 import re
+import sys
 import warnings
 
 from django import forms
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.forms import FileField
 from django.http import QueryDict
+from django.utils.module_loading import import_string
 
 from djangofloor.utils import RemovedInDjangoFloor200Warning
 
@@ -74,6 +115,9 @@ logger = logging.getLogger("djangofloor.signals")
 
 REGISTERED_SIGNALS = {}
 REGISTERED_FUNCTIONS = {}
+INLINE = "INLINE"
+# reserved queue name: the connection is executed by the process that receives the call
+# instead of a Celery worker (see :class:`djangofloor.tasks.InlineExecutor`)
 
 
 class DynamicQueueName:
@@ -210,6 +254,43 @@ class has_perm:
         return window_info and window_info.has_perm(self.perm)
 
 
+def cache_by_user(connection, window_info, kwargs):
+    """Cache a different result for each user (all anonymous users share the same result).
+
+    >>> @function(path='myproject.myfunc', cache_ttl=60, cache_key=cache_by_user)
+    >>> def my_function(window_info, arg1=None):
+    >>>     print(window_info, arg1)
+    """
+    return str(window_info and window_info.user_pk)
+
+
+def cache_by_perms(connection, window_info, kwargs):
+    """Cache a different result for each set of permissions (users with the same permissions share the same result).
+
+    >>> @function(path='myproject.myfunc', cache_ttl=60, cache_key=cache_by_perms)
+    >>> def my_function(window_info, arg1=None):
+    >>>     print(window_info, arg1)
+    """
+    if not window_info or not window_info.user_pk:
+        return "anonymous"
+    elif window_info.is_superuser:
+        return "superuser"
+    return ",".join(sorted(window_info.perms))
+
+
+def get_callable_identifier(obj):
+    """Return an identifier of a function or of a callable object, identical in all processes running the same code
+    (callable objects are identified by their class and their attributes)."""
+    if hasattr(obj, "__qualname__"):
+        return "%s.%s" % (getattr(obj, "__module__", None), obj.__qualname__)
+    cls = type(obj)
+    return "%s.%s%r" % (
+        cls.__module__,
+        cls.__qualname__,
+        sorted(getattr(obj, "__dict__", {}).items()),
+    )
+
+
 class Connection:
     """Parent class of a registered signal or remote function.
      Do not use it directly."""
@@ -234,6 +315,8 @@ class Connection:
         self.optional_arguments_names = set()
         self.accepted_argument_names = set()
         self.signature_check(fn)
+        self.validator = self.compile_validator()
+        self.module = getattr(fn, "__module__", None)
         # noinspection PyTypeChecker
         if hasattr(fn, "__name__"):
             self.__name__ = fn.__name__
@@ -273,41 +356,49 @@ class Connection:
             )
             raise ValueError(msg)
 
-    def check(self, kwargs):
-        """Check the provided kwargs and apply provided annotations to it.
-        Return `None` if something is invalid (like an error raised by an annotation or a missing argument).
-        """
+    def compile_validator(self):
+        """Build the function used by :meth:`check`, specialized with the results of :meth:`signature_check`:
+        argument names are checked with set operations and annotations are applied without any lookup."""
         cls = self.__class__.__name__
-        for k, v in self.argument_types.items():
-            try:
+        path = self.path
+        argument_types = tuple(self.argument_types.items())
+        required_names = frozenset(self.required_arguments_names)
+        accepted_names = (
+            None if self.accept_kwargs else frozenset(self.accepted_argument_names)
+        )
+
+        def validator(kwargs):
+            for k, v in argument_types:
                 if k in kwargs:
-                    kwargs[k] = v(kwargs[k])
-            except ValueError:
-                logger.warning(
-                    '%s("%s"): Invalid value %r for argument "%s".'
-                    % (cls, self.path, kwargs[k], k)
-                )
-                return None
-            except TypeError:
+                    try:
+                        kwargs[k] = v(kwargs[k])
+                    except (ValueError, TypeError):
+                        logger.warning(
+                            '%s("%s"): Invalid value %r for argument "%s".'
+                            % (cls, path, kwargs[k], k)
+                        )
+                        return None
+            if not required_names.issubset(kwargs):
                 logger.warning(
-                    '%s("%s"): Invalid value %r for argument "%s".'
-                    % (cls, self.path, kwargs[k], k)
+                    '%s("%s"): Missing required argument "%s".'
+                    % (cls, path, min(required_names.difference(kwargs)))
                 )
                 return None
-        for k in self.required_arguments_names:
-            if k not in kwargs:
+            if accepted_names is not None and not accepted_names.issuperset(kwargs):
                 logger.warning(
-                    '%s("%s"): Missing required argument "%s".' % (cls, self.path, k)
+                    '%s("%s"): Invalid argument "%s".'
+                    % (cls, path, min(kwargs.keys() - accepted_names))
                 )
                 return None
-        if not self.accept_kwargs:
-            for k in kwargs:
-                if k not in self.accepted_argument_names:
-                    logger.warning(
-                        '%s("%s"): Invalid argument "%s".' % (cls, self.path, k)
-                    )
-                    return None
-        return kwargs
+            return kwargs
+
+        return validator
+
+    def check(self, kwargs):
+        """Check the provided kwargs and apply provided annotations to it.
+        Return `None` if something is invalid (like an error raised by an annotation or a missing argument).
+        """
+        return self.validator(kwargs)
 
     def __call__(self, window_info, **kwargs):
         return self.function(window_info, **kwargs)
@@ -316,6 +407,28 @@ class Connection:
         """Register the Python code to the right dict."""
         raise NotImplementedError
 
+    def load(self):
+        """Return the actual connection (see :class:`DeferredConnection`)."""
+        return self
+
+    @property
+    def identifier(self):
+        """Identify the registered code and its permission check, independently of the registration order."""
+        return "%s:%s:%s" % (
+            self.module,
+            get_callable_identifier(self.function),
+            get_callable_identifier(self.is_allowed_to),
+        )
+
+    @staticmethod
+    def get_registering_module():
+        """Return the name of the module that registers the connection (outside this module)."""
+        # noinspection PyProtectedMember
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_globals.get("__name__") == __name__:
+            frame = frame.f_back
+        return frame.f_globals.get("__name__") if frame is not None else None
+
     def get_queue(self, window_info, original_kwargs):
         """Provide the Celery queue name as a string."""
         if callable(self.queue):
@@ -329,7 +442,26 @@ class SignalConnection(Connection):
 
     def register(self):
         """register the signal into the `REGISTERED_SIGNALS` dict """
-        REGISTERED_SIGNALS.setdefault(self.path, []).append(self)
+        self.module = self.get_registering_module() or self.module
+        connections = REGISTERED_SIGNALS.setdefault(self.path, [])
+        identifier = None
+        for index, connection in enumerate(connections):
+            # replace in place the first placeholder of this connection
+            if (
+                not isinstance(connection, DeferredConnection)
+                or connection.connection is not None
+            ):
+                continue
+            if connection.connection_identifier is not None:
+                identifier = identifier or self.identifier
+                if connection.connection_identifier != identifier:
+                    continue
+            elif connection.module != self.module:
+                continue
+            connection.connection = self
+            connections[index] = self
+            return
+        connections.append(self)
 
     def call(self, window_info, **kwargs):
         from djangofloor.tasks import call, SERVER
@@ -337,14 +469,223 @@ class SignalConnection(Connection):
         call(window_info, self.path, to=SERVER, kwargs=kwargs)
 
 
+class SignalDispatchEntry:
+    """Immutable dispatch data of a signal: its connections and their indices grouped by static queue
+    (connections with a callable queue are resolved on each call)."""
+
+    __slots__ = (
+        "connections",
+        "indices_by_queue",
+        "dynamic_indices",
+        "source",
+        "fingerprint",
+    )
+
+    def __init__(self, source):
+        self.source = source
+        self.connections = tuple(source)
+        # indices are only valid in processes with the same connections in the same order
+        self.fingerprint = hashlib.sha256(
+            "\n".join(x.identifier for x in self.connections).encode("utf-8")
+        ).hexdigest()[:32]
+        indices_by_queue = {}
+        dynamic_indices = []
+        for index, connection in enumerate(self.connections):
+            if callable(connection.queue):
+                dynamic_indices.append(index)
+            else:
+                queue = connection.get_queue(None, None)
+                indices_by_queue.setdefault(queue, []).append(index)
+        self.indices_by_queue = {k: tuple(v) for (k, v) in indices_by_queue.items()}
+        self.dynamic_indices = tuple(dynamic_indices)
+
+    def is_valid(self, source):
+        # connections can be replaced in place (see :class:`DeferredConnection`)
+        return source is self.source and tuple(source) == self.connections
+
+
+class SignalDispatchTable:
+    """Compiled view of `REGISTERED_SIGNALS`: each signal is compiled on its first call
+    and compiled again only when its connections are modified."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get_entry(self, signal_name):
+        source = REGISTERED_SIGNALS.get(signal_name)
+        if not source:
+            return None
+        entry = self.entries.get(signal_name)
+        if entry is None or not entry.is_valid(source):
+            entry = SignalDispatchEntry(source)
+            self.entries[signal_name] = entry
+        return entry
+
+    def resolve(self, signal_name, window_info, kwargs, from_client=False):
+        """Return a dict `{queue: [connection index, …]}` of the connections to call.
+        When the signal is called by a client, only allowed connections are returned."""
+        entry = self.get_entry(signal_name)
+        if entry is None:
+            return {}
+        indices_by_queue = {k: list(v) for (k, v) in entry.indices_by_queue.items()}
+        for index in entry.dynamic_indices:
+            queue = entry.connections[index].get_queue(window_info, kwargs)
+            indices_by_queue.setdefault(queue, []).append(index)
+        if entry.dynamic_indices:  # connections are called in their registration order
+            for indices in indices_by_queue.values():
+                indices.sort()
+        if from_client:
+            for queue, indices in list(indices_by_queue.items()):
+                indices = [
+                    x
+                    for x in indices
+                    if entry.connections[x].is_allowed_to(
+                        entry.connections[x], window_info, kwargs
+                    )
+                ]
+                if indices:
+                    indices_by_queue[queue] = indices
+                else:
+                    del indices_by_queue[queue]
+        return indices_by_queue
+
+    def get_fingerprint(self, signal_name):
+        """Return the fingerprint of the connections of a signal, to send with their indices."""
+        entry = self.get_entry(signal_name)
+        return None if entry is None else entry.fingerprint
+
+    def get_connections(self, signal_name, indices, fingerprint):
+        """Return the connections with the given indices, or `None` if these indices have been
+        resolved by a process with different connections (or in a different order)."""
+        entry = self.get_entry(signal_name)
+        if entry is None or fingerprint != entry.fingerprint:
+            return None
+        if any(not 0 <= x < len(entry.connections) for x in indices):
+            return None
+        return [entry.connections[x] for x in indices]
+
+
+signal_dispatch_table = SignalDispatchTable()
+
+
 class FunctionConnection(Connection):
     """represent a WS function """
 
+    def __init__(
+        self,
+        fn,
+        path=None,
+        is_allowed_to=server_side,
+        queue=None,
+        cache_ttl=None,
+        cache_key=None,
+    ):
+        super().__init__(fn, path=path, is_allowed_to=is_allowed_to, queue=queue)
+        self.cache_ttl = cache_ttl
+        self.cache_key = cache_key
+
+    def get_cache_key(self, window_info, kwargs):
+        """Return the Django cache key of the result, or `None` if the result cannot be cached.
+        `kwargs` must have been checked by :meth:`check` (so they are normalized by their annotations,
+        and equivalent calls share the same result), or be `None` if they are invalid."""
+        if not self.cache_ttl or kwargs is None:
+            return None
+        try:
+            serialized_kwargs = json.dumps(kwargs, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+        fingerprint = ""
+        if self.cache_key is not None:
+            fingerprint = self.cache_key(self, window_info, kwargs)
+        digest = hashlib.sha256(
+            ("%s\n%s" % (fingerprint, serialized_kwargs)).encode("utf-8")
+        ).hexdigest()
+        return "djangofloor.functions.%s.%s" % (self.path, digest)
+
+    @staticmethod
+    def get_cached_result(cache_key):
+        """Return `(True, result)` if the result is cached, `(False, None)` otherwise."""
+        if cache_key is None:
+            return False, None
+        cached = cache.get(cache_key)
+        if cached is None:
+            return False, None
+        return True, cached[0]
+
+    def set_cached_result(self, cache_key, result):
+        if cache_key is not None:
+            # wrapped in a tuple to also cache None
+            cache.set(cache_key, (result,), self.cache_ttl)
+
     def register(self):
         """register the WS function into the `REGISTERED_FUNCTIONS` dict """
+        self.module = self.get_registering_module() or self.module
+        connection = REGISTERED_FUNCTIONS.get(self.path)
+        if isinstance(connection, DeferredConnection):
+            connection.connection = self
         REGISTERED_FUNCTIONS[self.path] = self
 
 
+class DeferredConnection:
+    """Placeholder of a signal or function connection, read from the registry manifest
+    (see :meth:`djangofloor.tasks.load_registry_manifest`).
+
+    The static queue and the `is_allowed_to` callable are known without importing the module that registers the
+    connection. This module is only imported when another attribute is required (for example to call it): the
+    placeholder is then replaced in place by the actual connection, and delegates all calls to it.
+    """
+
+    def __init__(self, path, module, queue=None, is_allowed_to=None, identifier=None):
+        self.path = path
+        self.module = module
+        self.static_queue = queue
+        self.is_allowed_to_path = is_allowed_to
+        self.connection_identifier = identifier
+        self.connection = None
+
+    def load(self):
+        if self.connection is None:
+            importlib.import_module(self.module)
+        if self.connection is None:
+            raise ImproperlyConfigured(
+                "%s is not registered by %s, the manifest must be rebuilt"
+                % (self.path, self.module)
+            )
+        return self.connection
+
+    @property
+    def queue(self):
+        if self.static_queue is not None:
+            return self.static_queue
+        return self.load().queue
+
+    @property
+    def identifier(self):
+        if self.connection_identifier is not None:
+            return self.connection_identifier
+        return self.load().identifier
+
+    @property
+    def is_allowed_to(self):
+        if self.is_allowed_to_path is not None:
+            return import_string(self.is_allowed_to_path)
+        return self.load().is_allowed_to
+
+    def get_queue(self, window_info, original_kwargs):
+        if self.static_queue is not None:
+            return str(self.static_queue) or settings.CELERY_DEFAULT_QUEUE
+        return self.load().get_queue(window_info, original_kwargs)
+
+    def check(self, kwargs):
+        return self.load().check(kwargs)
+
+    def __call__(self, window_info, **kwargs):
+        return self.load()(window_info, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self.load(), item)
+
+
 class FormValidator(FunctionConnection):
     """Special signal, dedicated to dynamically validate a HTML form.
 
@@ -392,7 +733,14 @@ def signal(
 
 
 # noinspection PyShadowingBuiltins
-def function(fn=None, path=None, is_allowed_to=server_side, queue=None):
+def function(
+    fn=None,
+    path=None,
+    is_allowed_to=server_side,
+    queue=None,
+    cache_ttl=None,
+    cache_key=None,
+):
     """Allow the following Python code to be called from the JavaScript code.
 The result of this function is serialized (with JSON and `settings.WEBSOCKET_SIGNAL_ENCODER`) before being
 sent to the JavaScript part.
@@ -412,15 +760,26 @@ The this function can be called from your JavaScript code:
 
   $.dfws.myproject.myfunc({arg: 3123}).then(function(result) { alert(result); });
 
+The result can be stored in the Django cache during `cache_ttl` seconds, with an optional `cache_key`
+callable (see :meth:`djangofloor.decorators.cache_by_user`).
 
 """
-    return signal(
-        fn=fn,
-        path=path,
-        is_allowed_to=is_allowed_to,
-        queue=queue,
-        cls=FunctionConnection,
-    )
+
+    def wrapped(fn_):
+        wrapper = FunctionConnection(
+            fn=fn_,
+            path=path,
+            is_allowed_to=is_allowed_to,
+            queue=queue,
+            cache_ttl=cache_ttl,
+            cache_key=cache_key,
+        )
+        wrapper.register()
+        return fn_
+
+    if fn is not None:
+        wrapped = wrapped(fn)
+    return wrapped
 
 
 def validate_form(form_cls=None, path=None, is_allowed_to=server_side, queue=None):
@@ -0,0 +1,45 @@
+"""Write the manifest of the signals and functions registered by all Django apps.
+
+When `settings.DF_SIGNAL_MANIFEST` is an existing file, Celery workers and websocket servers read it instead of
+importing all `signals.py`, `forms.py` and `functions.py` modules: a module is only imported when one of its signals
+or functions is called.
+The manifest must be written again each time a signal or a function is added, removed or modified.
+"""
+import json
+from argparse import ArgumentParser
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from djangofloor.scripts import load_celery
+from djangofloor.tasks import get_registry_manifest, import_signal_modules
+
+__author__ = "Matthieu Gallet"
+
+
+class Command(BaseCommand):
+    help = "write the manifest of the registered signals and functions"
+
+    def add_arguments(self, parser):
+        assert isinstance(parser, ArgumentParser)
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="path of the manifest (default: settings.DF_SIGNAL_MANIFEST)",
+        )
+
+    def handle(self, *args, **options):
+        path = options["output"] or settings.DF_SIGNAL_MANIFEST
+        if not path:
+            raise CommandError(
+                "settings.DF_SIGNAL_MANIFEST is not set and --output is not provided"
+            )
+        load_celery()
+        import_signal_modules()
+        manifest = get_registry_manifest()
+        with open(path, "w", encoding="utf-8") as fd:
+            json.dump(manifest, fd, indent=2, sort_keys=True)
+        self.stdout.write(
+            "%d signals and %d functions written to %s"
+            % (len(manifest["signals"]), len(manifest["functions"]), path)
+        )
@@ -27,8 +27,15 @@ The class :class:`WindowInfoMiddleware` allows to:
 
 """
 import base64
+import hashlib
+import hmac
+import json
 import logging
+import threading
+import time
 import warnings
+import zlib
+from collections import OrderedDict
 
 from django.conf import settings
 from django.contrib import auth
@@ -48,7 +55,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.db.models import Q
 from django.http import HttpRequest
 from django.utils import translation
-from django.utils.crypto import get_random_string
+from django.utils.crypto import constant_time_compare, get_random_string
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.translation import get_language_from_request
 
@@ -59,18 +66,51 @@ __author__ = "Matthieu Gallet"
 logger = logging.getLogger("django.request")
 
 
-def sign_token(session_id, ws_token, user_pk=None, backend_path=None):
-    signer = signing.Signer(session_id)
+def get_token_signer(session_id):
+    """Return the signer used for websocket tokens.
+
+    When `settings.WEBSOCKET_SIGNED_TOPICS` is set, the token carries the list of topics, so it must be signed
+    with the secret key (the session id is only used as salt) and it expires like topics stored in Redis.
+    """
+    if settings.WEBSOCKET_SIGNED_TOPICS:
+        return signing.TimestampSigner(salt="djangofloor.websocket.%s" % session_id)
+    return signing.Signer(session_id)
+
+
+def sign_token(session_id, ws_token, user_pk=None, backend_path=None, topics=None):
+    """Sign the window key and the user id. If `topics` is not `None`, the list of (serialized) topics
+    is also stored in the token."""
+    signer = get_token_signer(session_id)
     data = "%s:%s" % (ws_token, user_pk)
+    if topics is not None:
+        encoded_topics = zlib.compress(json.dumps(list(topics)).encode("utf-8"))
+        data += ":%s" % signing.b64_encode(encoded_topics).decode("ascii")
     signed_token = signer.sign(data)
     return signed_token
 
 
 def unsign_token(session_id, signed_token):
-    signer = signing.Signer(session_id)
-    data = signer.unsign(signed_token)
-    window_key, __, user_pk = data.partition(":")
-    return window_key, user_pk, None
+    """Return the window key, the user id and the list of topics (`None` if topics are not stored in the token).
+
+    :raise: :class:`django.core.signing.BadSignature`
+    """
+    signer = get_token_signer(session_id)
+    if settings.WEBSOCKET_SIGNED_TOPICS:
+        # like topics stored in Redis, topics in the token expire
+        data = signer.unsign(signed_token, max_age=settings.WEBSOCKET_REDIS_EXPIRE)
+    else:
+        data = signer.unsign(signed_token)
+    window_key, __, data = data.partition(":")
+    user_pk, sep, encoded_topics = data.partition(":")
+    topics = None
+    if sep == ":":
+        try:
+            topics = json.loads(
+                zlib.decompress(signing.b64_decode(encoded_topics.encode("ascii")))
+            )
+        except (ValueError, zlib.error):
+            raise signing.BadSignature("Invalid topics in token")
+    return window_key, user_pk, topics
 
 
 def get_user_from_backend(user_id, backend_path):
@@ -85,6 +125,82 @@ def get_user_from_backend(user_id, backend_path):
     return user or AnonymousUser()
 
 
+def is_session_user(request, user):
+    """Return `True` if the session of the request is already authenticated with the given user."""
+    session = getattr(request, "session", None)
+    if session is None:
+        return False
+    if session.get(auth.SESSION_KEY) != user._meta.pk.value_to_string(user):
+        return False
+    return constant_time_compare(
+        session.get(auth.HASH_SESSION_KEY, ""), user.get_session_auth_hash()
+    )
+
+
+class BasicAuthCache:
+    """Bounded cache of verified HTTP basic credentials.
+
+    Entries are keyed by a HMAC (with `settings.SECRET_KEY`) of the `Authorization` header, so clear passwords
+    are never stored in memory. Each entry stores the user id, the authentication backend and the password hash
+    of the user: the entry is discarded as soon as the password of the user is modified.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(authorization):
+        return hmac.new(
+            settings.SECRET_KEY.encode("utf-8"),
+            authorization.encode("utf-8"),
+            hashlib.sha256,
+        ).hexdigest()
+
+    def get(self, authorization):
+        """Return the user matching the given `Authorization` header, or `None` if it is not cached (or invalid)."""
+        if settings.DF_HTTP_BASIC_AUTH_CACHE_TTL <= 0:
+            return None
+        key = self.get_key(authorization)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        user_pk, backend_path, password, __ = entry
+        user = get_user_from_backend(user_pk, backend_path)
+        if not user.is_authenticated or user.password != password:
+            with self.lock:
+                self.entries.pop(key, None)
+            return None
+        user.backend = backend_path
+        return user
+
+    def set(self, authorization, user):
+        """Store a user that has just been authenticated with the given `Authorization` header."""
+        ttl = settings.DF_HTTP_BASIC_AUTH_CACHE_TTL
+        backend_path = getattr(user, "backend", None)
+        if ttl <= 0 or backend_path is None:
+            return
+        key = self.get_key(authorization)
+        entry = (user.pk, backend_path, user.password, time.monotonic() + ttl)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.DF_HTTP_BASIC_AUTH_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+basic_auth_cache = BasicAuthCache()
+
+
 # noinspection PyClassHasNoInit
 class DjangoFloorMiddleware(BaseRemoteUserMiddleware):
     """Like :class:`django.contrib.auth.middleware.RemoteUserMiddleware` but:
@@ -120,13 +236,22 @@ class DjangoFloorMiddleware(BaseRemoteUserMiddleware):
             authentication = request.META["HTTP_AUTHORIZATION"]
             authmeth, sep, auth_data = authentication.partition(" ")
             if sep == " " and authmeth.lower() == "basic":
-                auth_data = base64.b64decode(auth_data.strip()).decode("utf-8")
-                username, sep, password = auth_data.partition(":")
-                if sep == ":":
-                    user = auth.authenticate(username=username, password=password)
+                user = basic_auth_cache.get(authentication)
+                if user:
+                    # credentials already verified: skip the password hasher,
+                    # and the session write if the session already belongs to this user
+                    request.user = user
+                    if not is_session_user(request, user):
+                        auth.login(request, user)
+                else:
+                    auth_data = base64.b64decode(auth_data.strip()).decode("utf-8")
+                    username, sep, password = auth_data.partition(":")
+                    if sep == ":":
+                        user = auth.authenticate(username=username, password=password)
                     if user:
                         request.user = user
                         auth.login(request, user)
+                        basic_auth_cache.set(authentication, user)
         # noinspection PyTypeChecker
         username = getattr(settings, "DF_FAKE_AUTHENTICATION_USERNAME", None)
         if username and settings.DEBUG:
@@ -194,6 +319,9 @@ class DjangoFloorMiddleware(BaseRemoteUserMiddleware):
 class WindowInfoMiddleware:
     """Base class for the WindowInfo middlewares."""
 
+    # names of the attributes set by this middleware, stored in slots by CompactWindowInfo
+    fields = ()
+
     def from_request(self, request, window_info):
         pass
 
@@ -217,6 +345,8 @@ class WindowKeyMiddleware(WindowInfoMiddleware):
     """handle the unique ID generated for each :class:`django.http.request.HttpRequest` and copy
     it to the :class:`WindowInfo` object"""
 
+    fields = ("window_key",)
+
     def from_request(self, request, window_info):
         # noinspection PyTypeChecker
         window_info.window_key = getattr(request, "window_key", None)
@@ -238,6 +368,22 @@ class WindowKeyMiddleware(WindowInfoMiddleware):
 class DjangoAuthMiddleware(WindowInfoMiddleware):
     """handle attributes related to the :mod:`django.contrib.auth` framework"""
 
+    fields = (
+        "_user",
+        "_perms",
+        "_template_perms",
+        "user_agent",
+        "csrf_cookie",
+        "user_pk",
+        "username",
+        "is_superuser",
+        "is_staff",
+        "is_active",
+        "user_set",
+        "is_authenticated",
+        "is_anonymous",
+    )
+
     def from_request(self, request, window_info):
         assert isinstance(request, HttpRequest)
         # auth and perms part
@@ -383,6 +529,8 @@ class DjangoAuthMiddleware(WindowInfoMiddleware):
 class BrowserMiddleware(WindowInfoMiddleware):
     """add attributes related to the browser (currently only the HTTP_USER_AGENT header)"""
 
+    fields = ("user_agent",)
+
     def from_request(self, request, window_info):
         window_info.user_agent = request.META.get("HTTP_USER_AGENT", "")
 
@@ -406,6 +554,8 @@ class BrowserMiddleware(WindowInfoMiddleware):
 class Djangoi18nMiddleware(WindowInfoMiddleware):
     """Add attributes required for using i18n-related functions."""
 
+    fields = ("language_code",)
+
     def from_request(self, request, window_info):
         # noinspection PyTypeChecker
         if getattr(request, "session", None):
@@ -7,17 +7,29 @@ Currently, only defines models for Notification:
     * NotificationRead, that tracks traces of read actions from users.
 
 Non-authenticated users uses sessions for tracking read actions.
+
+Currently active notifications are indexed in memory (see :class:`NotificationIndex`), so displaying a page
+does not require any SQL query when no notification targets the user.
 """
 import datetime
+import threading
+import uuid
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.contrib.sites.models import Site
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
 from django.db.models import F
 from django.db.models import Q
-from django.db.models.signals import pre_migrate, post_migrate
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_migrate,
+)
 from django.dispatch import receiver
 from django.template.defaultfilters import truncatewords
 from django.utils.timezone import utc
@@ -160,28 +172,29 @@ class Notification(models.Model):
     @classmethod
     def get_notifications(cls, request):
         now = datetime.datetime.now(tz=utc)
-        query = (
-            cls.objects.filter(is_active=True)
-            .filter(Q(not_before=None) | Q(not_before__lte=now))
-            .filter(Q(not_after=None) | Q(not_after__gte=now))
-        )
         if request.user.is_authenticated:
             user = request.user
-            query = query.filter(
-                Q(broadcast_mode=cls.ANY)
-                | Q(broadcast_mode=cls.AUTHENTICATED)
-                | Q(destination_users=user)
-                | Q(destination_groups__in=user.groups.all())
-            )
+            notifications = notification_index.get_notifications(now, user=user)
         else:
-            query = query.filter(broadcast_mode=cls.ANY)
-        notifications = list(query)
+            notifications = notification_index.get_notifications(now)
         if not notifications:
             return []
-        if request.user.is_authenticated:
+        write_behind = settings.DF_NOTIFICATION_READ_WRITE_BEHIND
+        if request.user.is_authenticated and write_behind:
+            return notification_read_buffer.get_user_notifications(
+                user, notifications
+            )
+        elif write_behind:
+            if not request.session.session_key:
+                # a single write to get a session key, next reads are only counted in Redis
+                request.session.create()
+            return notification_read_buffer.get_session_notifications(
+                request.session.session_key, notifications
+            )
+        elif request.user.is_authenticated:
             read_by_pk = {}
             for read in NotificationRead.objects.filter(
-                notification_id__in=[x.pk for x in notifications]
+                notification_id__in=[x.pk for x in notifications], user=user
             ):
                 read_by_pk[read.notification_id] = read
             result = []
@@ -237,6 +250,277 @@ class NotificationRead(models.Model):
     read_count = models.IntegerField(_("Read count"), default=1, db_index=True)
 
 
+class NotificationIndex:
+    """Per-process index of the currently active notifications, bucketed by broadcast mode, user and group.
+
+    The index is rebuilt when:
+
+      * a notification (or its destinations) is modified in any process: a version number is shared through the
+        Django cache (so the index is disabled when this cache is local to each process),
+      * a `not_before` or `not_after` date of an indexed notification is reached.
+    """
+
+    version_cache_key = "djangofloor.notifications.version"
+    # cache backends that cannot share the version between processes (or that do not keep it at all)
+    local_cache_backends = {
+        "django.core.cache.backends.locmem.LocMemCache",
+        "django.core.cache.backends.dummy.DummyCache",
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.expires = None
+        self.any = []
+        self.authenticated = []
+        self.by_user = {}
+        self.by_group = {}
+
+    @classmethod
+    def invalidate(cls):
+        cache.set(cls.version_cache_key, uuid.uuid4().hex, None)
+
+    @classmethod
+    def get_version(cls):
+        version = cache.get(cls.version_cache_key)
+        if version is None:
+            cache.add(cls.version_cache_key, uuid.uuid4().hex, None)
+            version = cache.get(cls.version_cache_key)
+        return version
+
+    @classmethod
+    def is_enabled(cls):
+        """The index requires a cache shared by all processes, unless `settings.DF_NOTIFICATION_INDEX` is set."""
+        if settings.DF_NOTIFICATION_INDEX is not None:
+            return settings.DF_NOTIFICATION_INDEX
+        return settings.CACHES["default"]["BACKEND"] not in cls.local_cache_backends
+
+    @staticmethod
+    def query_notifications(now, user=None):
+        """Return the active notifications from the database, when the index is disabled."""
+        query = (
+            Notification.objects.filter(is_active=True)
+            .filter(Q(not_before=None) | Q(not_before__lte=now))
+            .filter(Q(not_after=None) | Q(not_after__gte=now))
+        )
+        if user is None:
+            query = query.filter(broadcast_mode=Notification.ANY)
+        else:
+            query = query.filter(
+                Q(broadcast_mode=Notification.ANY)
+                | Q(broadcast_mode=Notification.AUTHENTICATED)
+                | Q(destination_users=user)
+                | Q(destination_groups__in=user.groups.all())
+            )
+        return list(query.distinct().order_by("pk"))
+
+    def get_notifications(self, now, user=None):
+        """Return the list of active notifications for the given user (anonymous if `None`),
+        ordered by primary key."""
+        if not self.is_enabled():
+            return self.query_notifications(now, user=user)
+        version = self.get_version()
+        with self.lock:
+            if (
+                version is None
+                or version != self.version
+                or (self.expires is not None and self.expires <= now)
+            ):
+                self.rebuild(now)
+                self.version = version
+            if user is None:
+                return list(self.any)
+            notifications = self.any + self.authenticated
+            notifications += self.by_user.get(user.pk, [])
+            by_group = self.by_group
+        if by_group:
+            for group_pk in user.groups.values_list("pk", flat=True):
+                notifications += by_group.get(group_pk, [])
+        notifications = {x.pk: x for x in notifications}
+        return [notifications[x] for x in sorted(notifications)]
+
+    def rebuild(self, now):
+        query = Notification.objects.filter(is_active=True).filter(
+            Q(not_after=None) | Q(not_after__gte=now)
+        )
+        self.expires = None
+        self.any = []
+        self.authenticated = []
+        self.by_user = {}
+        self.by_group = {}
+        selected_notifications = {}
+        for notification in query.order_by("pk"):
+            if notification.not_before and notification.not_before > now:
+                self.set_expiration(notification.not_before)
+                continue
+            if notification.not_after:
+                self.set_expiration(notification.not_after)
+            if notification.broadcast_mode == Notification.ANY:
+                self.any.append(notification)
+            elif notification.broadcast_mode == Notification.AUTHENTICATED:
+                self.authenticated.append(notification)
+            else:
+                selected_notifications[notification.pk] = notification
+        if not selected_notifications:
+            return
+        query = Notification.objects.filter(pk__in=selected_notifications)
+        for attr_name, bucket in (
+            ("destination_users", self.by_user),
+            ("destination_groups", self.by_group),
+        ):
+            for notification_pk, pk in query.filter(
+                **{"%s__isnull" % attr_name: False}
+            ).values_list("pk", attr_name):
+                bucket.setdefault(pk, []).append(selected_notifications[notification_pk])
+
+    def set_expiration(self, date):
+        if self.expires is None or date < self.expires:
+            self.expires = date
+
+
+notification_index = NotificationIndex()
+
+
+class NotificationReadBuffer:
+    """Write-behind storage of notification reads, used when `settings.DF_NOTIFICATION_READ_WRITE_BEHIND` is set.
+
+    Reads are counted in Redis hashes (on the websocket Redis database) instead of being written to the database
+    (or to the session of anonymous users) during the request. Reads of authenticated users are periodically
+    written to :class:`NotificationRead` by the :meth:`djangofloor.tasks.flush_notification_reads` Celery task.
+    """
+
+    @staticmethod
+    def get_connection():
+        from djangofloor.tasks import get_websocket_redis_connection
+
+        return get_websocket_redis_connection()
+
+    @staticmethod
+    def get_users_key():
+        return "%snotification-reads" % settings.WEBSOCKET_REDIS_PREFIX
+
+    @staticmethod
+    def get_session_key(session_key):
+        return "%snotification-reads-%s" % (settings.WEBSOCKET_REDIS_PREFIX, session_key)
+
+    @staticmethod
+    def select(notifications, read_counts):
+        return [
+            x
+            for x in notifications
+            if x.repeat_count == 0 or x.repeat_count > read_counts.get(x.pk, 0)
+        ]
+
+    def get_user_notifications(self, user, notifications):
+        """Return the notifications that must be displayed to this user and count them as read."""
+        read_counts = dict(
+            NotificationRead.objects.filter(
+                notification_id__in=[x.pk for x in notifications], user=user
+            ).values_list("notification_id", "read_count")
+        )
+        key = self.get_users_key()
+        fields = ["%s-%s" % (user.pk, x.pk) for x in notifications]
+        connection = self.get_connection()
+        for notification, count in zip(notifications, connection.hmget(key, fields)):
+            if count:
+                read_counts[notification.pk] = read_counts.get(
+                    notification.pk, 0
+                ) + int(count)
+        notifications = self.select(notifications, read_counts)
+        fields = ["%s-%s" % (user.pk, x.pk) for x in notifications if x.repeat_count]
+        if fields:
+            pipe = connection.pipeline(transaction=False)
+            for field in fields:
+                pipe.hincrby(key, field, 1)
+            pipe.execute()
+        return notifications
+
+    def get_session_notifications(self, session_key, notifications):
+        """Return the notifications that must be displayed to an anonymous user and count them as read."""
+        key = self.get_session_key(session_key)
+        connection = self.get_connection()
+        read_counts = {int(x): int(y) for (x, y) in connection.hgetall(key).items()}
+        notifications = self.select(notifications, read_counts)
+        fields = [x.pk for x in notifications if x.repeat_count]
+        if fields:
+            pipe = connection.pipeline(transaction=False)
+            for field in fields:
+                pipe.hincrby(key, field, 1)
+            pipe.expire(key, settings.SESSION_COOKIE_AGE)
+            pipe.execute()
+        return notifications
+
+    def flush(self):
+        """Write the reads of authenticated users to the database.
+
+        :return: the number of updated or created :class:`NotificationRead`
+        """
+        key = self.get_users_key()
+        pipe = self.get_connection().pipeline()
+        pipe.hgetall(key)
+        pipe.delete(key)
+        values, __ = pipe.execute()
+        counts = {}
+        for field, count in values.items():
+            user_pk, __, notification_pk = field.decode("utf-8").rpartition("-")
+            counts[(user_pk, int(notification_pk))] = int(count)
+        if not counts:
+            return 0
+        notification_pks = set(
+            Notification.objects.filter(pk__in={x[1] for x in counts}).values_list(
+                "pk", flat=True
+            )
+        )
+        user_pks = {
+            str(x)
+            for x in get_user_model()
+            .objects.filter(pk__in={x[0] for x in counts})
+            .values_list("pk", flat=True)
+        }
+        counts = {
+            x: y
+            for (x, y) in counts.items()
+            if x[0] in user_pks and x[1] in notification_pks
+        }
+        read_pks_by_count = {}
+        for read_pk, user_pk, notification_pk in NotificationRead.objects.filter(
+            notification_id__in=notification_pks, user_id__in=user_pks
+        ).values_list("pk", "user_id", "notification_id"):
+            count = counts.pop((str(user_pk), notification_pk), None)
+            if count:
+                read_pks_by_count.setdefault(count, []).append(read_pk)
+        now = datetime.datetime.now(tz=utc)
+        with transaction.atomic():
+            for count, read_pks in read_pks_by_count.items():
+                NotificationRead.objects.filter(pk__in=read_pks).update(
+                    read_count=F("read_count") + count, last_read_time=now
+                )
+            NotificationRead.objects.bulk_create(
+                [
+                    NotificationRead(
+                        user_id=user_pk, notification_id=notification_pk, read_count=y
+                    )
+                    for ((user_pk, notification_pk), y) in counts.items()
+                ]
+            )
+        return len(counts) + sum(len(x) for x in read_pks_by_count.values())
+
+
+notification_read_buffer = NotificationReadBuffer()
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+@receiver(m2m_changed, sender=Notification.destination_users.through)
+@receiver(m2m_changed, sender=Notification.destination_groups.through)
+def invalidate_notification_index(sender, **kwargs):
+    """Rebuild the index of active notifications in all processes."""
+    NotificationIndex.invalidate()
+    # other processes may have rebuilt their index before the end of the transaction
+    transaction.on_commit(NotificationIndex.invalidate)
+
+
 # noinspection PyUnusedLocal
 @receiver(pre_migrate)
 def apply_pre_migrate_settings(sender, **kwargs):
@@ -72,7 +72,14 @@ Here is the complete JavaScript API provided by DjangoFloor.
                 $.df._wsConnection.send(e.data);
             } else {
                 var msg = JSON.parse(e.data);
-                if (msg.signal && msg.signal_id) {
+                if (msg.signals) {
+                    for (var i = 0; i < msg.signals.length; i++) {
+                        if ($.df.debug) {
+                            console.debug('received grouped call ' + msg.signals[i].signal + ' from server.');
+                        }
+                        $.df.call(msg.signals[i].signal, msg.signals[i].opts, msg.signals[i].signal_id);
+                    }
+                } else if (msg.signal && msg.signal_id) {
                     if ($.df.debug) {
                         console.debug('received call ' + msg.signal + ' from server.');
                     }
@@ -6,34 +6,55 @@ Use these functions for:
 
   * setting websocket channels allowed for a given :class:`django.http.response.HttpResponse`,
   * calling signals, with a full function (:meth:`djangofloor.tasks.call`) and a
-    shortcut (:meth:`djangofloor.tasks.scall`)
+    shortcut (:meth:`djangofloor.tasks.scall`),
+  * grouping several signal calls into a single websocket message per topic
+    (:meth:`djangofloor.tasks.batch` and :meth:`djangofloor.tasks.call_many`),
+  * running signals and functions registered with `queue=INLINE` and called by the clients
+    without Celery (:class:`djangofloor.tasks.InlineExecutor`),
+  * scheduling delayed signals in Redis instead of Celery (:class:`djangofloor.tasks.DelayedSignalScheduler`),
+  * storing large signal arguments in Redis instead of Celery messages (:class:`djangofloor.tasks.PayloadStorage`),
+  * grouping calls to server signals in a single Celery task (:class:`djangofloor.tasks.ServerSignalBuffer`)
 
 """
 
+import atexit
+import datetime
+import hashlib
 import json
 import logging
 import os
+import sys
+import threading
+import time
 import uuid
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from functools import lru_cache
 
 from celery import shared_task
 from django.apps import apps
 from django.conf import settings
+from django.utils import timezone
 from django.utils.module_loading import import_string
 from redis import StrictRedis, ConnectionPool
 
 from djangofloor.decorators import (
+    INLINE,
     REGISTERED_SIGNALS,
     SignalConnection,
     REGISTERED_FUNCTIONS,
     FunctionConnection,
+    DeferredConnection,
     DynamicQueueName,
+    signal_dispatch_table,
 )
 from djangofloor.scripts import load_celery
 from djangofloor.utils import import_module, RemovedInDjangoFloor200Warning
 from djangofloor.wsgi.exceptions import NoWindowKeyException
-from djangofloor.wsgi.window_info import WindowInfo
+from djangofloor.wsgi.transports import get_transport
+from djangofloor.wsgi.window_info import WindowInfo, get_window_info_class
 
 __author__ = "Matthieu Gallet"
 logger = logging.getLogger("djangofloor.signals")
@@ -105,20 +126,27 @@ by the client.
     token = request.window_key
     request.has_websocket_topics = True
     prefix = settings.WEBSOCKET_REDIS_PREFIX
-    request = WindowInfo.from_request(request)
-    topic_strings = {_topic_serializer(request, x) for x in topics if x is not SERVER}
+    window_info = WindowInfo.from_request(request)
+    topic_strings = {
+        _topic_serializer(window_info, x) for x in topics if x is not SERVER
+    }
     # noinspection PyUnresolvedReferences,PyTypeChecker
-    if getattr(request, "user", None) and request.user.is_authenticated:
-        topic_strings.add(_topic_serializer(request, USER))
-    topic_strings.add(_topic_serializer(request, WINDOW))
-    topic_strings.add(_topic_serializer(request, BROADCAST))
-    connection = get_websocket_redis_connection()
-    redis_key = "%s%s" % (prefix, token)
-    connection.delete(redis_key)
-    for topic in topic_strings:
-        if topic is not None:
-            connection.rpush(redis_key, prefix + topic)
-    connection.expire(redis_key, settings.WEBSOCKET_REDIS_EXPIRE)
+    if getattr(window_info, "user", None) and window_info.user.is_authenticated:
+        topic_strings.add(_topic_serializer(window_info, USER))
+    topic_strings.add(_topic_serializer(window_info, WINDOW))
+    topic_strings.add(_topic_serializer(window_info, BROADCAST))
+    topic_strings.discard(None)
+    if settings.WEBSOCKET_SIGNED_TOPICS:
+        # topics will be stored in the signed token by the `df_init_websocket` template tag
+        request.websocket_topics = sorted(topic_strings)
+        return
+    # the window topic is rebuilt from the window key when the websocket connects
+    topic_strings.discard(_topic_serializer(window_info, WINDOW))
+    get_transport().set_topics(
+        token,
+        [prefix + x for x in sorted(topic_strings)],
+        settings.WEBSOCKET_REDIS_EXPIRE,
+    )
 
 
 def scall(window_info, signal_name, to=None, **kwargs):
@@ -176,6 +204,348 @@ def call(
     )
 
 
+class _SignalBatch(threading.local):
+    """Signals waiting to be sent to the websockets, grouped by topic"""
+
+    def __init__(self):
+        self.depth = 0
+        self.messages = None  # messages[serialized_topic] = [encoded_signal1, encoded_signal2, …]
+
+    def add(self, signal_name, signal_id, serialized_topics, kwargs):
+        serialized_message = json.dumps(
+            {"signal": signal_name, "opts": kwargs, "signal_id": signal_id},
+            cls=_signal_encoder,
+        )
+        for serialized_topic in serialized_topics:
+            self.messages.setdefault(serialized_topic, []).append(serialized_message)
+
+
+_signal_batch = _SignalBatch()
+
+
+@contextmanager
+def batch():
+    """Group all signals sent to websockets inside this context:
+    a single message is sent to each topic when the outermost context exits.
+    Signals sent to the server are not delayed.
+
+.. code-block:: python
+
+    from djangofloor.signals.html import add_class
+    from djangofloor.tasks import batch
+
+    def my_python_view(request):
+        with batch():
+            for i in range(100):
+                add_class(request, "#row-%d" % i, "active")
+
+    """
+    _signal_batch.depth += 1
+    if _signal_batch.depth == 1:
+        _signal_batch.messages = OrderedDict()
+    try:
+        yield
+    finally:
+        _signal_batch.depth -= 1
+        if _signal_batch.depth == 0:
+            messages, _signal_batch.messages = _signal_batch.messages, None
+            if messages:
+                _call_ws_signal_batch(messages)
+
+
+def call_many(window_info, signal_calls, to=None):
+    """Call several signals, sending a single websocket message per topic.
+
+    :param window_info: either a :class:`django.http.request.HttpRequest` or
+        a :class:`djangofloor.wsgi.window_info.WindowInfo`
+    :param signal_calls: iterable of `(signal_name, kwargs)` tuples
+    :param to: :class:`list` of the topics that should receive all these signals
+    """
+    window_info = WindowInfo.from_request(window_info)
+    with batch():
+        for signal_name, kwargs in signal_calls:
+            _call_signal(
+                window_info, signal_name, to=to, kwargs=kwargs, from_client=False
+            )
+
+
+class InlineExecutor:
+    """Run the signals and functions registered with `queue=INLINE` in a bounded thread pool of the current process.
+
+    The caller waits at most `settings.WEBSOCKET_INLINE_TIMEOUT` seconds for the result.
+    Python threads cannot be interrupted, so a call that exceeds this timeout still keeps its thread until it ends.
+    Inline calls made by an inline call are directly executed by the current thread, avoiding a deadlock
+    when all threads are busy.
+    """
+
+    def __init__(self, max_workers=None, timeout=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers
+                        or settings.WEBSOCKET_INLINE_THREADS,
+                        thread_name_prefix="df-inline",
+                    )
+        return self._executor
+
+    def execute(self, fn, *args):
+        self._local.running = True
+        try:
+            return fn(*args)
+        finally:
+            self._local.running = False
+
+    def run(self, fn, *args):
+        """Return the result of `fn(*args)`, or raise :class:`concurrent.futures.TimeoutError`."""
+        if getattr(self._local, "running", False):
+            return fn(*args)
+        future = self.get_executor().submit(self.execute, fn, *args)
+        return future.result(timeout=self.timeout or settings.WEBSOCKET_INLINE_TIMEOUT)
+
+
+inline_executor = InlineExecutor()
+
+
+class DelayedSignalScheduler:
+    """Store the signals delayed by `countdown` or `eta` in a Redis sorted set, scored by their due timestamp,
+    instead of sending Celery ETA tasks (only used when `settings.DF_SIGNAL_SCHEDULER` is set).
+
+    Celery workers prefetch ETA tasks and keep them in memory until they are due. Here, due signals are sent to
+    their Celery queue by batches by the :meth:`djangofloor.tasks.promote_delayed_signals` periodic task,
+    so workers never hold scheduled signals.
+    """
+
+    @staticmethod
+    def get_connection():
+        return get_websocket_redis_connection()
+
+    @staticmethod
+    def get_key():
+        return "%sdelayed-signals" % settings.WEBSOCKET_REDIS_PREFIX
+
+    @staticmethod
+    def get_timestamp(value, now):
+        """Convert a Celery `eta` or `expires` argument to a timestamp:
+        datetimes are absolute and numbers are relative to `now` (in seconds)."""
+        if isinstance(value, datetime.datetime):
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value, datetime.timezone.utc)
+            return value.timestamp()
+        return now + float(value)
+
+    def get_due_timestamp(self, now, countdown=None, eta=None):
+        if countdown:
+            return now + float(countdown)
+        elif isinstance(eta, datetime.datetime):
+            return self.get_timestamp(eta, now)
+        elif eta:
+            return float(eta)
+        return now
+
+    def add(self, args, queue, countdown=None, eta=None, expires=None):
+        """Schedule a call to :meth:`djangofloor.tasks._server_signal_call` on the given Celery queue."""
+        now = time.time()
+        due = self.get_due_timestamp(now, countdown=countdown, eta=eta)
+        entry = {
+            "id": str(uuid.uuid4()),
+            "args": args,
+            "queue": queue,
+            "expires": self.get_timestamp(expires, now) if expires else None,
+        }
+        self.get_connection().zadd(
+            self.get_key(), {json.dumps(entry, cls=_signal_encoder): due}
+        )
+
+    def promote(self, batch_size=None):
+        """Send all due signals to Celery and return their number."""
+        batch_size = batch_size or settings.DF_SIGNAL_SCHEDULER_BATCH_SIZE
+        connection = self.get_connection()
+        key = self.get_key()
+        promoted = 0
+        while True:
+            now = time.time()
+            entries = connection.zrangebyscore(
+                key, "-inf", now, start=0, num=batch_size
+            )
+            if not entries:
+                break
+            pipe = connection.pipeline(transaction=False)
+            for entry in entries:
+                pipe.zrem(key, entry)
+            removed = pipe.execute()
+            with _server_signal_call.app.producer_or_acquire() as producer:
+                for entry, is_removed in zip(entries, removed):
+                    if not is_removed:  # already promoted by another process
+                        continue
+                    values = json.loads(entry.decode("utf-8"))
+                    celery_kwargs = {}
+                    if values["expires"] is not None:
+                        if values["expires"] < now:
+                            continue
+                        celery_kwargs["expires"] = datetime.datetime.fromtimestamp(
+                            values["expires"], tz=datetime.timezone.utc
+                        )
+                    _server_signal_call.apply_async(
+                        values["args"],
+                        queue=values["queue"],
+                        producer=producer,
+                        **celery_kwargs,
+                    )
+                    promoted += 1
+            if len(entries) < batch_size:
+                break
+        return promoted
+
+
+delayed_signal_scheduler = DelayedSignalScheduler()
+
+
+class PayloadStorage:
+    """Claim-check storage of the large arguments of signals sent to Celery.
+
+    When its JSON serialization is larger than `settings.DF_SIGNAL_CLAIM_CHECK_THRESHOLD` bytes, a value is stored
+    once in Redis under its SHA-256 hash (for `settings.DF_SIGNAL_CLAIM_CHECK_TTL` seconds after its due time)
+    and only a reference is sent to each Celery queue. The value is loaded by the worker that processes the signal.
+
+    Stored values are always dicts (keyword arguments or window info), so a reference is a list that cannot be
+    mistaken for a value.
+    """
+
+    reference_key = "df_claim_check"
+    # store the value if required, but never shorten its expiration time since the same value may have been stored
+    # for a later signal (EXPIRE GT requires Redis 7)
+    store_script = """
+redis.call("SET", KEYS[1], ARGV[1], "NX")
+if redis.call("TTL", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+"""
+
+    @staticmethod
+    def get_connection():
+        return get_websocket_redis_connection()
+
+    @staticmethod
+    def get_key(digest):
+        return "%spayload-%s" % (settings.WEBSOCKET_REDIS_PREFIX, digest)
+
+    def store(self, value, countdown=None, eta=None):
+        """Return the value itself, or a reference to the stored value if it is too large."""
+        threshold = settings.DF_SIGNAL_CLAIM_CHECK_THRESHOLD
+        if not threshold or value is None:
+            return value
+        serialized_value = json.dumps(value, cls=_signal_encoder)
+        encoded_value = serialized_value.encode("utf-8")
+        if len(encoded_value) < threshold:
+            return value
+        digest = hashlib.sha256(encoded_value).hexdigest()
+        now = time.time()
+        delay = delayed_signal_scheduler.get_due_timestamp(
+            now, countdown=countdown, eta=eta
+        )
+        ttl = settings.DF_SIGNAL_CLAIM_CHECK_TTL + max(0, int(delay - now))
+        self.get_connection().eval(
+            self.store_script, 1, self.get_key(digest), serialized_value, ttl
+        )
+        return [self.reference_key, digest]
+
+    def is_reference(self, value):
+        return (
+            isinstance(value, list)
+            and len(value) == 2
+            and value[0] == self.reference_key
+        )
+
+    def load(self, value):
+        """Return the stored value if `value` is a reference, otherwise `value` itself."""
+        if not self.is_reference(value):
+            return value
+        serialized_value = self.get_connection().get(self.get_key(value[1]))
+        if serialized_value is None:
+            raise ValueError("Signal payload %s has expired" % value[1])
+        return json.loads(serialized_value.decode("utf-8"))
+
+
+payload_storage = PayloadStorage()
+
+
+class ServerSignalBuffer:
+    """Group the calls to server signals by Celery queue (only used when `settings.DF_SIGNAL_BATCH_SIZE` is set).
+
+    Waiting calls to a queue are sent as a single :meth:`djangofloor.tasks._server_signal_call_batch` task
+    as soon as `settings.DF_SIGNAL_BATCH_SIZE` calls are waiting for this queue,
+    or `settings.DF_SIGNAL_BATCH_DELAY` seconds after the first waiting call.
+    Delayed signals are never buffered.
+    """
+
+    def __init__(self):
+        self.calls_by_queue = {}
+        self._condition = threading.Condition()
+        self._deadline = None
+        self._thread = None
+
+    def add(self, args, queue):
+        """Buffer a call to :meth:`djangofloor.tasks._server_signal_call` on the given Celery queue."""
+        calls = None
+        with self._condition:
+            self.calls_by_queue.setdefault(queue, []).append(args)
+            if len(self.calls_by_queue[queue]) >= settings.DF_SIGNAL_BATCH_SIZE:
+                calls = self.calls_by_queue.pop(queue)
+            elif self._deadline is None:
+                self._deadline = time.monotonic() + settings.DF_SIGNAL_BATCH_DELAY
+                self._condition.notify()
+            # the flusher thread is started on first use (it does not survive a fork)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.run, name="df-signal-buffer", daemon=True
+                )
+                self._thread.start()
+        if calls:
+            self.send(queue, calls)
+
+    def run(self):
+        """Send the waiting calls at the end of each batching window (run by a single daemon thread)."""
+        while True:
+            with self._condition:
+                while self._deadline is None:
+                    self._condition.wait()
+                delay = self._deadline - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+    def flush(self):
+        """Send all waiting calls."""
+        with self._condition:
+            calls_by_queue, self.calls_by_queue = self.calls_by_queue, {}
+            self._deadline = None
+        for queue, calls in calls_by_queue.items():
+            self.send(queue, calls)
+
+    @staticmethod
+    def send(queue, calls):
+        if len(calls) == 1:
+            _server_signal_call.apply_async(calls[0], queue=queue)
+        else:
+            _server_signal_call_batch.apply_async([calls], queue=queue)
+
+
+server_signal_buffer = ServerSignalBuffer()
+atexit.register(server_signal_buffer.flush)
+
+
 def _call_signal(
     window_info,
     signal_name,
@@ -222,13 +592,26 @@ def _call_signal(
         celery_kwargs["eta"] = eta
     if countdown:
         celery_kwargs["countdown"] = countdown
-    queues = {
-        x.get_queue(window_info, kwargs)
-        for x in REGISTERED_SIGNALS.get(signal_name, [])
-    }
+    # indices of the connections to call, resolved only once and sent to the workers
+    indices_by_queue, fingerprint = {}, None
+    if to_server:
+        indices_by_queue = signal_dispatch_table.resolve(
+            signal_name, window_info, kwargs, from_client=from_client
+        )
+        fingerprint = signal_dispatch_table.get_fingerprint(signal_name)
+    queues = set(indices_by_queue)
+    # inline signals are only run by the websocket server, other callers use Celery
+    inline_queues = queues & {INLINE} if from_client else set()
     window_info_as_dict = None
     if window_info:
         window_info_as_dict = window_info.to_dict()
+    # arguments of Celery tasks, large ones being stored only once for all queues
+    task_kwargs, task_window_info_as_dict = kwargs, window_info_as_dict
+    if celery_kwargs or (to_server and queues - inline_queues):
+        task_kwargs = payload_storage.store(kwargs, countdown=countdown, eta=eta)
+        task_window_info_as_dict = payload_storage.store(
+            window_info_as_dict, countdown=countdown, eta=eta
+        )
     if celery_kwargs:
         if serialized_client_topics:
             queues.add(settings.CELERY_DEFAULT_QUEUE)
@@ -238,24 +621,32 @@ def _call_signal(
                 if queue == settings.CELERY_DEFAULT_QUEUE
                 else []
             )
-            _server_signal_call.apply_async(
-                [
-                    signal_name,
-                    window_info_as_dict,
-                    kwargs,
-                    from_client,
-                    topics,
-                    to_server,
-                    queue,
-                ],
-                queue=queue,
-                **celery_kwargs,
-            )
+            args = [
+                signal_name,
+                task_window_info_as_dict,
+                task_kwargs,
+                from_client,
+                topics,
+                to_server,
+                queue,
+                indices_by_queue.get(queue, []),
+                fingerprint,
+            ]
+            # delayed inline signals are processed by the default Celery queue
+            celery_queue = settings.CELERY_DEFAULT_QUEUE if queue == INLINE else queue
+            if settings.DF_SIGNAL_SCHEDULER and (countdown or eta):
+                delayed_signal_scheduler.add(
+                    args, celery_queue, countdown=countdown, eta=eta, expires=expires
+                )
+            else:
+                _server_signal_call.apply_async(
+                    args, queue=celery_queue, **celery_kwargs
+                )
     else:
         if to_server:
             for queue in queues:
-                _server_signal_call.apply_async(
-                    [
+                if queue in inline_queues:
+                    args = [
                         signal_name,
                         window_info_as_dict,
                         kwargs,
@@ -263,46 +654,163 @@ def _call_signal(
                         [],
                         to_server,
                         queue,
-                    ],
-                    queue=queue,
-                )
-        if serialized_client_topics:
+                        indices_by_queue[queue],
+                        fingerprint,
+                    ]
+                    _call_inline_signal(args)
+                else:
+                    args = [
+                        signal_name,
+                        task_window_info_as_dict,
+                        task_kwargs,
+                        from_client,
+                        [],
+                        to_server,
+                        queue,
+                        indices_by_queue[queue],
+                        fingerprint,
+                    ]
+                    celery_queue = (
+                        settings.CELERY_DEFAULT_QUEUE if queue == INLINE else queue
+                    )
+                    if settings.DF_SIGNAL_BATCH_SIZE:
+                        server_signal_buffer.add(args, celery_queue)
+                    else:
+                        _server_signal_call.apply_async(args, queue=celery_queue)
+        if serialized_client_topics and _signal_batch.depth:
             signal_id = str(uuid.uuid4())
-            for topic in serialized_client_topics:
-                _call_ws_signal(signal_name, signal_id, topic, kwargs)
+            _signal_batch.add(signal_name, signal_id, serialized_client_topics, kwargs)
+        elif serialized_client_topics:
+            signal_id = str(uuid.uuid4())
+            _call_ws_signal(signal_name, signal_id, serialized_client_topics, kwargs)
+
+
+def _call_inline_signal(args):
+    try:
+        inline_executor.run(_server_signal_call, *args)
+    except FutureTimeoutError:
+        logger.warning('Inline signal "%s" did not complete in time' % args[0])
+
 
+def _call_function(window_info, function_name, result_id, kwargs, reply=None):
+    """Call a function registered by :meth:`djangofloor.decorators.function` on behalf of a client.
 
-def _call_ws_signal(signal_name, signal_id, serialized_topic, kwargs):
-    connection = get_websocket_redis_connection()
+    Functions registered with `queue=INLINE` and cached results are directly sent to `reply`
+    (if provided) instead of being published to the window.
+    """
+    connection = REGISTERED_FUNCTIONS[function_name]
+    checked, checked_kwargs, cache_key = False, None, None
+    if connection.cache_ttl and connection.is_allowed_to(
+        connection, window_info, kwargs
+    ):
+        checked, checked_kwargs = True, connection.check(kwargs)
+        cache_key = connection.get_cache_key(window_info, checked_kwargs)
+        is_cached, result = connection.get_cached_result(cache_key)
+        if is_cached:
+            _return_ws_function_result(window_info, result_id, result, reply=reply)
+            return
+    queue = connection.get_queue(window_info, kwargs)
+    # arguments are checked only once, but checked arguments are only sent to Celery
+    # if they can be serialized in JSON (as shown by their cache key), or if they are invalid (`None`)
+    checked = checked and (
+        queue == INLINE or cache_key is not None or checked_kwargs is None
+    )
+    task_kwargs = checked_kwargs if checked else kwargs
+    if queue != INLINE:
+        _server_function_call.apply_async(
+            [function_name, window_info.to_dict(), result_id, task_kwargs, checked],
+            queue=queue,
+        )
+        return
+    window_info = get_window_info_class().from_dict(window_info.to_dict())
+    try:
+        result, exception = inline_executor.run(
+            _execute_function, window_info, function_name, task_kwargs, checked
+        )
+    except FutureTimeoutError:
+        result, exception = (
+            None,
+            "Inline function %s did not complete in time" % function_name,
+        )
+        logger.warning(exception)
+    _return_ws_function_result(
+        window_info, result_id, result, exception=exception, reply=reply
+    )
+
+
+def _call_ws_signal(signal_name, signal_id, serialized_topics, kwargs):
+    """Send a signal to all the given topics. The message is serialized only once and
+    all messages are sent at once by the transport."""
     serialized_message = json.dumps(
         {"signal": signal_name, "opts": kwargs, "signal_id": signal_id},
         cls=_signal_encoder,
-    )
-    topic = settings.WEBSOCKET_REDIS_PREFIX + serialized_topic
-    logger.debug("send message to topic %r" % topic)
-    connection.publish(topic, serialized_message.encode("utf-8"))
+    ).encode("utf-8")
+    messages = []
+    for serialized_topic in serialized_topics:
+        topic = settings.WEBSOCKET_REDIS_PREFIX + serialized_topic
+        logger.debug("send message to topic %r" % topic)
+        messages.append((topic, serialized_message))
+    get_transport().publish_many(messages)
+
+
+def _call_ws_signal_batch(messages):
+    """Send grouped signals (encoded by :class:`_SignalBatch`) to their topics, all at once."""
+    grouped_messages = []
+    for serialized_topic, serialized_messages in messages.items():
+        topic = settings.WEBSOCKET_REDIS_PREFIX + serialized_topic
+        logger.debug(
+            "send %d grouped messages to topic %r" % (len(serialized_messages), topic)
+        )
+        serialized_message = '{"signals": [%s]}' % ", ".join(serialized_messages)
+        grouped_messages.append((topic, serialized_message.encode("utf-8")))
+    get_transport().publish_many(grouped_messages)
 
 
-def _return_ws_function_result(window_info, result_id, result, exception=None):
-    connection = get_websocket_redis_connection()
+def _return_ws_function_result(
+    window_info, result_id, result, exception=None, reply=None
+):
     json_msg = {
         "result_id": result_id,
         "result": result,
         "exception": str(exception) if exception else None,
     }
     serialized_message = json.dumps(json_msg, cls=_signal_encoder)
+    if reply is not None:
+        reply(serialized_message)
+        return
     serialized_topic = _topic_serializer(window_info, WINDOW)
     if serialized_topic:
         topic = settings.WEBSOCKET_REDIS_PREFIX + serialized_topic
         logger.debug("send function result to topic %r" % topic)
-        connection.publish(topic, serialized_message.encode("utf-8"))
+        get_transport().publish_many([(topic, serialized_message.encode("utf-8"))])
 
 
 @lru_cache()
 def import_signals_and_functions():
     """Import all `signals.py`, 'forms.py' and `functions.py` files to register signals and WS functions
 (tries these files for all Django apps).
+
+If `settings.DF_SIGNAL_MANIFEST` is an existing file, signals and functions are read from this manifest instead
+(see :meth:`load_registry_manifest`).
     """
+    load_celery()
+    manifest_path = settings.DF_SIGNAL_MANIFEST
+    if manifest_path and os.path.isfile(manifest_path):
+        with open(manifest_path, encoding="utf-8") as fd:
+            load_registry_manifest(json.load(fd))
+    else:
+        import_signal_modules()
+    logger.debug(
+        "Found signals: %s"
+        % ", ".join(["%s (%d)" % (k, len(v)) for (k, v) in REGISTERED_SIGNALS.items()])
+    )
+    logger.debug(
+        "Found functions: %s" % ", ".join([str(k) for k in REGISTERED_FUNCTIONS])
+    )
+
+
+def import_signal_modules():
+    """Import the modules that define signals and functions in all Django apps."""
 
     def try_import(module):
         try:
@@ -315,7 +823,6 @@ def import_signals_and_functions():
         except Exception as e:
             logger.exception(e)
 
-    load_celery()
     for app_config in apps.app_configs.values():
         app = app_config.name
         package_dir = app_config.path
@@ -326,13 +833,99 @@ def import_signals_and_functions():
                 for f in os.listdir(os.path.join(package_dir, module_name)):
                     f = os.path.splitext(f)[0]
                     try_import("%s.%s.%s" % (app, module_name, f))
-    logger.debug(
-        "Found signals: %s"
-        % ", ".join(["%s (%d)" % (k, len(v)) for (k, v) in REGISTERED_SIGNALS.items()])
-    )
-    logger.debug(
-        "Found functions: %s" % ", ".join([str(k) for k in REGISTERED_FUNCTIONS])
-    )
+
+
+def get_registry_manifest():
+    """Describe all registered signals and functions (written by the `signals_manifest` command).
+
+    For each connection, the manifest stores the module that registers it, its identifier
+    (see :attr:`djangofloor.decorators.Connection.identifier`), its queue (`None` if dynamic),
+    the dotted path of its `is_allowed_to` callable (`None` if it cannot be imported) and its arguments.
+    """
+
+    def describe(connection):
+        connection = connection.load()
+        is_allowed_to = connection.is_allowed_to
+        is_allowed_to_path = "%s.%s" % (
+            getattr(is_allowed_to, "__module__", None),
+            getattr(is_allowed_to, "__qualname__", None),
+        )
+        try:
+            if import_string(is_allowed_to_path) is not is_allowed_to:
+                is_allowed_to_path = None
+        except ImportError:
+            is_allowed_to_path = None
+        return {
+            "module": connection.module,
+            "identifier": connection.identifier,
+            "queue": None if callable(connection.queue) else str(connection.queue),
+            "is_allowed_to": is_allowed_to_path,
+            "required_arguments": sorted(connection.required_arguments_names),
+            "optional_arguments": sorted(connection.optional_arguments_names),
+            "accept_kwargs": connection.accept_kwargs,
+        }
+
+    return {
+        "signals": {
+            name: [describe(x) for x in connections]
+            for (name, connections) in sorted(REGISTERED_SIGNALS.items())
+        },
+        "functions": {
+            name: describe(connection)
+            for (name, connection) in sorted(REGISTERED_FUNCTIONS.items())
+        },
+    }
+
+
+def load_registry_manifest(manifest):
+    """Register a :class:`djangofloor.decorators.DeferredConnection` for each connection of the manifest,
+    so the modules that define signals and functions are only imported when one of their connections is called.
+
+    Connections of already imported modules are already registered: they take the place of their placeholder,
+    so the connections of each signal are in the manifest order in all processes, whatever was imported before.
+    """
+    for name, descriptions in manifest["signals"].items():
+        registered = list(REGISTERED_SIGNALS.get(name, []))
+        connections = []
+        for description in descriptions:
+            identifier = description.get("identifier")
+            for index, connection in enumerate(registered):
+                if identifier is None:
+                    matches = connection.module == description["module"]
+                else:
+                    matches = connection.identifier == identifier
+                if matches:
+                    connections.append(registered.pop(index))
+                    break
+            else:
+                if description["module"] in sys.modules:
+                    # this module does not register this connection anymore
+                    continue
+                connections.append(
+                    DeferredConnection(
+                        name,
+                        description["module"],
+                        queue=description["queue"],
+                        is_allowed_to=description["is_allowed_to"],
+                        identifier=identifier,
+                    )
+                )
+        # connections that are missing from the manifest
+        connections += registered
+        REGISTERED_SIGNALS[name] = connections
+    for name, description in manifest["functions"].items():
+        if description["module"] in sys.modules:
+            continue
+        REGISTERED_FUNCTIONS.setdefault(
+            name,
+            DeferredConnection(
+                name,
+                description["module"],
+                queue=description["queue"],
+                is_allowed_to=description["is_allowed_to"],
+                identifier=description.get("identifier"),
+            ),
+        )
 
 
 @shared_task(serializer="json", bind=True)
@@ -345,30 +938,85 @@ def _server_signal_call(
     serialized_client_topics=None,
     to_server=False,
     queue=None,
+    connection_indices=None,
+    registry_fingerprint=None,
 ):
+    _process_signal_call(
+        self.request,
+        signal_name,
+        window_info_dict,
+        kwargs=kwargs,
+        from_client=from_client,
+        serialized_client_topics=serialized_client_topics,
+        to_server=to_server,
+        queue=queue,
+        connection_indices=connection_indices,
+        registry_fingerprint=registry_fingerprint,
+    )
+
+
+@shared_task(serializer="json", bind=True)
+def _server_signal_call_batch(self, calls):
+    """Process a list of :meth:`_server_signal_call` arguments sent to the same queue.
+    An error raised by a call does not prevent the next ones."""
+    logger.info("Batch of %d signals received." % len(calls))
+    for args in calls:
+        _process_signal_call(self.request, *args)
+
+
+def _process_signal_call(
+    celery_request,
+    signal_name,
+    window_info_dict,
+    kwargs=None,
+    from_client=False,
+    serialized_client_topics=None,
+    to_server=False,
+    queue=None,
+    connection_indices=None,
+    registry_fingerprint=None,
+):
+    """Process a signal sent to a Celery queue. `connection_indices` are the indices of the connections
+    (in `REGISTERED_SIGNALS[signal_name]`) resolved by :meth:`djangofloor.tasks._call_signal`.
+    They are only used if `registry_fingerprint` matches the connections of this process;
+    otherwise, the connections are filtered by queue and permission."""
     logger.info(
         'Signal "%s" called on queue "%s" to topics %s (from client?: %s, to server?: %s)'
         % (signal_name, queue, serialized_client_topics, from_client, to_server)
     )
     try:
+        kwargs = payload_storage.load(kwargs)
+        window_info_dict = payload_storage.load(window_info_dict)
         if kwargs is None:
             kwargs = {}
         if serialized_client_topics:
             signal_id = str(uuid.uuid4())
-            for topic in serialized_client_topics:
-                _call_ws_signal(signal_name, signal_id, topic, kwargs)
-        window_info = WindowInfo.from_dict(window_info_dict)
+            _call_ws_signal(signal_name, signal_id, serialized_client_topics, kwargs)
+        window_info = get_window_info_class().from_dict(window_info_dict)
         import_signals_and_functions()
-        window_info.celery_request = self.request
+        window_info.celery_request = celery_request
         if not to_server or signal_name not in REGISTERED_SIGNALS:
             return
-        for connection in REGISTERED_SIGNALS[signal_name]:
+        connections = None
+        if connection_indices is not None:
+            connections = signal_dispatch_table.get_connections(
+                signal_name, connection_indices, registry_fingerprint
+            )
+            if connections is None:
+                logger.info(
+                    'Connections of signal "%s" differ from the caller ones.'
+                    % signal_name
+                )
+        if connections is None:
+            connections = [
+                x
+                for x in REGISTERED_SIGNALS[signal_name]
+                if x.get_queue(window_info, kwargs) == queue
+                and (not from_client or x.is_allowed_to(x, window_info, kwargs))
+            ]
+        for connection in connections:
+            connection = connection.load()
             assert isinstance(connection, SignalConnection)
-            if connection.get_queue(window_info, kwargs) != queue or (
-                from_client
-                and not connection.is_allowed_to(connection, window_info, kwargs)
-            ):
-                continue
             new_kwargs = connection.check(kwargs)
             if new_kwargs is None:
                 continue
@@ -392,29 +1040,47 @@ def _server_signal_call(
 
 @shared_task(serializer="json", bind=True)
 def _server_function_call(
-    self, function_name, window_info_dict, result_id, kwargs=None
+    self, function_name, window_info_dict, result_id, kwargs=None, checked=False
 ):
     logger.info("Function %s called from client." % function_name)
-    e, result, window_info = None, None, None
+    window_info = get_window_info_class().from_dict(window_info_dict)
+    if not window_info:
+        return
+    window_info.celery_request = self.request
+    result, exception = _execute_function(
+        window_info, function_name, kwargs, checked=checked
+    )
+    _return_ws_function_result(window_info, result_id, result, exception=exception)
+
+
+def _execute_function(window_info, function_name, kwargs=None, checked=False):
+    """Execute a function called by a client and return `(result, exception)`.
+
+    If `checked` is `True`, `kwargs` have already been checked by :meth:`FunctionConnection.check`
+    (or are `None` if they are invalid).
+    """
+    result, exception = None, None
     try:
-        if kwargs is None:
+        if kwargs is None and not checked:
             kwargs = {}
-        window_info = WindowInfo.from_dict(window_info_dict)
         import_signals_and_functions()
-        window_info.celery_request = self.request
-        connection = REGISTERED_FUNCTIONS[function_name]
+        connection = REGISTERED_FUNCTIONS[function_name].load()
         assert isinstance(connection, FunctionConnection)
-        if not connection.is_allowed_to(connection, window_info, kwargs):
-            raise ValueError("Unauthorized function call %s" % connection.path)
-        kwargs = connection.check(kwargs)
+        if not checked:
+            if not connection.is_allowed_to(connection, window_info, kwargs):
+                raise ValueError("Unauthorized function call %s" % connection.path)
+            kwargs = connection.check(kwargs)
         if kwargs is not None:
-            # noinspection PyBroadException
+            cache_key = connection.get_cache_key(window_info, kwargs)
+            is_cached, result = connection.get_cached_result(cache_key)
+            if is_cached:
+                return result, None
             result = connection(window_info, **kwargs)
+            connection.set_cached_result(cache_key, result)
     except Exception as e:
         logger.exception(e)
-        result = None
-    if window_info:
-        _return_ws_function_result(window_info, result_id, result, exception=e)
+        result, exception = None, e
+    return result, exception
 
 
 # TODO remove the following functions
@@ -428,6 +1094,22 @@ def import_signals():
     return import_signals_and_functions()
 
 
+@shared_task(serializer="json")
+def flush_notification_reads():
+    """Write notification reads stored in Redis to the database
+    (only used when `settings.DF_NOTIFICATION_READ_WRITE_BEHIND` is set)."""
+    from djangofloor.models import notification_read_buffer
+
+    return notification_read_buffer.flush()
+
+
+@shared_task(serializer="json")
+def promote_delayed_signals():
+    """Send the due delayed signals to Celery
+    (only used when `settings.DF_SIGNAL_SCHEDULER` is set)."""
+    return delayed_signal_scheduler.promote()
+
+
 @shared_task(serializer="json")
 def signal_task(signal_name, request_dict, from_client, kwargs):
     """.. deprecated:: 1.0 do not use it"""
@@ -514,4 +1196,5 @@ def get_expected_queues():
                     expected_queues.add(queue_name)
             elif not callable(connection.queue):
                 expected_queues.add(connection.queue)
+    expected_queues.discard(INLINE)
     return expected_queues
@@ -49,8 +49,9 @@ def df_init_websocket(context, *topics):
         backend_path = context["df_http_request"].session[BACKEND_SESSION_KEY]
     except KeyError:
         backend_path = None
+    topics = getattr(context.get("df_http_request"), "websocket_topics", None)
     signed_token = sign_token(
-        session_id, ws_token, user_pk=user_pk, backend_path=backend_path
+        session_id, ws_token, user_pk=user_pk, backend_path=backend_path, topics=topics
     )
     protocol = "wss" if settings.USE_SSL else "ws"
     site_name = "%s:%s" % (settings.SERVER_NAME, settings.SERVER_PORT)
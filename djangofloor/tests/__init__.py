@@ -40,6 +40,7 @@ class SignalQueue:
         self.python_signals = {}  # javascript_signals[queue] = [signal1, signal2, …]
         self._old_async_method = None
         self._old_ws_function = None
+        self._old_ws_batch_function = None
 
     def activate(self):
         """replace private function that push signal calls to Celery or Websockets """
@@ -65,15 +66,27 @@ class SignalQueue:
         setattr(task_function, "apply_async", apply_async)
 
         # noinspection PyUnusedLocal
-        def ws_signal_call(signal_name, signal_id, serialized_topic, kwargs):
+        def ws_signal_call(signal_name, signal_id, serialized_topics, kwargs):
             json.dumps(kwargs, cls=encoder)  # to check if args are JSON-serializable
-            self.ws_signals.setdefault(serialized_topic, []).append(
-                (signal_name, kwargs)
-            )
+            for serialized_topic in serialized_topics:
+                self.ws_signals.setdefault(serialized_topic, []).append(
+                    (signal_name, kwargs)
+                )
 
         self._old_ws_function = getattr(tasks_module, "_call_ws_signal")
         setattr(tasks_module, "_call_ws_signal", ws_signal_call)
 
+        def ws_signal_batch_call(messages):
+            for serialized_topic, serialized_messages in messages.items():
+                for serialized_message in serialized_messages:
+                    message = json.loads(serialized_message)
+                    self.ws_signals.setdefault(serialized_topic, []).append(
+                        (message["signal"], message["opts"])
+                    )
+
+        self._old_ws_batch_function = getattr(tasks_module, "_call_ws_signal_batch")
+        setattr(tasks_module, "_call_ws_signal_batch", ws_signal_batch_call)
+
     def deactivate(self):
         """ replace the normal private functions for calling Celery or websockets signals"""
         task = getattr(tasks_module, "_server_signal_call")
@@ -81,6 +94,8 @@ class SignalQueue:
         self._old_async_method = None
         setattr(tasks_module, "_call_ws_signal", self._old_ws_function)
         self._old_ws_function = None
+        setattr(tasks_module, "_call_ws_signal_batch", self._old_ws_batch_function)
+        self._old_ws_batch_function = None
 
     def execute_delayed_signals(self, queues=None):
         """ execute the Celery signals """
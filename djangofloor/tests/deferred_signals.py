@@ -0,0 +1,17 @@
+"""Signals and functions used by :class:`djangofloor.tests.test_tasks.TestRegistryManifest`:
+this module must only be imported by the registry manifest."""
+from djangofloor.decorators import everyone, function, signal
+
+__author__ = "Matthieu Gallet"
+
+received_values = []
+
+
+@signal(path="test.deferred_signal", queue="deferred", is_allowed_to=everyone)
+def deferred_signal(window_info, value: int = 0):
+    received_values.append(value)
+
+
+@function(path="test.deferred_function", is_allowed_to=everyone)
+def deferred_function(window_info, value: int = 0):
+    return value * 2
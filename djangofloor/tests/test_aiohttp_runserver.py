@@ -0,0 +1,382 @@
+import asyncio
+import json
+import threading
+import time
+from unittest import mock, skipIf
+
+from django.test import SimpleTestCase
+
+try:
+    from djangofloor.wsgi import aiohttp_runserver
+except (ImportError, AttributeError):
+    # missing optional dependencies, or Python without asyncio.coroutine
+    aiohttp_runserver = None
+
+__author__ = "Matthieu Gallet"
+
+
+class FakeSubscription:
+    """Subscription that fails to open while `failures` is positive."""
+
+    instances = []
+    failures = 0
+
+    def __init__(self):
+        self.topics = []
+        self.subscribed = []
+        self.unsubscribed = []
+        self.published = asyncio.Queue()
+        self.closed = False
+        self.instances.append(self)
+
+    async def open(self):
+        if FakeSubscription.failures > 0:
+            FakeSubscription.failures -= 1
+            raise ConnectionError("unavailable")
+
+    async def subscribe(self, topics):
+        self.subscribed.append(sorted(topics))
+        self.topics += topics
+
+    async def unsubscribe(self, topics):
+        self.unsubscribed.append(sorted(topics))
+
+    async def next_published(self):
+        published = await self.published.get()
+        if isinstance(published, Exception):
+            raise published
+        return published
+
+    def close(self):
+        self.closed = True
+
+
+@skipIf(aiohttp_runserver is None, "aiohttp_runserver cannot be imported")
+class AsyncTestCase(SimpleTestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+
+class TestSubscriber(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        FakeSubscription.instances = []
+        FakeSubscription.failures = 0
+        transport = mock.Mock(async_subscription="%s.FakeSubscription" % __name__)
+        self.patch = mock.patch(
+            "djangofloor.wsgi.aiohttp_runserver.get_transport", return_value=transport
+        )
+        self.patch.start()
+        self.subscriber = aiohttp_runserver.Subscriber()
+        self.subscriber.min_reconnect_delay = 0.01
+        self.subscriber.max_reconnect_delay = 0.02
+
+    def tearDown(self):
+        self.patch.stop()
+        super().tearDown()
+
+    def test_reference_counting(self):
+        queue_1, queue_2 = asyncio.Queue(), asyncio.Queue()
+        self.run_async(self.subscriber.subscribe(queue_1, ["topic", "topic-1"]))
+        self.run_async(self.subscriber.subscribe(queue_2, ["topic", "topic-2"]))
+        subscription = self.subscriber.subscription
+        self.assertEqual(1, len(FakeSubscription.instances))
+        self.assertEqual([["topic", "topic-1"], ["topic-2"]], subscription.subscribed)
+        subscription.published.put_nowait(("topic", "message"))
+        subscription.published.put_nowait(("topic-2", "message-2"))
+        self.run_async(asyncio.sleep(0.01))
+        self.assertEqual("message", queue_1.get_nowait())
+        self.assertTrue(queue_1.empty())
+        self.assertEqual("message", queue_2.get_nowait())
+        self.assertEqual("message-2", queue_2.get_nowait())
+        self.run_async(self.subscriber.unsubscribe(queue_1, ["topic", "topic-1"]))
+        self.assertEqual([["topic-1"]], subscription.unsubscribed)
+        self.run_async(self.subscriber.unsubscribe(queue_2, ["topic", "topic-2"]))
+        self.assertEqual([["topic-1"], ["topic", "topic-2"]], subscription.unsubscribed)
+        self.assertEqual({}, self.subscriber.queues_by_topic)
+
+    def test_reconnect(self):
+        queue = asyncio.Queue()
+        self.run_async(self.subscriber.subscribe(queue, ["topic"]))
+        # the connection is lost and the server is unavailable for two attempts
+        FakeSubscription.failures = 2
+        FakeSubscription.instances[0].published.put_nowait(ConnectionError("lost"))
+        self.run_async(asyncio.sleep(0.2))
+        self.assertTrue(FakeSubscription.instances[0].closed)
+        self.assertEqual(4, len(FakeSubscription.instances))
+        self.assertTrue(all(x.closed for x in FakeSubscription.instances[1:3]))
+        subscription = self.subscriber.subscription
+        self.assertIs(FakeSubscription.instances[3], subscription)
+        self.assertEqual([["topic"]], subscription.subscribed)
+        subscription.published.put_nowait(("topic", "message"))
+        self.run_async(asyncio.sleep(0.01))
+        self.assertEqual("message", queue.get_nowait())
+
+
+class TestSignalDispatcher(AsyncTestCase):
+    def test_dispatch(self):
+        dispatcher = aiohttp_runserver.SignalDispatcher(max_workers=2, max_pending=1)
+        calls = []
+
+        def publish_message(window_info, message, reply=None):
+            time.sleep(0.01)
+            calls.append((window_info, message, reply, threading.current_thread()))
+
+        with mock.patch.object(
+            aiohttp_runserver.WebsocketWSGIServer,
+            "publish_message",
+            side_effect=publish_message,
+        ):
+            self.run_async(
+                asyncio.gather(
+                    *[
+                        dispatcher.async_publish_message("window", x, reply=print)
+                        for x in ("1", "2", "3")
+                    ]
+                )
+            )
+        self.assertEqual(
+            [("window", x, print) for x in ("1", "2", "3")],
+            [x[:3] for x in calls],
+        )
+        self.assertNotIn(threading.main_thread(), [x[3] for x in calls])
+        self.assertEqual(
+            {
+                "threads": 2,
+                "max_pending": 1,
+                "pending": 0,
+                "max_observed_pending": 1,
+                "processed": 3,
+                "throttled": 2,
+            },
+            dispatcher.stats(),
+        )
+
+
+class TestSendQueue(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.totals = {"dropped": 0, "coalesced": 0, "disconnected": 0}
+        self.patch = mock.patch.object(
+            aiohttp_runserver.SendQueue, "totals", self.totals
+        )
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        super().tearDown()
+
+    @staticmethod
+    def signal(name, value):
+        return json.dumps({"signal": name, "opts": {"value": value}})
+
+    def get_all(self, queue):
+        return [self.run_async(queue.get()) for __ in range(len(queue.messages))]
+
+    def test_drop_oldest(self):
+        queue = aiohttp_runserver.SendQueue(maxsize=2, policy="drop-oldest")
+        for message in ("1", "2", "3"):
+            queue.put_nowait(message)
+        self.assertEqual(["2", "3"], self.get_all(queue))
+        self.assertEqual(1, queue.dropped)
+        self.assertEqual(0, queue.coalesced)
+        self.assertEqual(
+            {"dropped": 1, "coalesced": 0, "disconnected": 0},
+            aiohttp_runserver.SendQueue.stats(),
+        )
+
+    def test_coalesce(self):
+        queue = aiohttp_runserver.SendQueue(maxsize=3, policy="coalesce")
+        for message in (
+            self.signal("a", 1),
+            self.signal("b", 1),
+            self.signal("c", 1),
+            self.signal("a", 2),
+        ):
+            queue.put_nowait(message)
+        # the previous "a" message is replaced and the new one is sent last
+        self.assertEqual(0, queue.dropped)
+        self.assertEqual(1, queue.coalesced)
+        # without any message with the same name, the oldest one is dropped
+        queue.put_nowait(self.signal("d", 1))
+        queue.put_nowait("not a signal")
+        self.assertEqual(
+            [self.signal("a", 2), self.signal("d", 1), "not a signal"],
+            self.get_all(queue),
+        )
+        self.assertEqual(2, queue.dropped)
+        self.assertEqual(
+            {"dropped": 2, "coalesced": 1, "disconnected": 0},
+            aiohttp_runserver.SendQueue.stats(),
+        )
+
+    def test_disconnect(self):
+        queue = aiohttp_runserver.SendQueue(maxsize=2, policy="disconnect", max_lag=1)
+        with mock.patch.object(aiohttp_runserver.time, "monotonic") as monotonic:
+            monotonic.return_value = 10.0
+            queue.put_nowait("1")
+            queue.put_nowait("2")
+            # the queue is full since 10.0, but messages are not dropped
+            monotonic.return_value = 10.5
+            queue.put_nowait("3")
+            self.assertEqual(["1", "2", "3"], [x[0] for x in queue.messages])
+            # the consumer reads a message, but the queue is still full
+            self.assertEqual("1", self.run_async(queue.get()))
+            monotonic.return_value = 11.5
+            queue.put_nowait("4")
+            self.assertTrue(queue.disconnected)
+            queue.put_nowait("5")
+        self.assertIsNone(self.run_async(queue.get()))
+        self.assertEqual(0, queue.dropped)
+        self.assertEqual(
+            {"dropped": 0, "coalesced": 0, "disconnected": 1},
+            aiohttp_runserver.SendQueue.stats(),
+        )
+
+    def test_disconnect_under_load(self):
+        # 10 messages per second to a consumer that never reads them
+        queue = aiohttp_runserver.SendQueue(
+            maxsize=100, policy="disconnect", max_lag=30
+        )
+        with mock.patch.object(aiohttp_runserver.time, "monotonic") as monotonic:
+            for index in range(6000):
+                monotonic.return_value = index / 10.0
+                queue.put_nowait(str(index))
+                if queue.disconnected:
+                    break
+        self.assertTrue(queue.disconnected)
+        # the queue is full after 9.9 seconds, then disconnected 30 seconds later
+        self.assertEqual(400, index)
+        self.assertEqual(0, queue.dropped)
+        # a consumer that empties its queue is not disconnected
+        queue = aiohttp_runserver.SendQueue(maxsize=2, policy="disconnect", max_lag=1)
+        with mock.patch.object(aiohttp_runserver.time, "monotonic") as monotonic:
+            for index in range(100):
+                monotonic.return_value = index / 10.0
+                queue.put_nowait(str(index))
+                queue.put_nowait(str(index))
+                self.get_all(queue)
+        self.assertFalse(queue.disconnected)
+
+    def test_results(self):
+        result = json.dumps({"result_id": "id", "result": 42})
+        for policy in ("drop-oldest", "coalesce"):
+            queue = aiohttp_runserver.SendQueue(maxsize=2, policy=policy)
+            queue.put_nowait(result)
+            for value in range(3):
+                queue.put_nowait(self.signal("a", value))
+            self.assertEqual([result, self.signal("a", 2)], self.get_all(queue))
+            # the queue can only contain results: they are all kept
+            for __ in range(3):
+                queue.put_nowait(result)
+            self.assertEqual([result] * 3, self.get_all(queue))
+
+    def test_get(self):
+        queue = aiohttp_runserver.SendQueue(maxsize=2, policy="drop-oldest")
+        self.loop.call_later(0.01, queue.put_nowait, "1")
+        self.assertEqual("1", self.run_async(queue.get()))
+        self.assertRaises(
+            ValueError, aiohttp_runserver.SendQueue, maxsize=2, policy="unknown"
+        )
+
+
+class FakeRedisConnection:
+    instances = []
+
+    def __init__(self):
+        self.subscribed = []
+        self.unsubscribed = []
+        self.closed = False
+        self.instances.append(self)
+
+    @classmethod
+    async def create(cls, **kwargs):
+        await asyncio.sleep(0.01)
+        return cls()
+
+    async def start_subscribe(self):
+        return self
+
+    async def subscribe(self, topics):
+        self.subscribed += topics
+
+    async def unsubscribe(self, topics):
+        self.unsubscribed += topics
+
+    async def next_published(self):
+        return await asyncio.Future()
+
+    def close(self):
+        self.closed = True
+
+
+class TestShardedRedisAsyncSubscription(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        FakeRedisConnection.instances = []
+        shards = [{"host": "localhost", "port": 6379, "db": x} for x in range(2)]
+        transport = mock.Mock(shards=shards)
+        transport.get_shard_index = lambda topic: int(topic[-1])
+        self.patches = [
+            mock.patch(
+                "djangofloor.wsgi.aiohttp_runserver.get_transport",
+                return_value=transport,
+            ),
+            mock.patch.object(
+                aiohttp_runserver.asyncio_redis, "Connection", FakeRedisConnection
+            ),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        super().tearDown()
+
+    def test_concurrent_subscriptions(self):
+        subscription = aiohttp_runserver.ShardedRedisAsyncSubscription()
+        self.run_async(subscription.open())
+        self.run_async(
+            asyncio.gather(
+                subscription.subscribe(["topic-a0"]),
+                subscription.subscribe(["topic-b0", "topic-c1"]),
+            )
+        )
+        # a single connection is opened to each shard
+        self.assertEqual(2, len(FakeRedisConnection.instances))
+        connection_0, connection_1 = FakeRedisConnection.instances
+        self.assertEqual({"topic-a0", "topic-b0"}, set(connection_0.subscribed))
+        self.assertEqual(["topic-c1"], connection_1.subscribed)
+        self.run_async(subscription.unsubscribe(["topic-a0", "topic-c1"]))
+        self.run_async(asyncio.sleep(0))
+        self.assertEqual(["topic-a0"], connection_0.unsubscribed)
+        self.assertFalse(connection_0.closed)
+        self.assertTrue(connection_1.closed)
+        self.run_async(subscription.unsubscribe(["topic-b0"]))
+        self.run_async(asyncio.sleep(0))
+        self.assertTrue(connection_0.closed)
+        self.assertEqual({}, subscription.connections)
+
+    def test_close_while_opening(self):
+        subscription = aiohttp_runserver.ShardedRedisAsyncSubscription()
+        self.run_async(subscription.open())
+        opening = asyncio.ensure_future(subscription.subscribe(["topic-a0"]))
+        self.run_async(asyncio.sleep(0))
+        subscription.close()
+        self.run_async(opening)
+        self.run_async(asyncio.sleep(0))
+        connection = FakeRedisConnection.instances[0]
+        self.assertTrue(connection.closed)
+        self.assertEqual([], connection.subscribed)
@@ -0,0 +1,49 @@
+from django.test import TestCase
+
+from djangofloor.decorators import RE, Choice, SignalConnection
+
+__author__ = "Matthieu Gallet"
+
+
+def checked_signal(window_info, value: int, choice: Choice(["a", "b"]) = "a", text=""):
+    pass
+
+
+def kwargs_signal(window_info, value: RE(r"^\d+$", int), **kwargs):
+    pass
+
+
+class TestConnectionCheck(TestCase):
+    def setUp(self):
+        self.connection = SignalConnection(checked_signal, path="test.checked")
+
+    def test_valid(self):
+        self.assertEqual({"value": 1}, self.connection.check({"value": "1"}))
+        self.assertEqual(
+            {"value": 1, "choice": "b", "text": "t"},
+            self.connection.check({"value": 1, "choice": "b", "text": "t"}),
+        )
+
+    def test_invalid(self):
+        with self.assertLogs("djangofloor.signals", level="WARNING") as logs:
+            self.assertIsNone(self.connection.check({"value": "a"}))
+            self.assertIsNone(self.connection.check({"value": 1, "choice": "c"}))
+            self.assertIsNone(self.connection.check({"text": "t"}))
+            self.assertIsNone(self.connection.check({"value": 1, "other": 2}))
+        self.assertEqual(
+            [
+                'Invalid value \'a\' for argument "value".',
+                'Invalid value \'c\' for argument "choice".',
+                'Missing required argument "value".',
+                'Invalid argument "other".',
+            ],
+            [x.partition(": ")[2] for x in logs.output],
+        )
+
+    def test_kwargs(self):
+        connection = SignalConnection(kwargs_signal, path="test.kwargs")
+        self.assertEqual(
+            {"value": 12, "other": 2}, connection.check({"value": "12", "other": 2})
+        )
+        with self.assertLogs("djangofloor.signals", level="WARNING"):
+            self.assertIsNone(connection.check({"value": "1a"}))
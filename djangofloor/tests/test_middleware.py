@@ -0,0 +1,143 @@
+import base64
+from unittest import mock
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core import signing
+from django.http import HttpRequest
+from django.test import TestCase, override_settings
+
+from djangofloor.middleware import (
+    DjangoFloorMiddleware,
+    basic_auth_cache,
+    sign_token,
+    unsign_token,
+)
+from djangofloor.wsgi.wsgi_server import get_websocket_topics
+
+__author__ = "Matthieu Gallet"
+
+
+class TestSignedToken(TestCase):
+    def test_token(self):
+        token = sign_token("session", "window", user_pk=12)
+        self.assertEqual(("window", "12", None), unsign_token("session", token))
+        self.assertRaises(signing.BadSignature, unsign_token, "other", token)
+
+    @override_settings(WEBSOCKET_SIGNED_TOPICS=True)
+    def test_token_with_topics(self):
+        topics = ["-broadcast", "-window.window"]
+        token = sign_token("session", "window", user_pk=12, topics=topics)
+        self.assertEqual(("window", "12", topics), unsign_token("session", token))
+        self.assertRaises(signing.BadSignature, unsign_token, "other", token)
+        # the session id is not enough to forge a valid token
+        forged_token = signing.Signer("session").sign("window:12")
+        self.assertRaises(signing.BadSignature, unsign_token, "session", forged_token)
+
+    @override_settings(WEBSOCKET_SIGNED_TOPICS=True, WEBSOCKET_REDIS_EXPIRE=60)
+    def test_token_expiration(self):
+        topics = ["-broadcast"]
+        with mock.patch("django.core.signing.time.time", return_value=1000000):
+            token = sign_token("session", "window", topics=topics)
+        with mock.patch("django.core.signing.time.time", return_value=1000050):
+            self.assertEqual(("window", "None", topics), unsign_token("session", token))
+        with mock.patch("django.core.signing.time.time", return_value=1000070):
+            self.assertRaises(signing.SignatureExpired, unsign_token, "session", token)
+
+    @override_settings(WEBSOCKET_SIGNED_TOPICS=True)
+    def test_websocket_topics(self):
+        request = HttpRequest()
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = "session"
+        request.GET["token"] = sign_token(
+            "session", "window", topics=["-broadcast", "-window.window"]
+        )
+        prefix = settings.WEBSOCKET_REDIS_PREFIX
+        self.assertEqual(
+            [prefix + "-broadcast", prefix + "-window.window"],
+            get_websocket_topics(request),
+        )
+
+
+@override_settings(USE_HTTP_BASIC_AUTH=True)
+class TestBasicAuthCache(TestCase):
+    def setUp(self):
+        basic_auth_cache.clear()
+        self.user = get_user_model().objects.create_user("user", password="password")
+        self.middleware = DjangoFloorMiddleware(get_response=lambda r: None)
+
+    def tearDown(self):
+        basic_auth_cache.clear()
+
+    @staticmethod
+    def get_request(password="password"):
+        request = HttpRequest()
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+        auth_data = base64.b64encode(("user:%s" % password).encode("utf-8"))
+        request.META["HTTP_AUTHORIZATION"] = "Basic %s" % auth_data.decode("utf-8")
+        return request
+
+    def test_cache(self):
+        with mock.patch("djangofloor.middleware.auth.authenticate") as authenticate:
+            authenticate.return_value = None
+            request = self.get_request(password="invalid")
+            self.middleware.process_request(request)
+            self.assertFalse(request.user.is_authenticated)
+        request = self.get_request()
+        self.middleware.process_request(request)
+        self.assertEqual(self.user.pk, request.user.pk)
+        with mock.patch("djangofloor.middleware.auth.authenticate") as authenticate:
+            request = self.get_request()
+            self.middleware.process_request(request)
+            self.assertEqual(self.user.pk, request.user.pk)
+            authenticate.assert_not_called()
+            # invalid credentials are never cached
+            authenticate.return_value = None
+            request = self.get_request(password="invalid")
+            self.middleware.process_request(request)
+            self.assertFalse(request.user.is_authenticated)
+
+    def test_password_change(self):
+        self.middleware.process_request(self.get_request())
+        self.user.set_password("new password")
+        self.user.save()
+        request = self.get_request()
+        self.middleware.process_request(request)
+        self.assertFalse(request.user.is_authenticated)
+
+    def test_session(self):
+        other_user = get_user_model().objects.create_user("other", password="password")
+        request = self.get_request()
+        self.middleware.process_request(request)
+        session = request.session
+        with mock.patch("djangofloor.middleware.auth.login", wraps=auth.login) as login:
+            # the session already belongs to the user: it is not written again
+            request = self.get_request()
+            request.session = session
+            self.middleware.process_request(request)
+            login.assert_not_called()
+            # the session belongs to another user
+            request = self.get_request()
+            auth.login(request, other_user, backend=settings.AUTHENTICATION_BACKENDS[0])
+            login.reset_mock()
+            self.middleware.process_request(request)
+            login.assert_called_once_with(request, self.user)
+            self.assertEqual(str(self.user.pk), request.session[auth.SESSION_KEY])
+            # anonymous session
+            request = self.get_request()
+            self.middleware.process_request(request)
+            self.assertEqual(2, login.call_count)
+            self.assertEqual(str(self.user.pk), request.session[auth.SESSION_KEY])
+
+    @override_settings(DF_HTTP_BASIC_AUTH_CACHE_SIZE=1)
+    def test_size(self):
+        get_user_model().objects.create_user("user2", password="password")
+        self.middleware.process_request(self.get_request())
+        request = self.get_request()
+        auth_data = base64.b64encode(b"user2:password").decode("utf-8")
+        request.META["HTTP_AUTHORIZATION"] = "Basic %s" % auth_data
+        self.middleware.process_request(request)
+        self.assertEqual(1, len(basic_auth_cache.entries))
@@ -0,0 +1,175 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.contrib.sessions.backends.cache import SessionStore
+from django.http import HttpRequest
+from django.test import TestCase, override_settings
+from django.utils.timezone import utc
+
+from djangofloor.models import (
+    Notification,
+    NotificationIndex,
+    NotificationRead,
+    notification_index,
+    notification_read_buffer,
+)
+from djangofloor.tests.test_tasks import RedisTestCase
+
+__author__ = "Matthieu Gallet"
+
+
+@override_settings(DF_NOTIFICATION_INDEX=True)
+class TestNotificationIndex(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("user")
+        self.other_user = get_user_model().objects.create_user("other")
+        self.group = Group.objects.create(name="group")
+        self.user.groups.add(self.group)
+
+    @staticmethod
+    def get_request(user=None):
+        request = HttpRequest()
+        request.session = SessionStore()
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_no_query(self):
+        Notification.objects.create(
+            broadcast_mode=Notification.SELECTED_GROUPS_OR_USERS
+        )
+        Notification.get_notifications(self.get_request())
+        with self.assertNumQueries(0):
+            self.assertEqual([], Notification.get_notifications(self.get_request()))
+
+    def test_destinations(self):
+        n_any = Notification.objects.create(broadcast_mode=Notification.ANY)
+        n_auth = Notification.objects.create(broadcast_mode=Notification.AUTHENTICATED)
+        n_user = Notification.objects.create()
+        n_user.destination_users.add(self.user)
+        n_other = Notification.objects.create()
+        n_other.destination_users.add(self.other_user)
+        n_group = Notification.objects.create()
+        n_group.destination_groups.add(self.group)
+        now = datetime.datetime.now(tz=utc)
+        self.assertEqual(
+            [n_any, n_auth, n_other],
+            notification_index.get_notifications(now, user=self.other_user),
+        )
+        self.assertEqual([n_any], Notification.get_notifications(self.get_request()))
+        self.assertEqual(
+            [n_any, n_auth, n_user, n_group],
+            Notification.get_notifications(self.get_request(self.user)),
+        )
+        # already read by the user
+        self.assertEqual(
+            [], Notification.get_notifications(self.get_request(self.user))
+        )
+        # reads of other users are ignored
+        self.assertEqual(
+            [n_any, n_auth, n_other],
+            Notification.get_notifications(self.get_request(self.other_user)),
+        )
+        n_user.delete()
+        n_any.repeat_count = 0
+        n_any.save()
+        self.assertEqual(
+            [n_any], Notification.get_notifications(self.get_request(self.user))
+        )
+
+    def test_boundaries(self):
+        now = datetime.datetime.now(tz=utc)
+        notification = Notification.objects.create(
+            broadcast_mode=Notification.ANY,
+            not_before=now + datetime.timedelta(hours=1),
+            not_after=now + datetime.timedelta(hours=2),
+        )
+        self.assertEqual([], notification_index.get_notifications(now))
+        self.assertEqual(
+            [notification],
+            notification_index.get_notifications(now + datetime.timedelta(hours=1)),
+        )
+        self.assertEqual(
+            [], notification_index.get_notifications(now + datetime.timedelta(hours=3))
+        )
+
+    @override_settings(DF_NOTIFICATION_INDEX=None)
+    def test_local_cache(self):
+        # the cache used by tests is local to each process
+        self.assertFalse(NotificationIndex.is_enabled())
+        notification_index.get_notifications(datetime.datetime.now(tz=utc))
+        # modified by another process, without invalidating the index of this one
+        with mock.patch.object(NotificationIndex, "invalidate"):
+            notification = Notification.objects.create(
+                broadcast_mode=Notification.AUTHENTICATED
+            )
+            notification.destination_groups.add(self.group)
+        now = datetime.datetime.now(tz=utc)
+        self.assertEqual([], notification_index.get_notifications(now))
+        self.assertEqual(
+            [notification], notification_index.get_notifications(now, user=self.user)
+        )
+
+    @override_settings(DF_NOTIFICATION_INDEX=None)
+    def test_dummy_cache(self):
+        # the version is never kept: the index would be rebuilt on each call
+        caches = {
+            "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+        }
+        with override_settings(CACHES=caches):
+            self.assertFalse(NotificationIndex.is_enabled())
+        caches = {"default": {"BACKEND": "django_redis.cache.RedisCache"}}
+        with override_settings(CACHES=caches):
+            self.assertTrue(NotificationIndex.is_enabled())
+
+
+@override_settings(DF_NOTIFICATION_READ_WRITE_BEHIND=True, DF_NOTIFICATION_INDEX=True)
+class TestNotificationWriteBehind(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user("user")
+        self.notification = Notification.objects.create(
+            broadcast_mode=Notification.ANY, repeat_count=2
+        )
+
+    def get_request(self, user=None):
+        request = TestNotificationIndex.get_request(user=user)
+        request.session.create()
+        return request
+
+    def test_user(self):
+        request = self.get_request(self.user)
+        notification_index.get_notifications(datetime.datetime.now(tz=utc))
+        # only the select of NotificationRead, no write
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [self.notification], Notification.get_notifications(request)
+            )
+        self.assertEqual(1, notification_read_buffer.flush())
+        self.assertEqual(1, NotificationRead.objects.get(user=self.user).read_count)
+        self.assertEqual([self.notification], Notification.get_notifications(request))
+        self.assertEqual([], Notification.get_notifications(request))
+        self.assertEqual(1, notification_read_buffer.flush())
+        self.assertEqual(2, NotificationRead.objects.get(user=self.user).read_count)
+        self.assertEqual(0, notification_read_buffer.flush())
+
+    def test_anonymous(self):
+        request = self.get_request()
+        for __ in range(2):
+            self.assertEqual(
+                [self.notification], Notification.get_notifications(request)
+            )
+        self.assertEqual([], Notification.get_notifications(request))
+        self.assertNotIn("djangofloor_notifications", request.session)
+
+    def test_new_session(self):
+        # anonymous user without session key
+        request = TestNotificationIndex.get_request()
+        self.assertEqual([self.notification], Notification.get_notifications(request))
+        session_key = request.session.session_key
+        self.assertIsNotNone(session_key)
+        self.assertEqual([self.notification], Notification.get_notifications(request))
+        self.assertEqual([], Notification.get_notifications(request))
+        self.assertEqual(session_key, request.session.session_key)
+        self.assertNotIn("djangofloor_notifications", request.session)
@@ -0,0 +1,752 @@
+import datetime
+import json
+import sys
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest
+from django.test import TestCase, override_settings
+
+from djangofloor import tasks as tasks_module
+from djangofloor.decorators import (
+    INLINE,
+    DeferredConnection,
+    REGISTERED_FUNCTIONS,
+    REGISTERED_SIGNALS,
+    FunctionConnection,
+    SignalConnection,
+    cache_by_user,
+    everyone,
+    signal_dispatch_table,
+)
+from djangofloor.middleware import sign_token
+from djangofloor.tasks import (
+    BROADCAST,
+    SERVER,
+    WINDOW,
+    batch,
+    call,
+    call_many,
+    get_expected_queues,
+    get_registry_manifest,
+    load_registry_manifest,
+    scall,
+    set_websocket_topics,
+)
+from djangofloor.wsgi import wsgi_server
+from djangofloor.wsgi.topics import serialize_topic
+from djangofloor.wsgi.window_info import WindowInfo
+
+__author__ = "Matthieu Gallet"
+
+
+class FakePipeline:
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = []
+        self.results = []
+
+    def __getattr__(self, item):
+        def command(*args, **kwargs):
+            self.commands.append((item,) + args)
+            self.results.append(getattr(self.connection, item)(*args, **kwargs))
+
+        return command
+
+    def execute(self):
+        self.connection.executed.append(self.commands)
+        results = self.results
+        self.commands = []
+        self.results = []
+        return results
+
+
+class FakeRedis:
+    """Record the commands sent to Redis and emulate a few of them"""
+
+    def __init__(self):
+        self.executed = []
+        self.data = {}
+        self.ttls = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def publish(self, topic, message):
+        pass
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(x.encode("utf-8") for x in values)
+
+    def expire(self, key, value):
+        self.ttls[key] = value
+
+    def eval(self, script, numkeys, key, value, ttl):
+        """emulate PayloadStorage.store_script"""
+        assert script == tasks_module.PayloadStorage.store_script
+        self.data.setdefault(key, value.encode("utf-8"))
+        if self.ttls.get(key, -1) < ttl:
+            self.ttls[key] = ttl
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode("utf-8")
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def lrange(self, key, start, end):
+        return self.data.get(key, [])
+
+    def hincrby(self, key, field, value):
+        values = self.data.setdefault(key, {})
+        field = str(field).encode("utf-8")
+        values[field] = str(int(values.get(field, 0)) + value).encode("utf-8")
+
+    def hmget(self, key, fields):
+        values = self.data.get(key, {})
+        return [values.get(str(x).encode("utf-8")) for x in fields]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def zadd(self, key, mapping):
+        values = self.data.setdefault(key, {})
+        values.update({x.encode("utf-8"): y for (x, y) in mapping.items()})
+
+    def zrangebyscore(self, key, min_score, max_score, start=None, num=None):
+        values = sorted(self.data.get(key, {}).items(), key=lambda x: x[1])
+        values = [x for (x, y) in values if y <= max_score]
+        return values[start : start + num]
+
+    def zrem(self, key, member):
+        return 1 if self.data.get(key, {}).pop(member, None) is not None else 0
+
+
+class RedisTestCase(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self._old_connection = tasks_module.get_websocket_redis_connection
+        tasks_module.get_websocket_redis_connection = lambda: self.redis
+
+    def tearDown(self):
+        tasks_module.get_websocket_redis_connection = self._old_connection
+
+
+class TestCallWsSignal(RedisTestCase):
+    def test_single_pipeline(self):
+        window_info = WindowInfo()
+        window_info.window_key = "window-key"
+        scall(window_info, "test.signal", to=[WINDOW, BROADCAST], value=42)
+        self.assertEqual(1, len(self.redis.executed))
+        commands = self.redis.executed[0]
+        prefix = settings.WEBSOCKET_REDIS_PREFIX
+        self.assertEqual(
+            [
+                prefix + serialize_topic(window_info, WINDOW),
+                prefix + serialize_topic(window_info, BROADCAST),
+            ],
+            [x[1] for x in commands],
+        )
+        self.assertIs(commands[0][2], commands[1][2])
+        message = json.loads(commands[0][2].decode("utf-8"))
+        self.assertEqual("test.signal", message["signal"])
+        self.assertEqual({"value": 42}, message["opts"])
+
+
+class TestBatch(RedisTestCase):
+    def test_batch(self):
+        window_info = WindowInfo()
+        window_info.window_key = "window-key"
+        with batch():
+            scall(window_info, "test.signal1", to=[WINDOW], value=1)
+            with batch():
+                scall(window_info, "test.signal2", to=[WINDOW, BROADCAST], value=2)
+            self.assertEqual([], self.redis.executed)
+        self.assertEqual(1, len(self.redis.executed))
+        commands = self.redis.executed[0]
+        self.assertEqual(2, len(commands))
+        message = json.loads(commands[0][2].decode("utf-8"))
+        self.assertEqual(
+            ["test.signal1", "test.signal2"], [x["signal"] for x in message["signals"]]
+        )
+        message = json.loads(commands[1][2].decode("utf-8"))
+        self.assertEqual(
+            [("test.signal2", {"value": 2})],
+            [(x["signal"], x["opts"]) for x in message["signals"]],
+        )
+
+    def test_call_many(self):
+        window_info = WindowInfo()
+        window_info.window_key = "window-key"
+        call_many(
+            window_info,
+            [("test.signal1", {"value": 1}), ("test.signal2", {"value": 2})],
+            to=[WINDOW],
+        )
+        self.assertEqual(1, len(self.redis.executed))
+        message = json.loads(self.redis.executed[0][0][2].decode("utf-8"))
+        self.assertEqual(
+            [{"value": 1}, {"value": 2}], [x["opts"] for x in message["signals"]]
+        )
+
+
+class TestWebsocketTopics(RedisTestCase):
+    @staticmethod
+    def get_request(window_key):
+        request = HttpRequest()
+        request.window_key = window_key
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = "session"
+        request.GET["token"] = sign_token("session", window_key)
+        return request
+
+    def test_shared_topics(self):
+        request_1 = self.get_request("window1")
+        request_2 = self.get_request("window2")
+        set_websocket_topics(request_1, "topic")
+        set_websocket_topics(request_2, "topic")
+        # one transaction per window
+        self.assertEqual(2, len(self.redis.executed))
+        prefix = settings.WEBSOCKET_REDIS_PREFIX
+        topic_keys = {x for x in self.redis.data if x.startswith(prefix + "topics-")}
+        self.assertEqual(1, len(topic_keys))
+        window_info = WindowInfo()
+        window_info.window_key = "window2"
+        self.assertEqual(
+            {
+                prefix + serialize_topic(window_info, BROADCAST),
+                prefix + serialize_topic(window_info, "topic"),
+                prefix + serialize_topic(window_info, WINDOW),
+            },
+            set(wsgi_server.get_websocket_topics(request_2)),
+        )
+
+
+def inline_add(window_info, a: int = 0, b: int = 0):
+    if a < 0:
+        time.sleep(0.5)
+    return a + b
+
+
+class TestInline(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        FunctionConnection(
+            inline_add, path="test.inline_add", is_allowed_to=everyone, queue=INLINE
+        ).register()
+        self.window_info = WindowInfo()
+        self.window_info.window_key = "window-key"
+
+    def tearDown(self):
+        super().tearDown()
+        del REGISTERED_FUNCTIONS["test.inline_add"]
+
+    def call(self, **kwargs):
+        replies = []
+        message = {"func": "test.inline_add", "result_id": "result", "opts": kwargs}
+        wsgi_server.WebsocketWSGIServer.publish_message(
+            self.window_info, json.dumps(message), reply=replies.append
+        )
+        self.assertEqual(1, len(replies))
+        return json.loads(replies[0])
+
+    def test_function(self):
+        self.assertEqual(
+            {"result_id": "result", "result": 3, "exception": None},
+            self.call(a=1, b=2),
+        )
+        self.assertEqual([], self.redis.executed)
+
+    def test_timeout(self):
+        with mock.patch.object(tasks_module.inline_executor, "timeout", 0.05):
+            reply = self.call(a=-1)
+        self.assertIsNone(reply["result"])
+        self.assertIsNotNone(reply["exception"])
+
+    def test_expected_queues(self):
+        with self.settings(USE_CELERY=True):
+            self.assertNotIn(INLINE, get_expected_queues())
+
+    def test_signal(self):
+        SignalConnection(
+            large_signal,
+            path="test.inline_signal",
+            is_allowed_to=everyone,
+            queue=INLINE,
+        ).register()
+        received_payloads.clear()
+        try:
+            with mock.patch.object(
+                tasks_module._server_signal_call, "apply_async"
+            ) as apply_async:
+                # called by a client: executed by the websocket server
+                message = {"signal": "test.inline_signal", "opts": {"content": "1"}}
+                wsgi_server.WebsocketWSGIServer.publish_message(
+                    self.window_info, json.dumps(message)
+                )
+                apply_async.assert_not_called()
+                self.assertEqual([("window-key", "1")], received_payloads)
+                # called from Python code: sent to the default Celery queue
+                scall(self.window_info, "test.inline_signal", to=[SERVER], content="2")
+            self.assertEqual([("window-key", "1")], received_payloads)
+            self.assertEqual(
+                [settings.CELERY_DEFAULT_QUEUE],
+                [x[1]["queue"] for x in apply_async.call_args_list],
+            )
+            self.assertEqual(INLINE, apply_async.call_args[0][0][6])
+            tasks_module._server_signal_call(*apply_async.call_args[0][0])
+            self.assertEqual(
+                [("window-key", "1"), ("window-key", "2")], received_payloads
+            )
+        finally:
+            del REGISTERED_SIGNALS["test.inline_signal"]
+
+
+cached_calls = []
+
+
+def cached_lookup(window_info, value: int = 0):
+    cached_calls.append(value)
+    return value * 2
+
+
+class TestFunctionCache(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        cached_calls.clear()
+        self.window_info = WindowInfo()
+        self.window_info.window_key = "window-key"
+
+    def tearDown(self):
+        super().tearDown()
+        REGISTERED_FUNCTIONS.pop("test.cached_lookup", None)
+
+    def register(self, **kwargs):
+        FunctionConnection(
+            cached_lookup, path="test.cached_lookup", is_allowed_to=everyone, **kwargs
+        ).register()
+
+    def call(self, **kwargs):
+        replies = []
+        message = {"func": "test.cached_lookup", "result_id": "id", "opts": kwargs}
+        wsgi_server.WebsocketWSGIServer.publish_message(
+            self.window_info, json.dumps(message), reply=replies.append
+        )
+        return [json.loads(x)["result"] for x in replies]
+
+    def test_inline(self):
+        self.register(queue=INLINE, cache_ttl=60)
+        self.assertEqual([4], self.call(value=2))
+        self.assertEqual([4], self.call(value="2"))  # normalized by the annotation
+        self.assertEqual([6], self.call(value=3))
+        self.assertEqual([2, 3], cached_calls)
+
+    def test_celery(self):
+        self.register(cache_ttl=60)
+        with mock.patch.object(tasks_module._server_function_call, "apply_async") as m:
+            self.assertEqual([], self.call(value="2"))
+            self.assertEqual(1, m.call_count)
+            # executed by the Celery worker, with the checked arguments
+            function_name, __, __, kwargs, checked = m.call_args[0][0]
+            self.assertEqual(({"value": 2}, True), (kwargs, checked))
+            tasks_module._execute_function(
+                self.window_info, function_name, kwargs, checked=checked
+            )
+            self.assertEqual([4], self.call(value=2))
+            self.assertEqual(1, m.call_count)
+
+    def test_single_check(self):
+        self.register(queue=INLINE, cache_ttl=60)
+        connection = REGISTERED_FUNCTIONS["test.cached_lookup"]
+        with mock.patch.object(connection, "check", wraps=connection.check) as check:
+            self.assertEqual([4], self.call(value=2))
+            self.assertEqual(1, check.call_count)
+            self.assertEqual([None], self.call(value="x"))
+            self.assertEqual(2, check.call_count)
+            self.assertEqual([4], self.call(value=2))
+            self.assertEqual(3, check.call_count)
+        self.assertEqual([2], cached_calls)
+
+    def test_cache_by_user(self):
+        self.register(queue=INLINE, cache_ttl=60, cache_key=cache_by_user)
+        self.call(value=2)
+        self.window_info.user_pk = 1
+        self.window_info.user_set = True
+        self.call(value=2)
+        self.call(value=2)
+        self.assertEqual([2, 2], cached_calls)
+
+
+@override_settings(DF_SIGNAL_SCHEDULER=True)
+class TestDelayedSignalScheduler(RedisTestCase):
+    def test_promote(self):
+        window_info = WindowInfo()
+        window_info.window_key = "window-key"
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with mock.patch.object(
+            tasks_module._server_signal_call, "apply_async"
+        ) as apply_async:
+            call(window_info, "test.later", to=[WINDOW], countdown=60)
+            call(
+                window_info,
+                "test.due",
+                to=[WINDOW],
+                eta=now - datetime.timedelta(seconds=1),
+            )
+            call(
+                window_info,
+                "test.expired",
+                to=[WINDOW],
+                eta=now - datetime.timedelta(seconds=10),
+                expires=now - datetime.timedelta(seconds=5),
+            )
+            self.assertEqual(0, apply_async.call_count)
+            self.assertEqual(1, tasks_module.delayed_signal_scheduler.promote())
+            self.assertEqual(1, apply_async.call_count)
+            args, kwargs = apply_async.call_args
+            self.assertEqual("test.due", args[0][0])
+            self.assertEqual(settings.CELERY_DEFAULT_QUEUE, kwargs["queue"])
+            self.assertEqual(0, tasks_module.delayed_signal_scheduler.promote())
+        key = tasks_module.delayed_signal_scheduler.get_key()
+        self.assertEqual(1, len(self.redis.data[key]))
+
+
+received_payloads = []
+
+
+def large_signal(window_info, content=""):
+    received_payloads.append((window_info.window_key, content))
+
+
+@override_settings(DF_SIGNAL_CLAIM_CHECK_THRESHOLD=1000)
+class TestPayloadStorage(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        received_payloads.clear()
+        SignalConnection(large_signal, path="test.large_signal", queue="q1").register()
+        SignalConnection(large_signal, path="test.large_signal", queue="q2").register()
+
+    def tearDown(self):
+        super().tearDown()
+        del REGISTERED_SIGNALS["test.large_signal"]
+
+    def test_claim_check(self):
+        window_info = WindowInfo()
+        window_info.window_key = "window-key"
+        content = "x" * 2000
+        with mock.patch.object(
+            tasks_module._server_signal_call, "apply_async"
+        ) as apply_async:
+            scall(window_info, "test.large_signal", to=[SERVER], content=content)
+        self.assertEqual(2, apply_async.call_count)
+        payload_keys = [x for x in self.redis.data if "payload-" in x]
+        self.assertEqual(1, len(payload_keys))
+        for args, kwargs in apply_async.call_args_list:
+            # the reference is sent instead of the kwargs, but not the small window_info
+            self.assertEqual("df_claim_check", args[0][2][0])
+            self.assertIsInstance(args[0][1], dict)
+            tasks_module._server_signal_call(*args[0])
+        self.assertEqual([("window-key", content)] * 2, received_payloads)
+
+    @override_settings(DF_SIGNAL_CLAIM_CHECK_TTL=60)
+    def test_expiration(self):
+        storage = tasks_module.payload_storage
+        value = {"content": "x" * 2000}
+        reference = storage.store(value, countdown=100)
+        key = storage.get_key(reference[1])
+        self.assertEqual(160, self.redis.ttls[key])
+        # the same payload sent without delay does not shorten the expiration time
+        self.assertEqual(reference, storage.store(value))
+        self.assertEqual(160, self.redis.ttls[key])
+        storage.store(value, countdown=200)
+        self.assertEqual(260, self.redis.ttls[key])
+        self.assertEqual(value, storage.load(reference))
+
+    def test_user_values(self):
+        # values that look like references are never loaded
+        storage = tasks_module.payload_storage
+        for value in ({"df_claim_check": "digest"}, ["df_claim_check"], None):
+            self.assertEqual(value, storage.load(value))
+
+
+def failing_signal(window_info, content=""):
+    raise ValueError(content)
+
+
+@override_settings(DF_SIGNAL_BATCH_SIZE=3, DF_SIGNAL_BATCH_DELAY=60)
+class TestServerSignalBuffer(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        received_payloads.clear()
+        SignalConnection(large_signal, path="test.batched_signal").register()
+        SignalConnection(failing_signal, path="test.failing_signal").register()
+
+    def tearDown(self):
+        super().tearDown()
+        tasks_module.server_signal_buffer.flush()
+        del REGISTERED_SIGNALS["test.batched_signal"]
+        del REGISTERED_SIGNALS["test.failing_signal"]
+
+    def test_batch(self):
+        window_info = WindowInfo()
+        window_info.window_key = "window-key"
+        with mock.patch.object(
+            tasks_module._server_signal_call, "apply_async"
+        ) as apply_async, mock.patch.object(
+            tasks_module._server_signal_call_batch, "apply_async"
+        ) as apply_batch_async:
+            scall(window_info, "test.batched_signal", to=[SERVER], content="1")
+            scall(window_info, "test.failing_signal", to=[SERVER], content="2")
+            scall(window_info, "test.batched_signal", to=[SERVER], content="3")
+            self.assertEqual(1, apply_batch_async.call_count)
+            scall(window_info, "test.batched_signal", to=[SERVER], content="4")
+            self.assertEqual(0, apply_async.call_count)
+            tasks_module.server_signal_buffer.flush()
+            self.assertEqual(1, apply_async.call_count)
+        args, kwargs = apply_batch_async.call_args
+        self.assertEqual(settings.CELERY_DEFAULT_QUEUE, kwargs["queue"])
+        tasks_module._server_signal_call_batch(*args[0])
+        self.assertEqual([("window-key", "1"), ("window-key", "3")], received_payloads)
+
+    @override_settings(DF_SIGNAL_BATCH_DELAY=0.01)
+    def test_delay(self):
+        window_info = WindowInfo()
+        buffer = tasks_module.server_signal_buffer
+        with mock.patch.object(
+            tasks_module._server_signal_call, "apply_async"
+        ) as apply_async, mock.patch.object(
+            tasks_module._server_signal_call_batch, "apply_async"
+        ) as apply_batch_async:
+            for content in ("1", "2"):
+                scall(window_info, "test.batched_signal", to=[SERVER], content=content)
+            thread = buffer._thread
+            time.sleep(0.1)
+            self.assertEqual(1, apply_batch_async.call_count)
+            # the same thread sends the calls of the next batching window
+            scall(window_info, "test.batched_signal", to=[SERVER], content="3")
+            time.sleep(0.1)
+            self.assertEqual(1, apply_async.call_count)
+            self.assertIs(thread, buffer._thread)
+            self.assertTrue(thread.is_alive())
+
+
+class TestSignalDispatchTable(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        received_payloads.clear()
+        SignalConnection(large_signal, path="test.dispatch", queue="q1").register()
+        SignalConnection(
+            large_signal,
+            path="test.dispatch",
+            queue=lambda c, w, k: "q%s" % k["content"],
+            is_allowed_to=everyone,
+        ).register()
+        SignalConnection(
+            large_signal, path="test.dispatch", queue="q1", is_allowed_to=everyone
+        ).register()
+
+    def tearDown(self):
+        super().tearDown()
+        del REGISTERED_SIGNALS["test.dispatch"]
+
+    def test_resolve(self):
+        window_info = WindowInfo()
+        self.assertEqual(
+            {"q1": [0, 2], "q2": [1]},
+            signal_dispatch_table.resolve("test.dispatch", window_info, {"content": 2}),
+        )
+        self.assertEqual(
+            {"q1": [0, 1, 2]},
+            signal_dispatch_table.resolve("test.dispatch", window_info, {"content": 1}),
+        )
+        self.assertEqual(
+            {"q1": [2], "q2": [1]},
+            signal_dispatch_table.resolve(
+                "test.dispatch", window_info, {"content": 2}, from_client=True
+            ),
+        )
+        SignalConnection(large_signal, path="test.dispatch", queue="q3").register()
+        self.assertEqual(
+            {"q1": [0, 2], "q2": [1], "q3": [3]},
+            signal_dispatch_table.resolve("test.dispatch", window_info, {"content": 2}),
+        )
+
+    def test_indices(self):
+        window_info = WindowInfo()
+        window_info.window_key = "window-key"
+        with mock.patch.object(
+            tasks_module._server_signal_call, "apply_async"
+        ) as apply_async:
+            wsgi_server.WebsocketWSGIServer.publish_message(
+                window_info,
+                json.dumps({"signal": "test.dispatch", "opts": {"content": "2"}}),
+            )
+        calls = {y["queue"]: x[0] for (x, y) in apply_async.call_args_list}
+        self.assertEqual({"q1", "q2"}, set(calls))
+        self.assertEqual([2], calls["q1"][7])
+        self.assertEqual([1], calls["q2"][7])
+        tasks_module._server_signal_call(*calls["q1"])
+        self.assertEqual([("window-key", "2")], received_payloads)
+
+    def test_fingerprint(self):
+        window_info = WindowInfo()
+        window_info.window_key = "window-key"
+        with mock.patch.object(
+            tasks_module._server_signal_call, "apply_async"
+        ) as apply_async:
+            wsgi_server.WebsocketWSGIServer.publish_message(
+                window_info,
+                json.dumps({"signal": "test.dispatch", "opts": {"content": "2"}}),
+            )
+        calls = {y["queue"]: x[0] for (x, y) in apply_async.call_args_list}
+        # the worker registered the same connections in another order:
+        # the index 2 now points to the server-side connection
+        connections = REGISTERED_SIGNALS["test.dispatch"]
+        connections[0], connections[2] = connections[2], connections[0]
+        self.assertIsNone(
+            signal_dispatch_table.get_connections(
+                "test.dispatch", calls["q1"][7], calls["q1"][8]
+            )
+        )
+        with mock.patch.object(
+            SignalConnection, "__call__", autospec=True
+        ) as connection_call:
+            tasks_module._server_signal_call(*calls["q1"])
+        self.assertEqual(
+            [connections[0]], [x[0][0] for x in connection_call.call_args_list]
+        )
+        # indices out of range or sent without fingerprint are not trusted
+        fingerprint = signal_dispatch_table.get_fingerprint("test.dispatch")
+        self.assertIsNone(
+            signal_dispatch_table.get_connections("test.dispatch", [3], fingerprint)
+        )
+        self.assertIsNone(
+            signal_dispatch_table.get_connections("test.dispatch", [0], None)
+        )
+        self.assertEqual(
+            [connections[1]],
+            signal_dispatch_table.get_connections("test.dispatch", [1], fingerprint),
+        )
+
+
+class TestRegistryManifest(TestCase):
+    module = "djangofloor.tests.deferred_signals"
+
+    def setUp(self):
+        sys.modules.pop(self.module, None)
+        description = {
+            "module": self.module,
+            "identifier": "%s:%s.deferred_signal:djangofloor.decorators.everyone"
+            % (self.module, self.module),
+            "queue": "deferred",
+            "is_allowed_to": "djangofloor.decorators.everyone",
+            "required_arguments": [],
+            "optional_arguments": ["value"],
+            "accept_kwargs": False,
+        }
+        self.description = description
+        load_registry_manifest(
+            {
+                "signals": {"test.deferred_signal": [description]},
+                "functions": {"test.deferred_function": description},
+            }
+        )
+
+    def tearDown(self):
+        sys.modules.pop(self.module, None)
+        del REGISTERED_SIGNALS["test.deferred_signal"]
+        del REGISTERED_FUNCTIONS["test.deferred_function"]
+
+    def test_deferred_signal(self):
+        window_info = WindowInfo()
+        self.assertEqual(
+            {"deferred": [0]},
+            signal_dispatch_table.resolve(
+                "test.deferred_signal", window_info, {}, from_client=True
+            ),
+        )
+        self.assertIsInstance(
+            REGISTERED_SIGNALS["test.deferred_signal"][0], DeferredConnection
+        )
+        self.assertNotIn(self.module, sys.modules)
+        tasks_module._process_signal_call(
+            None,
+            "test.deferred_signal",
+            window_info.to_dict(),
+            {"value": "1"},
+            to_server=True,
+            queue="deferred",
+            connection_indices=[0],
+            registry_fingerprint=signal_dispatch_table.get_fingerprint(
+                "test.deferred_signal"
+            ),
+        )
+        self.assertEqual([1], sys.modules[self.module].received_values)
+        connections = REGISTERED_SIGNALS["test.deferred_signal"]
+        self.assertEqual(1, len(connections))
+        self.assertIsInstance(connections[0], SignalConnection)
+        self.assertEqual(
+            REGISTERED_SIGNALS["test.deferred_signal"][0].identifier,
+            self.description["identifier"],
+        )
+
+    def test_manifest_order(self):
+        # this process imported a module before reading the manifest
+        SignalConnection(large_signal, path="test.ordered_signal").register()
+        imported = REGISTERED_SIGNALS["test.ordered_signal"][0]
+        try:
+            load_registry_manifest(
+                {
+                    "signals": {
+                        "test.ordered_signal": [
+                            dict(self.description),
+                            {
+                                "module": imported.module,
+                                "identifier": imported.identifier,
+                                "queue": settings.CELERY_DEFAULT_QUEUE,
+                                "is_allowed_to": None,
+                            },
+                        ]
+                    },
+                    "functions": {},
+                }
+            )
+            connections = REGISTERED_SIGNALS["test.ordered_signal"]
+            self.assertEqual(2, len(connections))
+            self.assertIsInstance(connections[0], DeferredConnection)
+            self.assertIs(imported, connections[1])
+        finally:
+            del REGISTERED_SIGNALS["test.ordered_signal"]
+
+    def test_deferred_function(self):
+        connection = REGISTERED_FUNCTIONS["test.deferred_function"]
+        self.assertEqual("deferred", connection.queue)
+        self.assertNotIn(self.module, sys.modules)
+        self.assertEqual(
+            (4, None),
+            tasks_module._execute_function(
+                WindowInfo(), "test.deferred_function", {"value": 2}
+            ),
+        )
+        self.assertIsInstance(
+            REGISTERED_FUNCTIONS["test.deferred_function"], FunctionConnection
+        )
+        manifest = get_registry_manifest()
+        self.assertEqual(
+            {
+                "module": self.module,
+                "identifier": "%s:%s.deferred_function:djangofloor.decorators.everyone"
+                % (self.module, self.module),
+                "queue": settings.CELERY_DEFAULT_QUEUE,
+                "is_allowed_to": "djangofloor.decorators.everyone",
+                "required_arguments": [],
+                "optional_arguments": ["value"],
+                "accept_kwargs": False,
+            },
+            manifest["functions"]["test.deferred_function"],
+        )
@@ -0,0 +1,188 @@
+import json
+import os
+import select
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.http import HttpRequest
+from django.test import TestCase
+
+from djangofloor.middleware import sign_token
+from djangofloor.tasks import BROADCAST, WINDOW, scall, set_websocket_topics
+from djangofloor.wsgi.topics import serialize_topic
+from djangofloor.tests.test_tasks import FakeRedis
+from djangofloor.wsgi.transports import (
+    HashRing,
+    MemoryTransport,
+    ShardedRedisTransport,
+)
+from djangofloor.wsgi.window_info import WindowInfo
+from djangofloor.wsgi.wsgi_server import get_websocket_topics
+
+__author__ = "Matthieu Gallet"
+
+
+class TestMemoryTransport(TestCase):
+    directory = None
+
+    def setUp(self):
+        self.transport = MemoryTransport(directory=self.directory)
+        self.patches = [
+            mock.patch("djangofloor.tasks.get_transport", return_value=self.transport),
+            mock.patch(
+                "djangofloor.wsgi.wsgi_server.get_transport",
+                return_value=self.transport,
+            ),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    @staticmethod
+    def get_message(subscription):
+        ready, __, __ = select.select([subscription], [], [], 5.0)
+        return subscription.get_message() if ready else None
+
+    def test_topics(self):
+        request = HttpRequest()
+        request.window_key = "window"
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = "session"
+        request.GET["token"] = sign_token("session", "window")
+        self.assertEqual([], get_websocket_topics(request))
+        set_websocket_topics(request, "topic")
+        window_info = WindowInfo()
+        window_info.window_key = "window"
+        prefix = settings.WEBSOCKET_REDIS_PREFIX
+        self.assertEqual(
+            {
+                prefix + serialize_topic(window_info, x)
+                for x in (BROADCAST, WINDOW, "topic")
+            },
+            set(get_websocket_topics(request)),
+        )
+
+    def test_publish(self):
+        window_info = WindowInfo()
+        window_info.window_key = "window"
+        topic = settings.WEBSOCKET_REDIS_PREFIX + serialize_topic(window_info, WINDOW)
+        subscription = self.transport.subscribe([topic])
+        try:
+            scall(window_info, "test.signal", to=[WINDOW, BROADCAST], value=42)
+            topic_, message = self.get_message(subscription)
+            self.assertEqual(topic, topic_)
+            message = json.loads(message.decode("utf-8"))
+            self.assertEqual("test.signal", message["signal"])
+            self.assertEqual({"value": 42}, message["opts"])
+        finally:
+            subscription.close()
+
+
+class TestRelayedMemoryTransport(TestMemoryTransport):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.directory = self.temp_directory.name
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self.temp_directory.cleanup()
+
+    def test_topic_files(self):
+        self.transport.set_topics("window-1", ["topic-1", "topic-2"], 60)
+        self.transport.set_topics("window-2", ["topic-1", "topic-2"], 60)
+        self.transport.set_topics("window-3", ["topic-3"], -1)
+        self.assertEqual(["topic-1", "topic-2"], self.transport.get_topics("window-2"))
+        self.assertIsNone(self.transport.get_topics("window-3"))
+        self.assertIsNone(self.transport.get_topics("window-4"))
+        names = os.listdir(self.directory)
+        # a single file is written for all windows with the same topics
+        self.assertEqual(2, len([x for x in names if x.startswith("topics-")]))
+        self.assertEqual(3, len([x for x in names if x.startswith("window-")]))
+        # expired files are removed when topics are written
+        self.transport.set_topics("window-4", ["topic-1", "topic-2"], 60)
+        self.assertEqual(6, len(os.listdir(self.directory)))
+        self.transport.next_cleanup = 0.0
+        self.transport.set_topics("window-4", ["topic-1", "topic-2"], 60)
+        self.assertEqual(
+            {"window-window-1", "window-window-2", "window-window-4"},
+            {x for x in os.listdir(self.directory) if x.startswith("window-")},
+        )
+        self.assertEqual(4, len(os.listdir(self.directory)))
+
+    def test_relay(self):
+        # simulate another process (like a Celery worker) publishing a message
+        publisher = MemoryTransport(directory=self.directory)
+        subscription = self.transport.subscribe(["topic"])
+        try:
+            publisher.publish_many([("topic", b"message"), ("other", b"message")])
+            self.assertEqual(("topic", b"message"), self.get_message(subscription))
+        finally:
+            subscription.close()
+
+
+class TestShardedRedisTransport(TestCase):
+    shards = [
+        {"host": "localhost", "port": 6379, "db": 0, "password": ""},
+        {"host": "localhost", "port": 6379, "db": 1, "password": ""},
+        {"host": "localhost", "port": 6380, "db": 0, "password": ""},
+    ]
+
+    def setUp(self):
+        self.transport = ShardedRedisTransport(shards=self.shards)
+        self.connections = [FakeRedis() for __ in self.shards]
+        self.transport.get_shard_connection = lambda index: self.connections[index]
+        self.patches = [
+            mock.patch("djangofloor.tasks.get_transport", return_value=self.transport),
+            mock.patch(
+                "djangofloor.wsgi.wsgi_server.get_transport",
+                return_value=self.transport,
+            ),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_ring(self):
+        topics = ["topic-%d" % x for x in range(1000)]
+        indices = [self.transport.get_shard_index(x) for x in topics]
+        self.assertEqual({0, 1, 2}, set(indices))
+        # removing a shard only moves its own topics
+        ring = HashRing(["%(host)s:%(port)s/%(db)s" % x for x in self.shards[:2]])
+        for topic, index in zip(topics, indices):
+            if index != 2:
+                self.assertEqual(index, ring.get_index(topic))
+
+    def test_publish(self):
+        messages = [("topic-%d" % x, b"message") for x in range(20)]
+        self.transport.publish_many(messages)
+        for index, connection in enumerate(self.connections):
+            published = [x[1] for y in connection.executed for x in y]
+            self.assertLessEqual(len(connection.executed), 1)
+            self.assertEqual(
+                [
+                    x
+                    for (x, y) in messages
+                    if self.transport.get_shard_index(x) == index
+                ],
+                published,
+            )
+
+    def test_topics(self):
+        request = HttpRequest()
+        request.window_key = "window"
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = "session"
+        request.GET["token"] = sign_token("session", "window")
+        set_websocket_topics(request, "topic")
+        index = self.transport.get_shard_index("window")
+        self.assertEqual(
+            [1 if x == index else 0 for x in range(len(self.shards))],
+            [len(x.executed) for x in self.connections],
+        )
+        self.assertEqual(3, len(get_websocket_topics(request)))
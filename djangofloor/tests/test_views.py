@@ -3,6 +3,7 @@ import os
 from django.test import TestCase
 from django.conf import settings
 from django.http import StreamingHttpResponse, HttpResponse
+from django.urls import reverse
 
 from djangofloor.views import send_file
 
@@ -82,3 +83,18 @@ class TestSendFile(TestCase):
         self.assertEqual(
             os.path.join(settings.MEDIA_URL, "test.md"), response["X-Accel-Redirect"]
         )
+
+
+class TestSignalsView(TestCase):
+    def test_etag(self):
+        url = reverse("df:signals")
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertIn("$.df._wsSignalConnect", response.content.decode("utf-8"))
+        etag = response["ETag"]
+        self.assertIn("no-cache", response["Cache-Control"])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response["ETag"])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(200, response.status_code)
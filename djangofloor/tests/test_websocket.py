@@ -0,0 +1,155 @@
+import io
+import os
+import time
+import zlib
+
+from django.test import TestCase
+
+from djangofloor.wsgi.exceptions import FrameTooLargeException, WebSocketError
+from djangofloor.wsgi.utf8validator import DfaUtf8Validator, IncrementalUtf8Validator
+from djangofloor.wsgi.websocket import Header, PerMessageDeflate, WebSocket
+
+__author__ = "Matthieu Gallet"
+
+
+def client_frame(payload, opcode=WebSocket.OPCODE_TEXT, fin=True, mask=b"abcd"):
+    header = Header(length=len(payload))
+    header.mask = mask
+    return Header.encode_header(fin, opcode, mask, len(payload), 0) + (
+        header.mask_payload(payload)
+    )
+
+
+class TestWebSocket(TestCase):
+    def test_mask(self):
+        header = Header()
+        header.mask = b"\x01\x02\x03\x04"
+        payload = os.urandom(1001)
+        expected = bytes(x ^ header.mask[i % 4] for (i, x) in enumerate(payload))
+        self.assertEqual(expected, header.mask_payload(payload))
+        self.assertEqual(payload, header.unmask_payload(expected))
+        self.assertEqual(b"", header.mask_payload(b""))
+
+    def test_fragmented_text(self):
+        data = "é€".encode("utf-8")
+        # the second character is split across two frames
+        stream = io.BytesIO(
+            client_frame(data[:3], fin=False)
+            + client_frame(data[3:], opcode=WebSocket.OPCODE_CONTINUATION)
+        )
+        websocket = WebSocket(stream)
+        self.assertEqual("é€", websocket.read_message())
+
+    def test_binary(self):
+        stream = io.BytesIO(
+            client_frame(b"\xff\x00", opcode=WebSocket.OPCODE_BINARY, fin=False)
+            + client_frame(b"\x01", opcode=WebSocket.OPCODE_CONTINUATION)
+        )
+        websocket = WebSocket(stream)
+        self.assertEqual(bytearray(b"\xff\x00\x01"), websocket.read_message())
+
+    def test_large_message(self):
+        chunk = b"x" * 65536
+        frames = [client_frame(chunk, fin=False)]
+        frames += [
+            client_frame(chunk, opcode=WebSocket.OPCODE_CONTINUATION, fin=False)
+            for __ in range(14)
+        ]
+        frames.append(client_frame(chunk, opcode=WebSocket.OPCODE_CONTINUATION))
+        websocket = WebSocket(io.BytesIO(b"".join(frames)))
+        start = time.monotonic()
+        message = websocket.read_message()
+        self.assertEqual(16 * 65536, len(message))
+        self.assertLess(time.monotonic() - start, 1.0)
+
+
+class TestUtf8Validator(TestCase):
+    def check(self, *chunks):
+        dfa_validator = DfaUtf8Validator()
+        validator = IncrementalUtf8Validator()
+        for chunk in chunks:
+            expected = dfa_validator.validate(chunk)
+            self.assertEqual(expected, validator.validate(chunk))
+            if not expected[0]:
+                return expected
+        return expected
+
+    def test_valid(self):
+        self.assertEqual((True, True, 5, 5), self.check("é€".encode("utf-8")))
+        self.assertEqual((True, True, 2, 4), self.check(b"\xf0\x9f", b"\x98\x80"))
+        self.assertEqual((True, False, 2, 2), self.check(b"\xe2\x82"))
+
+    def test_invalid(self):
+        self.assertEqual((False, False, 1, 1), self.check(b"\xc3\x28"))
+        self.assertEqual((False, False, 2, 2), self.check(b"ab\xff"))
+        # surrogates are not valid UTF-8, even when incomplete
+        self.assertEqual((False, False, 1, 1), self.check(b"\xed\xa0"))
+        self.assertEqual((False, False, 0, 1), self.check(b"\xe0", b"\x80"))
+
+
+class TestPerMessageDeflate(TestCase):
+    def test_negotiate(self):
+        deflate, response = PerMessageDeflate.negotiate(
+            "permessage-deflate; client_max_window_bits"
+        )
+        self.assertEqual("permessage-deflate", response)
+        self.assertTrue(deflate.context_takeover)
+        deflate, response = PerMessageDeflate.negotiate(
+            "permessage-deflate; client_no_context_takeover", context_takeover=False
+        )
+        self.assertEqual(
+            "permessage-deflate; client_no_context_takeover; server_no_context_takeover",
+            response,
+        )
+        deflate, response = PerMessageDeflate.negotiate(
+            "permessage-deflate; server_max_window_bits=8, permessage-deflate"
+        )
+        self.assertEqual(15, deflate.server_max_window_bits)
+        self.assertEqual((None, None), PerMessageDeflate.negotiate("x-webkit-deflate"))
+
+    def test_read_compressed(self):
+        text = "<div>%s</div>" % ("signal " * 100)
+        compressor = zlib.compressobj(-1, zlib.DEFLATED, -15)
+        data = compressor.compress(text.encode("utf-8"))
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        data = data[:-4]
+        frame = bytearray(client_frame(data[:10], fin=False))
+        frame[0] |= Header.RSV0_MASK
+        frame += client_frame(data[10:], opcode=WebSocket.OPCODE_CONTINUATION)
+        websocket = WebSocket(io.BytesIO(bytes(frame)), deflate=PerMessageDeflate())
+        self.assertEqual(text, websocket.read_message())
+        # compressed frames are rejected if the extension has not been negotiated
+        websocket = WebSocket(io.BytesIO(bytes(frame)))
+        self.assertRaises(WebSocketError, websocket.read_message)
+
+    def test_send_compressed(self):
+        stream = io.BytesIO()
+        websocket = WebSocket(stream, deflate=PerMessageDeflate(threshold=100))
+        websocket.send("small")
+        websocket.send("large " * 100)
+        stream.seek(0)
+        header = Header.decode_header(stream)
+        self.assertEqual(0, header.flags)
+        self.assertEqual(b"small", stream.read(header.length))
+        header = Header.decode_header(stream)
+        self.assertEqual(Header.RSV0_MASK, header.flags)
+        self.assertLess(header.length, 100)
+        data = stream.read(header.length)
+        self.assertEqual(
+            ("large " * 100).encode("utf-8"),
+            PerMessageDeflate().decompress(data),
+        )
+
+    def test_read_compressed_too_large(self):
+        compressor = zlib.compressobj(-1, zlib.DEFLATED, -15)
+        data = compressor.compress(b"0" * 10000) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        frame = bytearray(client_frame(data[:-4], opcode=WebSocket.OPCODE_BINARY))
+        frame[0] |= Header.RSV0_MASK
+        websocket = WebSocket(
+            io.BytesIO(bytes(frame)), deflate=PerMessageDeflate(max_size=9999)
+        )
+        self.assertRaises(FrameTooLargeException, websocket.read_message)
+        websocket = WebSocket(
+            io.BytesIO(bytes(frame)), deflate=PerMessageDeflate(max_size=10000)
+        )
+        self.assertEqual(b"0" * 10000, websocket.read_message())
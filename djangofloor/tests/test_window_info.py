@@ -0,0 +1,108 @@
+import tracemalloc
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpRequest
+from django.test import TestCase
+
+from djangofloor.middleware import DjangoAuthMiddleware
+from djangofloor.wsgi.window_info import (
+    CompactWindowInfo,
+    WindowInfo,
+    get_window_context,
+)
+
+__author__ = "Matthieu Gallet"
+
+
+class TestCompactWindowInfo(TestCase):
+    values = {
+        "window_key": "window",
+        "user_pk": 12,
+        "username": "user",
+        "is_superuser": False,
+        "is_staff": True,
+        "is_active": True,
+        "csrf_cookie": "csrf",
+        "perms": ["app_label.codename"],
+        "user_agent": "agent",
+        "user_set": True,
+        "language_code": "fr",
+    }
+
+    def test_no_instance_dict(self):
+        window_info = CompactWindowInfo.from_dict(self.values)
+        self.assertEqual(12, window_info.user_pk)
+        self.assertFalse(hasattr(window_info, "__dict__") and window_info.__dict__)
+
+    def test_from_dict(self):
+        expected = WindowInfo.from_dict(self.values)
+        window_info = CompactWindowInfo.from_dict(self.values)
+        self.assertEqual(expected.to_dict(), window_info.to_dict())
+        for name in ("window_key", "username", "is_authenticated", "language_code"):
+            self.assertEqual(getattr(expected, name), getattr(window_info, name))
+        self.assertTrue(window_info.has_perm("app_label.codename"))
+        self.assertIsNone(CompactWindowInfo.from_dict(None))
+
+    def test_lazy_loading(self):
+        with mock.patch.object(
+            DjangoAuthMiddleware, "from_dict", autospec=True
+        ) as from_dict:
+            window_info = CompactWindowInfo.from_dict(self.values)
+            window_info.celery_request = None
+            self.assertEqual("window", window_info.window_key)
+            from_dict.assert_not_called()
+            self.assertEqual("fr", window_info.language_code)
+            from_dict.assert_called_once_with(
+                mock.ANY, window_info, values=self.values
+            )
+
+    def test_from_request(self):
+        request = HttpRequest()
+        request.window_key = "window"
+        request.user = AnonymousUser()
+        request.META["HTTP_USER_AGENT"] = "agent"
+        expected = WindowInfo.from_request(request)
+        window_info = CompactWindowInfo.from_request(request)
+        self.assertIsInstance(window_info, CompactWindowInfo)
+        self.assertIs(window_info, CompactWindowInfo.from_request(window_info))
+        self.assertEqual(expected.to_dict(), window_info.to_dict())
+        self.assertEqual(
+            get_window_context(expected)["df_user_agent"],
+            get_window_context(window_info)["df_user_agent"],
+        )
+        self.assertRaises(AttributeError, getattr, window_info, "is_authenticated")
+
+    def test_user(self):
+        user = get_user_model().objects.create(username="user")
+        values = dict(self.values, user_pk=user.pk)
+        window_info = CompactWindowInfo.from_dict(values)
+        self.assertEqual(user, window_info.user)
+        # only attributes declared by middlewares can be set
+        self.assertRaises(AttributeError, setattr, window_info, "extra_value", 42)
+
+    @staticmethod
+    def get_size(factory, count=1000):
+        tracemalloc.start()
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            objects = [factory() for __ in range(count)]
+            diff = tracemalloc.take_snapshot().compare_to(snapshot, "filename")
+        finally:
+            tracemalloc.stop()
+        del objects
+        return sum(x.size_diff for x in diff) / count
+
+    def test_size(self):
+        request = HttpRequest()
+        request.window_key = "window"
+        request.user = AnonymousUser()
+        self.assertLess(
+            self.get_size(lambda: CompactWindowInfo.from_request(request)),
+            self.get_size(lambda: WindowInfo.from_request(request)),
+        )
+        window_info = CompactWindowInfo.from_dict(self.values)
+        window_info.to_dict()
+        self.assertIsNone(window_info._pending)
+        self.assertIs(CompactWindowInfo, window_info.__class__)
@@ -6,6 +6,7 @@ Also define two functions:
   * :meth:`read_file_in_chunks`: generate an iterator that reads a file object in chunks
   * :meth:`send_file`: return an efficient :class:`django.http.response.HttpResponse` for reading files
 """
+import hashlib
 import mimetypes
 import os
 import urllib.parse
@@ -17,13 +18,16 @@ from django.conf import settings
 from django.contrib.sites.shortcuts import get_current_site
 from django.contrib.syndication.views import add_domain
 from django.http import HttpResponse
+from django.http import HttpResponseNotModified
 from django.http import HttpResponsePermanentRedirect
 from django.http import HttpResponseRedirect
 from django.http import StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
 from django.templatetags.static import static
 from django.urls import reverse
-from django.views.decorators.cache import never_cache
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
 from django.views.generic import TemplateView
 
 from djangofloor.decorators import REGISTERED_SIGNALS, REGISTERED_FUNCTIONS, everyone
@@ -75,9 +79,11 @@ def read_file_in_chunks(fileobj, chunk_size=32768):
         yield data
 
 
-@never_cache
 def signals(request):
     """Generate a JS file with the list of signals. Also configure jQuery with a CSRF header for AJAX requests.
+
+    The content only depends on the signals and functions that the user can call, so it is rendered once per set of
+    names and sent with an ETag: browsers only revalidate it and receive a `304 Not Modified` answer.
     """
     signal_request = WindowInfo.from_request(request)
     import_signals_and_functions()
@@ -98,7 +104,27 @@ def signals(request):
                 connection, signal_request, None
             ):
                 valid_function_names.append(function_name)
+    content, etag = render_signals(
+        tuple(valid_signal_names), tuple(sorted(valid_function_names))
+    )
+    if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=__get_js_mimetype())
+    response["ETag"] = etag
+    # the content depends on the user: it must be revalidated and cannot be shared
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ("Cookie",))
+    return response
+
 
+@lru_cache(maxsize=64)
+def render_signals(valid_signal_names, valid_function_names):
+    """Render the content of `signals.js` for the given signal and function names.
+
+    :return: content, ETag
+    :rtype: :class:`tuple`
+    """
     function_names_dict = {}
     for name in valid_function_names:
         function_names_dict[name] = (
@@ -133,12 +159,9 @@ def signals(request):
             site_name,
             settings.WEBSOCKET_URL,
         )
-    return TemplateResponse(
-        request,
-        "djangofloor/signals.html",
-        template_values,
-        content_type=__get_js_mimetype(),
-    )
+    content = render_to_string("djangofloor/signals.html", template_values)
+    etag = quote_etag(hashlib.sha1(content.encode("utf-8")).hexdigest())
+    return content, etag
 
 
 def send_file(filepath, mimetype=None, force_download=False, attachment_filename=None):
@@ -2,7 +2,11 @@ import asyncio
 
 # noinspection PyProtectedMember
 import concurrent.futures._base as base
+import json
 import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 
 import aiohttp
@@ -17,6 +21,7 @@ from aiohttp_wsgi import WSGIHandler
 from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 from django.http import HttpRequest
+from django.utils.module_loading import import_string
 
 # noinspection PyPackageRequirements
 
@@ -26,6 +31,7 @@ try:
 except ImportError:
     # noinspection PyPackageRequirements
     from aiohttp.web_request import Request
+from djangofloor.wsgi.transports import get_transport
 from djangofloor.wsgi.wsgi_server import WebsocketWSGIServer
 
 logger = logging.getLogger("django.request")
@@ -46,24 +52,508 @@ def get_http_request(aiohttp_request):
     return django_request
 
 
+class RedisAsyncSubscription:
+    """Subscription to Redis topics, used with :class:`djangofloor.wsgi.transports.RedisTransport`."""
+
+    def __init__(self):
+        self.connection = None
+        self.subscriber = None
+
+    @asyncio.coroutine
+    def open(self):
+        self.connection = yield from asyncio_redis.Connection.create(
+            **settings.WEBSOCKET_REDIS_CONNECTION
+        )
+        self.subscriber = yield from self.connection.start_subscribe()
+
+    @asyncio.coroutine
+    def subscribe(self, topics):
+        yield from self.subscriber.subscribe(topics)
+
+    @asyncio.coroutine
+    def unsubscribe(self, topics):
+        yield from self.subscriber.unsubscribe(topics)
+
+    @asyncio.coroutine
+    def next_published(self):
+        """return the next message as `(topic, message)`"""
+        msg_redis = yield from self.subscriber.next_published()
+        if not msg_redis:
+            return None
+        return msg_redis.channel, msg_redis.value
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+        self.subscriber = None
+
+
+class MemoryAsyncSubscription:
+    """Subscription to in-memory topics, used with :class:`djangofloor.wsgi.transports.MemoryTransport`."""
+
+    def __init__(self):
+        self.transport = get_transport()
+        self.topics = set()
+        self.loop = None
+        self.queue = None
+
+    @asyncio.coroutine
+    def open(self):
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue()
+
+    def put(self, topic, message):
+        # called by the thread reading the relay socket
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (topic, message))
+
+    @asyncio.coroutine
+    def subscribe(self, topics):
+        self.topics.update(topics)
+        self.transport.add_listener(self.put, topics)
+
+    @asyncio.coroutine
+    def unsubscribe(self, topics):
+        self.topics.difference_update(topics)
+        self.transport.remove_listener(self.put, topics)
+
+    @asyncio.coroutine
+    def next_published(self):
+        """return the next message as `(topic, message)`"""
+        topic, message = yield from self.queue.get()
+        return topic, message.decode("utf-8")
+
+    def close(self):
+        self.transport.remove_listener(self.put, self.topics)
+        self.topics = set()
+
+
+class ShardedRedisAsyncSubscription:
+    """Subscription to Redis topics, used with :class:`djangofloor.wsgi.transports.ShardedRedisTransport`.
+
+    A connection is only opened to the servers of the subscribed topics, and is closed
+    when its last topic is unsubscribed.
+    """
+
+    def __init__(self):
+        self.transport = get_transport()
+        # connections[shard index] = future of (connection, subscriber, reader)
+        self.connections = {}
+        self.topics_by_shard = {}  # topics_by_shard[shard index] = {topic1, topic2, …}
+        self.queue = None
+
+    @asyncio.coroutine
+    def open(self):
+        self.queue = asyncio.Queue()
+
+    def group_by_shard(self, topics):
+        topics_by_shard = {}
+        for topic in topics:
+            index = self.transport.get_shard_index(topic)
+            topics_by_shard.setdefault(index, []).append(topic)
+        return topics_by_shard
+
+    @asyncio.coroutine
+    def read(self, subscriber):
+        try:
+            while True:
+                msg_redis = yield from subscriber.next_published()
+                if msg_redis:
+                    self.queue.put_nowait((msg_redis.channel, msg_redis.value))
+        except base.CancelledError:
+            raise
+        except Exception as e:
+            # raised by next_published, so the Subscriber reconnects
+            self.queue.put_nowait(e)
+
+    @asyncio.coroutine
+    def open_shard(self, index):
+        shard = self.transport.shards[index]
+        connection = yield from asyncio_redis.Connection.create(
+            host=shard["host"],
+            port=shard["port"],
+            db=shard["db"],
+            password=shard.get("password") or None,
+        )
+        try:
+            subscriber = yield from connection.start_subscribe()
+        except Exception:
+            connection.close()
+            raise
+        reader = asyncio.ensure_future(self.read(subscriber))
+        return connection, subscriber, reader
+
+    @asyncio.coroutine
+    def subscribe(self, topics):
+        for index, shard_topics in self.group_by_shard(topics).items():
+            self.topics_by_shard.setdefault(index, set()).update(shard_topics)
+            opening = self.connections.get(index)
+            if opening is None:
+                # registered before waiting: concurrent calls share the same connection
+                opening = asyncio.ensure_future(self.open_shard(index))
+                self.connections[index] = opening
+            try:
+                connection, subscriber, reader = yield from asyncio.shield(opening)
+            except Exception:
+                if self.connections.get(index) is opening:
+                    del self.connections[index]
+                raise
+            if self.connections.get(index) is opening:  # not closed in the meantime
+                yield from subscriber.subscribe(shard_topics)
+
+    @asyncio.coroutine
+    def unsubscribe(self, topics):
+        for index, shard_topics in self.group_by_shard(topics).items():
+            opening = self.connections.get(index)
+            if opening is None:
+                continue
+            remaining_topics = self.topics_by_shard.get(index, set())
+            remaining_topics.difference_update(shard_topics)
+            if not remaining_topics:
+                self.close_shard(index)
+                continue
+            connection, subscriber, reader = yield from asyncio.shield(opening)
+            if self.connections.get(index) is opening:
+                yield from subscriber.unsubscribe(shard_topics)
+
+    @asyncio.coroutine
+    def next_published(self):
+        """return the next message as `(topic, message)`"""
+        published = yield from self.queue.get()
+        if isinstance(published, Exception):
+            raise published
+        return published
+
+    @staticmethod
+    def close_opened(opening):
+        if opening.cancelled() or opening.exception() is not None:
+            return
+        connection, subscriber, reader = opening.result()
+        reader.cancel()
+        connection.close()
+
+    def close_shard(self, index):
+        opening = self.connections.pop(index)
+        self.topics_by_shard.pop(index, None)
+        # a connection that is still being opened is closed as soon as it is open
+        opening.add_done_callback(self.close_opened)
+
+    def close(self):
+        for index in list(self.connections):
+            self.close_shard(index)
+
+
+class Subscriber:
+    """Single subscription shared by all websockets of the current process.
+
+    Keep an index of the websocket queues listening each topic, subscribe to a topic
+    when its first listener is added and unsubscribe when its last listener is removed.
+    Each message received from the transport is then dispatched to all local listeners.
+    When the connection is lost, the subscription is opened again, waiting longer after each failed attempt.
+    """
+
+    min_reconnect_delay = 1.0
+    max_reconnect_delay = 30.0
+
+    def __init__(self):
+        self.subscription = None
+        self.queues_by_topic = {}  # queues_by_topic[topic] = {queue1, queue2, …}
+        self._reader = None
+        self._lock = None
+
+    @asyncio.coroutine
+    def start(self):
+        """open the subscription if required"""
+        if self.subscription is not None:
+            return
+        if self._lock is None:  # created here to be bound to the running loop
+            self._lock = asyncio.Lock()
+        yield from self._lock.acquire()
+        try:
+            if self.subscription is not None:
+                return
+            subscription_cls = import_string(get_transport().async_subscription)
+            subscription = subscription_cls()
+            try:
+                yield from subscription.open()
+                topics = [x for (x, y) in self.queues_by_topic.items() if y]
+                if topics:
+                    yield from subscription.subscribe(topics)
+            except Exception:
+                subscription.close()
+                raise
+            self.subscription = subscription
+            self._reader = asyncio.ensure_future(self.dispatch())
+        finally:
+            self._lock.release()
+
+    @asyncio.coroutine
+    def subscribe(self, queue, topics):
+        """register a new listener on each of the given topics"""
+        yield from self.start()
+        new_topics = []
+        for topic in topics:
+            queues = self.queues_by_topic.setdefault(topic, set())
+            if not queues:
+                new_topics.append(topic)
+            queues.add(queue)
+        if new_topics and self.subscription is not None:
+            yield from self.subscription.subscribe(new_topics)
+
+    @asyncio.coroutine
+    def unsubscribe(self, queue, topics):
+        """remove a listener from each of the given topics"""
+        old_topics = []
+        for topic in topics:
+            queues = self.queues_by_topic.get(topic)
+            if queues is None:
+                continue
+            queues.discard(queue)
+            if not queues:
+                del self.queues_by_topic[topic]
+                old_topics.append(topic)
+        if old_topics and self.subscription is not None:
+            yield from self.subscription.unsubscribe(old_topics)
+
+    @asyncio.coroutine
+    def dispatch(self):
+        """read published messages and send them to the local listeners"""
+        try:
+            while True:
+                published = yield from self.subscription.next_published()
+                if not published:
+                    continue
+                topic, message = published
+                for queue in self.queues_by_topic.get(topic, ()):
+                    queue.put_nowait(message)
+        except base.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(e)
+        self.close()
+        # the connection is lost: reconnect and subscribe again to all active topics
+        delay = self.min_reconnect_delay
+        while self.subscription is None:
+            yield from asyncio.sleep(delay)
+            try:
+                yield from self.start()
+            except base.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Unable to subscribe to websocket topics: %s" % e)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def close(self):
+        if self.subscription is not None:
+            self.subscription.close()
+        self.subscription = None
+
+
+subscriber = Subscriber()
+
+
+class SignalDispatcher:
+    """Process the signals and functions called by the clients outside the event loop.
+
+    :meth:`djangofloor.wsgi.wsgi_server.WebsocketWSGIServer.publish_message` performs blocking
+    Redis and Celery calls, so it is run in a bounded thread pool. At most
+    `settings.WEBSOCKET_DISPATCH_QUEUE_SIZE` messages can wait for a thread: when this limit is reached,
+    the websocket that sends a new message waits for a free slot while other websockets are still served.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None):
+        self.max_workers = max_workers or settings.WEBSOCKET_DISPATCH_THREADS
+        self.max_pending = max_pending or settings.WEBSOCKET_DISPATCH_QUEUE_SIZE
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.pending = 0  # number of messages waiting for (or being processed by) a thread
+        self.max_observed_pending = 0
+        self.processed = 0
+        self.throttled = 0  # number of messages that had to wait for a free slot
+        self._semaphore = None
+
+    @asyncio.coroutine
+    def async_publish_message(self, window_info, message, reply=None):
+        """coroutine equivalent of :meth:`WebsocketWSGIServer.publish_message`"""
+        if self._semaphore is None:  # created here to be bound to the running loop
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        if self._semaphore.locked():
+            self.throttled += 1
+            logger.warning(
+                "%d websocket messages are waiting to be dispatched" % self.pending
+            )
+        yield from self._semaphore.acquire()
+        self.pending += 1
+        self.max_observed_pending = max(self.max_observed_pending, self.pending)
+        try:
+            loop = asyncio.get_event_loop()
+            yield from loop.run_in_executor(
+                self.executor,
+                WebsocketWSGIServer.publish_message,
+                window_info,
+                message,
+                reply,
+            )
+        finally:
+            self.pending -= 1
+            self.processed += 1
+            self._semaphore.release()
+
+    def stats(self):
+        """return the current metrics of this dispatcher"""
+        return {
+            "threads": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "max_observed_pending": self.max_observed_pending,
+            "processed": self.processed,
+            "throttled": self.throttled,
+        }
+
+
+dispatcher = SignalDispatcher()
+
+
+class SendQueue:
+    """Bounded queue of the messages waiting to be sent to a single websocket.
+
+    When a client cannot read its messages fast enough and `settings.WEBSOCKET_SEND_QUEUE_SIZE` messages are
+    waiting, `settings.WEBSOCKET_SEND_QUEUE_POLICY` is applied:
+
+      * `"drop-oldest"`: the oldest message is dropped,
+      * `"coalesce"`: a waiting message with the same signal name is replaced by the new one (if there is no such
+        message, the oldest one is dropped),
+      * `"disconnect"`: no message is dropped, and the websocket is closed when its queue has been full for more than
+        `settings.WEBSOCKET_SEND_QUEUE_MAX_LAG` seconds.
+
+    Results of functions are never dropped, since the client is waiting for them.
+    Counters are kept for each queue and for the whole process (:meth:`stats`).
+    """
+
+    DROP_OLDEST = "drop-oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+    totals = {"dropped": 0, "coalesced": 0, "disconnected": 0}
+
+    def __init__(self, maxsize=None, policy=None, max_lag=None):
+        self.maxsize = maxsize or settings.WEBSOCKET_SEND_QUEUE_SIZE
+        self.policy = policy or settings.WEBSOCKET_SEND_QUEUE_POLICY
+        self.max_lag = max_lag or settings.WEBSOCKET_SEND_QUEUE_MAX_LAG
+        if self.policy not in (self.DROP_OLDEST, self.COALESCE, self.DISCONNECT):
+            raise ValueError("Invalid send queue policy: %r" % self.policy)
+        self.messages = deque()  # [message, (signal name, is a result) or None]
+        self.full_since = None  # time.monotonic() when the queue became full
+        self.dropped = 0
+        self.coalesced = 0
+        self.disconnected = False
+        self._event = asyncio.Event()
+
+    @staticmethod
+    def get_message_info(message):
+        """return the signal name (or `None`) and `True` if the message is the result of a function"""
+        try:
+            values = json.loads(message)
+            return values.get("signal"), "result_id" in values
+        except (ValueError, AttributeError, TypeError):
+            return None, False
+
+    def iter_messages(self):
+        """yield the index, the signal name and the type of each waiting message (parsed only once)"""
+        for index, item in enumerate(self.messages):
+            if item[1] is None:
+                item[1] = self.get_message_info(item[0])
+            yield index, item[1][0], item[1][1]
+
+    def put_nowait(self, message):
+        if self.disconnected:
+            return
+        if len(self.messages) >= self.maxsize:
+            if self.policy == self.DISCONNECT:
+                if time.monotonic() - self.full_since > self.max_lag:
+                    self.disconnected = True
+                    self.totals["disconnected"] += 1
+                    self.messages.clear()
+                    self._event.set()
+                    return
+            elif self.policy == self.COALESCE and self.coalesce(message):
+                self.coalesced += 1
+                self.totals["coalesced"] += 1
+            elif self.drop_oldest():
+                self.dropped += 1
+                self.totals["dropped"] += 1
+        self.messages.append([message, None])
+        if len(self.messages) >= self.maxsize and self.full_since is None:
+            self.full_since = time.monotonic()
+        self._event.set()
+
+    def coalesce(self, message):
+        """remove the oldest waiting message with the same signal name as the given message"""
+        signal_name = self.get_message_info(message)[0]
+        if signal_name is None:
+            return False
+        for index, name, __ in self.iter_messages():
+            if name == signal_name:
+                del self.messages[index]
+                return True
+        return False
+
+    def drop_oldest(self):
+        """remove the oldest waiting message that is not the result of a function"""
+        for index, __, is_result in self.iter_messages():
+            if not is_result:
+                del self.messages[index]
+                return True
+        return False
+
+    @asyncio.coroutine
+    def get(self):
+        """return the next message, or `None` if the websocket must be disconnected"""
+        while not self.messages and not self.disconnected:
+            self._event.clear()
+            yield from self._event.wait()
+        if self.disconnected:
+            return None
+        message = self.messages.popleft()[0]
+        if len(self.messages) < self.maxsize:
+            self.full_since = None
+        return message
+
+    @classmethod
+    def stats(cls):
+        """return the counters of all the send queues of this process"""
+        return dict(cls.totals)
+
+
 @asyncio.coroutine
-def handle_redis(window_info, ws, subscriber):
-    """ handle the Redis pubsub connection"""
+def handle_redis(window_info, ws, queue):
+    """ send messages received from the shared subscriber"""
     while window_info.is_active:
-        msg_redis = yield from subscriber.next_published()
-        if msg_redis:
-            yield from ws.send_str(msg_redis.value)
+        message = yield from queue.get()
+        if message is None:
+            logger.warning(
+                "websocket %s is too slow to read its messages: disconnected"
+                % window_info.window_key
+            )
+            yield from ws.close(code=1013, message=b"Too slow consumer")
+            break
+        yield from ws.send_str(message)
 
 
 @asyncio.coroutine
-def handle_ws(window_info, ws):
+def handle_ws(window_info, ws, queue):
     """process each event received on the websocket connection.
 
     :param window_info: window
     :type window_info: :class:`djangofloor.wsgi.window_info.WindowInfo`
     :param ws: open websocket connection
     :type ws: :class:`aiohttp.web.WebSocketResponse`
+    :param queue: messages to send to this websocket
+    :type queue: :class:`SendQueue`
     """
+    loop = asyncio.get_event_loop()
+
+    def reply(message):
+        # called by the dispatcher threads for inline functions
+        loop.call_soon_threadsafe(queue.put_nowait, message)
 
     while window_info.is_active:
         msg = yield from ws.receive(timeout=settings.WEBSOCKET_CONNECTION_EXPIRE)
@@ -75,7 +565,9 @@ def handle_ws(window_info, ws):
                 window_info.is_active = False
                 break
             else:
-                WebsocketWSGIServer.publish_message(window_info, msg.data)
+                yield from dispatcher.async_publish_message(
+                    window_info, msg.data, reply=reply
+                )
         elif msg.type == web.WSMsgType.binary:
             pass
         elif msg.type == web.WSMsgType.close:
@@ -96,7 +588,8 @@ class AnonymousWebSocketResponse(web.WebSocketResponse):
 
 @asyncio.coroutine
 def websocket_handler(request):
-    ws = AnonymousWebSocketResponse()
+    ws = AnonymousWebSocketResponse(compress=settings.WEBSOCKET_COMPRESSION)
+    queue = SendQueue()
     try:
         yield from ws.prepare(request)
         django_request = get_http_request(request)
@@ -104,22 +597,25 @@ def websocket_handler(request):
         channels, echo_message = WebsocketWSGIServer.process_subscriptions(
             django_request
         )
-        connection = yield from asyncio_redis.Connection.create(
-            **settings.WEBSOCKET_REDIS_CONNECTION
-        )
-        subscriber = yield from connection.start_subscribe()
     except base.CancelledError:
         return ws
     except Exception as e:
         logger.exception(e)
         return ws
 
+    tasks = []
     try:
-        yield from subscriber.subscribe(channels)
+        yield from subscriber.subscribe(queue, channels)
         window_info.is_active = True
-        yield from asyncio.gather(
-            handle_ws(window_info, ws), handle_redis(window_info, ws, subscriber)
+        tasks = [
+            asyncio.ensure_future(handle_ws(window_info, ws, queue)),
+            asyncio.ensure_future(handle_redis(window_info, ws, queue)),
+        ]
+        done, pending = yield from asyncio.wait(
+            tasks, return_when=asyncio.FIRST_COMPLETED
         )
+        for task in done:
+            task.result()
     except aiohttp.ClientConnectionError:
         pass
     except asyncio.TimeoutError:
@@ -131,9 +627,10 @@ def websocket_handler(request):
     except Exception as e:
         logger.exception(e)
     finally:
-        if subscriber:
-            yield from subscriber.unsubscribe(channels)
-        connection.close()
+        window_info.is_active = False
+        for task in tasks:
+            task.cancel()
+        yield from subscriber.unsubscribe(queue, channels)
     return ws
 
 
@@ -11,7 +11,7 @@ from django.core.management.commands import runserver
 from django.core.servers.basehttp import WSGIServer, WSGIRequestHandler, ServerHandler
 from django.core.wsgi import get_wsgi_application
 
-from djangofloor.wsgi.websocket import WebSocket
+from djangofloor.wsgi.websocket import PerMessageDeflate, WebSocket
 from djangofloor.wsgi.wsgi_server import (
     WebsocketWSGIServer,
     HandshakeError,
@@ -61,10 +61,20 @@ class WebsocketRunServer(WebsocketWSGIServer):
             ("Sec-WebSocket-Accept", sec_ws_accept),
             ("Sec-WebSocket-Version", str(websocket_version)),
         ]
+        deflate = None
+        if settings.WEBSOCKET_COMPRESSION:
+            deflate, extensions = PerMessageDeflate.negotiate(
+                environ.get("HTTP_SEC_WEBSOCKET_EXTENSIONS", ""),
+                threshold=settings.WEBSOCKET_COMPRESSION_THRESHOLD,
+                context_takeover=settings.WEBSOCKET_COMPRESSION_CONTEXT_TAKEOVER,
+                max_size=settings.WEBSOCKET_COMPRESSION_MAX_SIZE,
+            )
+            if deflate is not None:
+                headers.append(("Sec-WebSocket-Extensions", extensions))
         logger.debug("WebSocket request accepted, switching protocols")
         start_response(str("101 Switching Protocols"), headers)
         start_response.__self__.finish_content()
-        return DjangoWebSocket(environ["wsgi.input"])
+        return DjangoWebSocket(environ["wsgi.input"], deflate=deflate)
 
     def get_ws_file_descriptor(self, websocket):
         return websocket.get_file_descriptor()
@@ -83,8 +93,8 @@ class WebsocketRunServer(WebsocketWSGIServer):
 
 
 class DjangoWebSocket(WebSocket):
-    def __init__(self, wsgi_input):
-        super().__init__(Stream(wsgi_input))
+    def __init__(self, wsgi_input, deflate=None):
+        super().__init__(Stream(wsgi_input), deflate=deflate)
 
 
 class Stream:
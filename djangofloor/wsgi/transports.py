@@ -0,0 +1,493 @@
+"""Transports used for sending signals to websockets
+=================================================
+
+A transport publishes messages to topics, stores the list of topics of each window and allows websocket servers to
+subscribe to topics. The transport is defined by `settings.WEBSOCKET_TRANSPORT`:
+
+  * :class:`RedisTransport` (the default one) uses the Redis server defined by `settings.WEBSOCKET_REDIS_CONNECTION`,
+  * :class:`ShardedRedisTransport` distributes topics on the Redis servers defined by `settings.WEBSOCKET_REDIS_SHARDS`,
+  * :class:`MemoryTransport` does not require any external service, but only works on a single host.
+    If `settings.WEBSOCKET_MEMORY_TRANSPORT_DIRECTORY` is not set, everything is kept in memory and the HTTP server,
+    the websocket server and the Celery workers must share the same process (useful for tests).
+    Otherwise, messages are relayed to all processes through Unix sockets created in this directory,
+    where topics are also stored.
+
+All topics are already prefixed by `settings.WEBSOCKET_REDIS_PREFIX`.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from redis import ConnectionPool, ResponseError, StrictRedis
+
+__author__ = "Matthieu Gallet"
+logger = logging.getLogger("django.request")
+
+
+class BaseTransport:
+    """Base class of the transports."""
+
+    # class used by the aiohttp server for subscribing to topics
+    async_subscription = None
+
+    def publish_many(self, messages):
+        """Publish several messages.
+
+        :param messages: list of `(topic, message)`, `message` being :class:`bytes`
+        """
+        raise NotImplementedError
+
+    def set_topics(self, window_key, topics, expire):
+        """Store the topics of a window for `expire` seconds."""
+        raise NotImplementedError
+
+    def get_topics(self, window_key):
+        """Return the topics of a window (`None` if they are unknown)."""
+        raise NotImplementedError
+
+    def subscribe(self, topics):
+        """Return a :class:`Subscription` to the given topics, to use in a `select` loop."""
+        raise NotImplementedError
+
+
+class Subscription:
+    """Subscription to some topics, returned by :meth:`BaseTransport.subscribe`."""
+
+    def fileno(self):
+        """File descriptor that becomes readable when a message is available."""
+        raise NotImplementedError
+
+    def filenos(self):
+        """All file descriptors to watch, when messages can be received from several connections."""
+        return [self.fileno()]
+
+    def get_message(self, fd=None):
+        """Return the message available on `fd` as `(topic, message)` or `None` if it is not a published message."""
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class RedisTransport(BaseTransport):
+    """Use Redis pub/sub for sending messages.
+
+    Structure of the Redis database:
+
+      * pubsub topics,
+      * LIST "{prefix}topics-{hash}" to list of topics with EXPIRE, where hash is computed from these topics,
+      * STRING "{prefix}{window-key}" to the hash of its topic list with EXPIRE.
+    """
+
+    async_subscription = "djangofloor.wsgi.aiohttp_runserver.RedisAsyncSubscription"
+
+    # noinspection PyUnusedLocal
+    @staticmethod
+    def get_connection(key=None):
+        """Return the connection to use for the given key or topic."""
+        from djangofloor import tasks
+
+        return tasks.get_websocket_redis_connection()
+
+    def publish_many(self, messages):
+        pipe = self.get_connection().pipeline(transaction=False)
+        for topic, message in messages:
+            pipe.publish(topic, message)
+        pipe.execute()
+
+    def set_topics(self, window_key, topics, expire):
+        # topic lists are stored once for all windows sharing the same topics
+        prefix = settings.WEBSOCKET_REDIS_PREFIX
+        digest = hashlib.sha256("\n".join(topics).encode("utf-8")).hexdigest()
+        topics_key = "%stopics-%s" % (prefix, digest)
+        pipe = self.get_connection(window_key).pipeline(transaction=True)
+        pipe.delete(topics_key)
+        if topics:
+            pipe.rpush(topics_key, *topics)
+        pipe.expire(topics_key, expire)
+        pipe.set("%s%s" % (prefix, window_key), digest, ex=expire)
+        pipe.execute()
+
+    def get_topics(self, window_key):
+        prefix = settings.WEBSOCKET_REDIS_PREFIX
+        redis_key = "%s%s" % (prefix, window_key)
+        connection = self.get_connection(window_key)
+        try:
+            digest = connection.get(redis_key)
+        except ResponseError:  # list of topics stored by a previous version
+            topics = connection.lrange(redis_key, 0, -1)
+            return [x.decode("utf-8") for x in topics]
+        if digest is None:
+            return None
+        topics_key = "%stopics-%s" % (prefix, digest.decode("utf-8"))
+        return [x.decode("utf-8") for x in connection.lrange(topics_key, 0, -1)]
+
+    def subscribe(self, topics):
+        return RedisSubscription(self.get_connection(), topics)
+
+
+class RedisSubscription(Subscription):
+    def __init__(self, connection, topics):
+        self.pubsub = connection.pubsub()
+        self.pubsub.subscribe(*topics)
+
+    def fileno(self):
+        # noinspection PyProtectedMember
+        return self.pubsub.connection._sock.fileno()
+
+    def get_message(self, fd=None):
+        kind, topic, message = self.pubsub.parse_response()
+        if kind.decode("utf-8") == "message":
+            return topic.decode("utf-8"), message
+        return None
+
+    def close(self):
+        self.pubsub.close()
+
+
+class HashRing:
+    """Consistent hashing of keys on a list of nodes: adding or removing a node only moves
+    the keys of this node.
+
+    >>> ring = HashRing(["node1", "node2"])
+    >>> ring.get_index("topic") == ring.get_index("topic")
+    True
+    """
+
+    def __init__(self, node_names, replicas=100):
+        points = []
+        for index, name in enumerate(node_names):
+            for replica in range(replicas):
+                points.append((self.hash("%s-%d" % (name, replica)), index))
+        points.sort()
+        self.points = [x[0] for x in points]
+        self.indices = [x[1] for x in points]
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def get_index(self, key):
+        """Return the index of the node of the given key."""
+        position = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.indices[position]
+
+
+class ShardedRedisTransport(RedisTransport):
+    """Distribute topics on several Redis servers (`settings.WEBSOCKET_REDIS_SHARDS`, a list of dicts like
+    `settings.WEBSOCKET_REDIS_CONNECTION`) by consistent hashing: each message is only published on the
+    server of its topic and websocket servers only connect to the servers of their topics.
+    The topics of a window are stored on the server of its window key.
+    """
+
+    async_subscription = (
+        "djangofloor.wsgi.aiohttp_runserver.ShardedRedisAsyncSubscription"
+    )
+
+    def __init__(self, shards=None):
+        self.shards = shards or settings.WEBSOCKET_REDIS_SHARDS
+        if not self.shards:
+            raise ImproperlyConfigured(
+                "settings.WEBSOCKET_REDIS_SHARDS is required by ShardedRedisTransport"
+            )
+        self.ring = HashRing(["%(host)s:%(port)s/%(db)s" % x for x in self.shards])
+        self.connection_pools = {}
+
+    def get_shard_index(self, key):
+        return self.ring.get_index(key)
+
+    def get_shard_connection(self, index):
+        pool = self.connection_pools.get(index)
+        if pool is None:
+            shard = self.shards[index]
+            pool = ConnectionPool(
+                host=shard["host"],
+                port=shard["port"],
+                db=shard["db"],
+                password=shard.get("password") or None,
+                retry_on_timeout=True,
+                socket_keepalive=True,
+            )
+            self.connection_pools[index] = pool
+        return StrictRedis(connection_pool=pool)
+
+    def get_connection(self, key=None):
+        return self.get_shard_connection(self.get_shard_index(key or ""))
+
+    def publish_many(self, messages):
+        messages_by_shard = {}
+        for topic, message in messages:
+            index = self.get_shard_index(topic)
+            messages_by_shard.setdefault(index, []).append((topic, message))
+        for index, shard_messages in messages_by_shard.items():
+            pipe = self.get_shard_connection(index).pipeline(transaction=False)
+            for topic, message in shard_messages:
+                pipe.publish(topic, message)
+            pipe.execute()
+
+    def subscribe(self, topics):
+        return ShardedRedisSubscription(self, topics)
+
+
+class ShardedRedisSubscription(Subscription):
+    """One Redis subscription for each server used by the given topics."""
+
+    def __init__(self, transport, topics):
+        topics_by_shard = {}
+        for topic in topics:
+            index = transport.get_shard_index(topic)
+            topics_by_shard.setdefault(index, []).append(topic)
+        self.subscriptions = {}
+        try:
+            for index, shard_topics in topics_by_shard.items():
+                subscription = RedisSubscription(
+                    transport.get_shard_connection(index), shard_topics
+                )
+                self.subscriptions[subscription.fileno()] = subscription
+        except Exception:
+            self.close()
+            raise
+
+    def fileno(self):
+        return self.filenos()[0]
+
+    def filenos(self):
+        return list(self.subscriptions)
+
+    def get_message(self, fd=None):
+        return self.subscriptions[fd].get_message()
+
+    def close(self):
+        for subscription in self.subscriptions.values():
+            subscription.close()
+        self.subscriptions = {}
+
+
+class MemoryTransport(BaseTransport):
+    """Keep topics and subscriptions in memory, optionally relaying messages to the other processes of the same host
+    through Unix datagram sockets.
+
+    Each process that subscribes to topics binds a socket "relay-{pid}-{id}.sock" in the relay directory and runs a thread
+    for reading it. A published message is directly delivered to the local subscribers and sent to each other socket.
+    Each distinct topic list is stored once in this directory as a file "topics-{digest}", and each window as a file
+    "window-{window key}" that contains this digest. Expired files are regularly removed.
+    """
+
+    async_subscription = "djangofloor.wsgi.aiohttp_runserver.MemoryAsyncSubscription"
+    max_datagram_size = 200000
+    cleanup_interval = 60.0  # minimal delay (in seconds) between two removals of expired topics
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.WEBSOCKET_MEMORY_TRANSPORT_DIRECTORY
+        self.lock = threading.Lock()
+        self.listeners_by_topic = {}  # listeners_by_topic[topic] = {listener1, listener2, …}
+        self.topics = {}  # topics[window_key] = (expiration, topics), when there is no directory
+        self.relay_socket = None
+        self.relay_path = None
+        self.relay_thread = None
+        self.next_cleanup = 0.0
+
+    def add_listener(self, listener, topics):
+        """`listener(topic, message)` will be called (from any thread) for each message published to these topics"""
+        self.start_relay()
+        with self.lock:
+            for topic in topics:
+                self.listeners_by_topic.setdefault(topic, set()).add(listener)
+
+    def remove_listener(self, listener, topics):
+        with self.lock:
+            for topic in topics:
+                listeners = self.listeners_by_topic.get(topic)
+                if listeners is None:
+                    continue
+                listeners.discard(listener)
+                if not listeners:
+                    del self.listeners_by_topic[topic]
+
+    def deliver(self, topic, message):
+        """send a message to the local listeners"""
+        with self.lock:
+            listeners = list(self.listeners_by_topic.get(topic, ()))
+        for listener in listeners:
+            listener(topic, message)
+
+    def publish_many(self, messages):
+        for topic, message in messages:
+            self.deliver(topic, message)
+        if not self.directory:
+            return
+        relay_paths = [
+            os.path.join(self.directory, x)
+            for x in os.listdir(self.directory)
+            if x.startswith("relay-") and x.endswith(".sock")
+        ]
+        relay_paths = [x for x in relay_paths if x != self.relay_path]
+        if not relay_paths:
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            for topic, message in messages:
+                datagram = topic.encode("utf-8") + b"\n" + message
+                if len(datagram) > self.max_datagram_size:
+                    logger.error("message sent to %r is too large to be relayed" % topic)
+                    continue
+                for relay_path in relay_paths:
+                    try:
+                        sock.sendto(datagram, relay_path)
+                    except (ConnectionRefusedError, FileNotFoundError):
+                        # the process has been stopped without removing its socket
+                        self.remove_stale_socket(relay_path)
+                    except OSError as e:
+                        logger.warning("unable to relay message to %r: %s" % (relay_path, e))
+
+    @staticmethod
+    def remove_stale_socket(relay_path):
+        try:
+            os.remove(relay_path)
+        except OSError:
+            pass
+
+    def start_relay(self):
+        """create the Unix socket of this process and start the thread reading it"""
+        if not self.directory or self.relay_thread is not None:
+            return
+        with self.lock:
+            if self.relay_thread is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self.relay_path = os.path.join(
+                self.directory, "relay-%d-%x.sock" % (os.getpid(), id(self))
+            )
+            self.remove_stale_socket(self.relay_path)
+            self.relay_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.relay_socket.bind(self.relay_path)
+            self.relay_thread = threading.Thread(
+                target=self.read_relay, name="djangofloor-relay", daemon=True
+            )
+            self.relay_thread.start()
+
+    def read_relay(self):
+        while True:
+            try:
+                datagram = self.relay_socket.recv(self.max_datagram_size + 1)
+            except OSError as e:
+                logger.exception(e)
+                return
+            topic, __, message = datagram.partition(b"\n")
+            self.deliver(topic.decode("utf-8"), message)
+
+    def set_topics(self, window_key, topics, expire):
+        if not self.directory:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.next_cleanup:
+                    self.next_cleanup = now + self.cleanup_interval
+                    self.topics = {x: y for (x, y) in self.topics.items() if y[0] > now}
+                self.topics[window_key] = (now + expire, list(topics))
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.remove_expired_files()
+        expiration = time.time() + expire
+        # topic lists are stored once for all windows sharing the same topics
+        digest = hashlib.sha256("\n".join(topics).encode("utf-8")).hexdigest()
+        topics_path = os.path.join(self.directory, "topics-%s" % digest)
+        try:
+            if os.path.getmtime(topics_path) < expiration:
+                os.utime(topics_path, (expiration,) * 2)
+        except OSError:
+            self.write_file(topics_path, "\n".join(topics), expiration)
+        self.write_file(self.get_window_path(window_key), digest, expiration)
+
+    def write_file(self, path, content, expiration):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix="tmp-")
+        with os.fdopen(fd, "w") as fd:
+            fd.write(content)
+        # the modification time of the file is its expiration time
+        os.utime(tmp_path, (expiration,) * 2)
+        os.rename(tmp_path, path)
+
+    def remove_expired_files(self):
+        """remove expired topic files, at most once every `cleanup_interval` seconds"""
+        now = time.time()
+        if now < self.next_cleanup:
+            return
+        self.next_cleanup = now + self.cleanup_interval
+        for name in os.listdir(self.directory):
+            if not name.startswith(("topics-", "window-")):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < now:
+                    os.remove(path)
+            except OSError:  # already removed by another process
+                pass
+
+    def get_topics(self, window_key):
+        if not self.directory:
+            with self.lock:
+                expiration, topics = self.topics.get(window_key, (0, None))
+            return list(topics) if expiration > time.monotonic() else None
+        window_path = self.get_window_path(window_key)
+        try:
+            if os.path.getmtime(window_path) < time.time():
+                return None
+            with open(window_path) as fd:
+                digest = os.path.basename(fd.read())
+            with open(os.path.join(self.directory, "topics-%s" % digest)) as fd:
+                content = fd.read()
+        except OSError:
+            return None
+        return [x for x in content.splitlines() if x]
+
+    def get_window_path(self, window_key):
+        return os.path.join(self.directory, "window-%s" % os.path.basename(window_key))
+
+    def subscribe(self, topics):
+        return MemorySubscription(self, topics)
+
+
+class MemorySubscription(Subscription):
+    """Messages are stored in a deque, and a byte is written to a socket pair to wake up the `select` loop."""
+
+    def __init__(self, transport, topics):
+        self.transport = transport
+        self.topics = list(topics)
+        self.messages = deque()
+        self.reader, self.writer = socket.socketpair()
+        transport.add_listener(self.put, self.topics)
+
+    def put(self, topic, message):
+        self.messages.append((topic, message))
+        try:
+            self.writer.send(b"\0")
+        except OSError:
+            pass
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def get_message(self, fd=None):
+        self.reader.recv(1)
+        if self.messages:
+            return self.messages.popleft()
+        return None
+
+    def close(self):
+        self.transport.remove_listener(self.put, self.topics)
+        self.reader.close()
+        self.writer.close()
+
+
+@lru_cache()
+def get_transport():
+    """Return the transport defined by `settings.WEBSOCKET_TRANSPORT`."""
+    return import_string(settings.WEBSOCKET_TRANSPORT)()
@@ -27,497 +27,556 @@
 #
 ##############################################################################
 
-# use Cython implementation of UTF8 validator if available
-try:
-    # noinspection PyUnresolvedReferences,PyPackageRequirements
-    from wsaccel.utf8validator import Utf8Validator
-except ImportError:
-    # fallback to pure Python implementation
+import codecs
+
+
+class DfaUtf8Validator:
+    """
+    Incremental UTF-8 validator with constant memory consumption (minimal
+    state).
+
+    Implements the algorithm "Flexible and Economical UTF-8 Decoder" by
+    Bjoern Hoehrmann (http://bjoern.hoehrmann.de/utf-8/decoder/dfa/).
+    """
+
+    # DFA transitions
+    UTF8VALIDATOR_DFA = [
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,  # 00..1f
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,  # 20..3f
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,  # 40..5f
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,  # 60..7f
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,
+        9,  # 80..9f
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,
+        7,  # a0..bf
+        8,
+        8,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,
+        2,  # c0..df
+        0xA,
+        0x3,
+        0x3,
+        0x3,
+        0x3,
+        0x3,
+        0x3,
+        0x3,
+        0x3,
+        0x3,
+        0x3,
+        0x3,
+        0x3,
+        0x4,
+        0x3,
+        0x3,  # e0..ef
+        0xB,
+        0x6,
+        0x6,
+        0x6,
+        0x5,
+        0x8,
+        0x8,
+        0x8,
+        0x8,
+        0x8,
+        0x8,
+        0x8,
+        0x8,
+        0x8,
+        0x8,
+        0x8,  # f0..ff
+        0x0,
+        0x1,
+        0x2,
+        0x3,
+        0x5,
+        0x8,
+        0x7,
+        0x1,
+        0x1,
+        0x1,
+        0x4,
+        0x6,
+        0x1,
+        0x1,
+        0x1,
+        0x1,  # s0..s0
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        0,
+        1,
+        1,
+        1,
+        1,
+        1,
+        0,
+        1,
+        0,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,  # s1..s2
+        1,
+        2,
+        1,
+        1,
+        1,
+        1,
+        1,
+        2,
+        1,
+        2,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        2,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,  # s3..s4
+        1,
+        2,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        2,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        3,
+        1,
+        3,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,  # s5..s6
+        1,
+        3,
+        1,
+        1,
+        1,
+        1,
+        1,
+        3,
+        1,
+        3,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        3,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,
+        1,  # s7..s8
+    ]
+
+    UTF8_ACCEPT = 0
+    UTF8_REJECT = 1
 
-    class Utf8Validator:
+    def __init__(self):
+        self.state = None
+        self.codepoint = None
+        self.i = None
+        self.reset()
+
+    def decode(self, b):
         """
-        Incremental UTF-8 validator with constant memory consumption (minimal
-        state).
+        Eat one UTF-8 octet, and validate on the fly.
+
+        Returns UTF8_ACCEPT when enough octets have been consumed, in which case
+        self.codepoint contains the decoded Unicode code point.
+
+        Returns UTF8_REJECT when invalid UTF-8 was encountered.
 
-        Implements the algorithm "Flexible and Economical UTF-8 Decoder" by
-        Bjoern Hoehrmann (http://bjoern.hoehrmann.de/utf-8/decoder/dfa/).
+        Returns some other positive integer when more octets need to be eaten.
         """
+        # noinspection PyShadowingBuiltins
+        type = DfaUtf8Validator.UTF8VALIDATOR_DFA[b]
 
-        # DFA transitions
-        UTF8VALIDATOR_DFA = [
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,  # 00..1f
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,  # 20..3f
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,  # 40..5f
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,  # 60..7f
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,
-            9,  # 80..9f
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,
-            7,  # a0..bf
-            8,
-            8,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,
-            2,  # c0..df
-            0xA,
-            0x3,
-            0x3,
-            0x3,
-            0x3,
-            0x3,
-            0x3,
-            0x3,
-            0x3,
-            0x3,
-            0x3,
-            0x3,
-            0x3,
-            0x4,
-            0x3,
-            0x3,  # e0..ef
-            0xB,
-            0x6,
-            0x6,
-            0x6,
-            0x5,
-            0x8,
-            0x8,
-            0x8,
-            0x8,
-            0x8,
-            0x8,
-            0x8,
-            0x8,
-            0x8,
-            0x8,
-            0x8,  # f0..ff
-            0x0,
-            0x1,
-            0x2,
-            0x3,
-            0x5,
-            0x8,
-            0x7,
-            0x1,
-            0x1,
-            0x1,
-            0x4,
-            0x6,
-            0x1,
-            0x1,
-            0x1,
-            0x1,  # s0..s0
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            0,
-            1,
-            1,
-            1,
-            1,
-            1,
-            0,
-            1,
-            0,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,  # s1..s2
-            1,
-            2,
-            1,
-            1,
-            1,
-            1,
-            1,
-            2,
-            1,
-            2,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            2,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,  # s3..s4
-            1,
-            2,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            2,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            3,
-            1,
-            3,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,  # s5..s6
-            1,
-            3,
-            1,
-            1,
-            1,
-            1,
-            1,
-            3,
-            1,
-            3,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            3,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,
-            1,  # s7..s8
-        ]
-
-        UTF8_ACCEPT = 0
-        UTF8_REJECT = 1
-
-        def __init__(self):
-            self.state = None
-            self.codepoint = None
-            self.i = None
-            self.reset()
-
-        def decode(self, b):
-            """
-            Eat one UTF-8 octet, and validate on the fly.
-
-            Returns UTF8_ACCEPT when enough octets have been consumed, in which case
-            self.codepoint contains the decoded Unicode code point.
-
-            Returns UTF8_REJECT when invalid UTF-8 was encountered.
-
-            Returns some other positive integer when more octets need to be eaten.
-            """
-            # noinspection PyShadowingBuiltins
-            type = Utf8Validator.UTF8VALIDATOR_DFA[b]
-
-            if self.state != Utf8Validator.UTF8_ACCEPT:
-                self.codepoint = (b & 0x3F) | (self.codepoint << 6)
-            else:
-                self.codepoint = (0xFF >> type) & b
+        if self.state != DfaUtf8Validator.UTF8_ACCEPT:
+            self.codepoint = (b & 0x3F) | (self.codepoint << 6)
+        else:
+            self.codepoint = (0xFF >> type) & b
 
-            self.state = Utf8Validator.UTF8VALIDATOR_DFA[256 + self.state * 16 + type]
+        self.state = DfaUtf8Validator.UTF8VALIDATOR_DFA[256 + self.state * 16 + type]
 
-            return self.state
+        return self.state
 
-        def reset(self):
-            """
-            Reset validator to start new incremental UTF-8 decode/validation.
-            """
-            self.state = Utf8Validator.UTF8_ACCEPT
-            self.codepoint = 0
-            self.i = 0
+    def reset(self):
+        """
+        Reset validator to start new incremental UTF-8 decode/validation.
+        """
+        self.state = DfaUtf8Validator.UTF8_ACCEPT
+        self.codepoint = 0
+        self.i = 0
+
+    def validate(self, ba):
+        """
+        Incrementally validate a chunk of bytes provided as string.
 
-        def validate(self, ba):
-            """
-            Incrementally validate a chunk of bytes provided as string.
+        Will return a quad (valid?, endsOnCodePoint?, currentIndex, totalIndex).
 
-            Will return a quad (valid?, endsOnCodePoint?, currentIndex, totalIndex).
+        As soon as an octet is encountered which renders the octet sequence
+        invalid, a quad with valid? == False is returned. currentIndex returns
+        the index within the currently consumed chunk, and totalIndex the
+        index within the total consumed sequence that was the point of bail out.
+        When valid? == True, currentIndex will be len(ba) and totalIndex the
+        total amount of consumed bytes.
+        """
 
-            As soon as an octet is encountered which renders the octet sequence
-            invalid, a quad with valid? == False is returned. currentIndex returns
-            the index within the currently consumed chunk, and totalIndex the
-            index within the total consumed sequence that was the point of bail out.
-            When valid? == True, currentIndex will be len(ba) and totalIndex the
-            total amount of consumed bytes.
-            """
+        if isinstance(ba, str):
+            ba = ba.encode("utf-8")
+        length = len(ba)
 
-            if not isinstance(ba, str):
-                ba = ba.decode()
-            length = len(ba)
+        for i, octet in enumerate(ba):
+            # optimized version of decode(), since we are not interested in actual code points
 
-            for i in range(length):
-                # optimized version of decode(), since we are not interested in actual code points
+            self.state = DfaUtf8Validator.UTF8VALIDATOR_DFA[
+                256 + (self.state << 4) + DfaUtf8Validator.UTF8VALIDATOR_DFA[octet]
+            ]
 
-                self.state = Utf8Validator.UTF8VALIDATOR_DFA[
-                    256
-                    + (self.state << 4)
-                    + Utf8Validator.UTF8VALIDATOR_DFA[ord(ba[i])]
-                ]
+            if self.state == DfaUtf8Validator.UTF8_REJECT:
+                self.i += i
+                return False, False, i, self.i
 
-                if self.state == Utf8Validator.UTF8_REJECT:
-                    self.i += i
-                    return False, False, i, self.i
+        self.i += length
 
-            self.i += length
+        return True, self.state == DfaUtf8Validator.UTF8_ACCEPT, length, self.i
 
-            return True, self.state == Utf8Validator.UTF8_ACCEPT, length, self.i
+
+class IncrementalUtf8Validator:
+    """
+    Incremental UTF-8 validator based on the incremental decoder of the standard library.
+
+    Provides the same API as :class:`DfaUtf8Validator`, but most of the work is done by the
+    C implementation of the UTF-8 codec: it is used when `wsaccel` is not installed.
+    """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.i = 0
+
+    def reset(self):
+        """
+        Reset validator to start new incremental UTF-8 decode/validation.
+        """
+        self.decoder.reset()
+        self.i = 0
+
+    def validate(self, ba):
+        """
+        Incrementally validate a chunk of bytes.
+
+        Will return a quad (valid?, endsOnCodePoint?, currentIndex, totalIndex),
+        with the same meaning as :meth:`DfaUtf8Validator.validate`.
+        """
+        if isinstance(ba, str):
+            ba = ba.encode("utf-8")
+        pending = self.decoder.getstate()[0]
+        try:
+            self.decoder.decode(ba)
+        except UnicodeDecodeError as e:
+            # [e.start, e.end[ is the invalid sequence, but the validator must return
+            # the index of the first octet that cannot be part of a valid sequence
+            data = pending + bytes(ba)
+            if 0x80 <= data[e.start] <= 0xC1 or data[e.start] >= 0xF5:
+                index = e.start
+            else:
+                index = e.end
+            i = index - len(pending)
+            self.i += i
+            return False, False, i, self.i
+        length = len(ba)
+        # the codec does not reject all invalid incomplete sequences (like surrogates),
+        # so the few remaining octets are checked with the DFA
+        remaining = self.decoder.getstate()[0]
+        if remaining:
+            valid, __, i, __ = DfaUtf8Validator().validate(remaining)
+            if not valid:
+                i += length - len(remaining)
+                self.i += i
+                return False, False, i, self.i
+        self.i += length
+        return True, not remaining, length, self.i
+
+
+# use Cython implementation of UTF8 validator if available
+try:
+    # noinspection PyUnresolvedReferences,PyPackageRequirements
+    from wsaccel.utf8validator import Utf8Validator
+except ImportError:
+    # fallback to the standard library codec
+    Utf8Validator = IncrementalUtf8Validator
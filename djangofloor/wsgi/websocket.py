@@ -4,6 +4,7 @@ written by Jeffrey Gelens (http://noppo.pro/) and licensed under the Apache Lice
 This websocket is only used for the debug server and not for the production server.
 """
 import struct
+import zlib
 from socket import error as socket_error
 
 import logging
@@ -13,8 +14,101 @@ from djangofloor.wsgi.exceptions import WebSocketError, FrameTooLargeException
 logger = logging.getLogger("django.request")
 
 
+class PerMessageDeflate:
+    """Implement the "permessage-deflate" extension (RFC 7692).
+
+    Messages smaller than `threshold` bytes are sent uncompressed. If `context_takeover` is `False`,
+    the compression context is reset for each message (uses less memory, but compresses less).
+    Received messages that are larger than `max_size` bytes once decompressed are rejected.
+    """
+
+    name = "permessage-deflate"
+    TRAILER = b"\x00\x00\xff\xff"
+
+    def __init__(
+        self,
+        threshold=0,
+        context_takeover=True,
+        client_context_takeover=True,
+        server_max_window_bits=15,
+        max_size=1048576,
+    ):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.context_takeover = context_takeover
+        self.client_context_takeover = client_context_takeover
+        self.server_max_window_bits = server_max_window_bits
+        self.compressor = None
+        self.decompressor = None
+
+    @classmethod
+    def negotiate(cls, offers, threshold=0, context_takeover=True, max_size=1048576):
+        """Select the first acceptable offer in the `Sec-WebSocket-Extensions` header sent by the client.
+
+        :return: a `PerMessageDeflate` (or `None`) and the value of the `Sec-WebSocket-Extensions` response header
+        """
+        for offer in offers.split(","):
+            name, __, params = offer.partition(";")
+            if name.strip() != cls.name:
+                continue
+            extension = cls(
+                threshold=threshold,
+                context_takeover=context_takeover,
+                max_size=max_size,
+            )
+            response = [cls.name]
+            try:
+                for param in params.split(";"):
+                    key, __, value = param.strip().partition("=")
+                    value = value.strip('"')
+                    if key == "server_no_context_takeover":
+                        extension.context_takeover = False
+                    elif key == "client_no_context_takeover":
+                        extension.client_context_takeover = False
+                        response.append(key)
+                    elif key == "server_max_window_bits":
+                        extension.server_max_window_bits = int(value)
+                        if not 9 <= extension.server_max_window_bits <= 15:
+                            raise ValueError
+                        response.append("%s=%s" % (key, value))
+                    elif key not in ("", "client_max_window_bits"):
+                        raise ValueError
+            except ValueError:  # unsupported parameter: try the next offer
+                continue
+            if not extension.context_takeover:
+                response.append("server_no_context_takeover")
+            return extension, "; ".join(response)
+        return None, None
+
+    def compress(self, data):
+        if self.compressor is None or not self.context_takeover:
+            self.compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -self.server_max_window_bits
+            )
+        data = self.compressor.compress(data) + self.compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+        if data.endswith(self.TRAILER):
+            data = data[:-4]
+        return data
+
+    def decompress(self, data):
+        if self.decompressor is None or not self.client_context_takeover:
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        data = self.decompressor.decompress(
+            bytes(data) + self.TRAILER, self.max_size + 1
+        )
+        if len(data) > self.max_size:
+            # stop inflating the message as soon as it is too large
+            self.decompressor = None
+            raise FrameTooLargeException(
+                "Decompressed message cannot be larger than %d bytes" % self.max_size
+            )
+        return data
+
+
 class WebSocket:
-    __slots__ = ("_closed", "stream", "utf8validator", "utf8validate_last")
+    __slots__ = ("_closed", "stream", "utf8validator", "utf8validate_last", "deflate")
 
     OPCODE_CONTINUATION = 0x00
     OPCODE_TEXT = 0x01
@@ -23,9 +117,10 @@ class WebSocket:
     OPCODE_PING = 0x09
     OPCODE_PONG = 0x0A
 
-    def __init__(self, stream):
+    def __init__(self, stream, deflate=None):
         self._closed = False
         self.stream = stream
+        self.deflate = deflate
         self.utf8validator = Utf8Validator()
         self.utf8validate_last = None
 
@@ -130,17 +225,24 @@ class WebSocket:
         :return: The header and payload as a tuple.
         """
         header = Header.decode_header(self.stream)
-        if header.flags:
+        # only the first frame of a compressed message can set the RSV1 bit
+        if header.flags & ~Header.RSV0_MASK or (
+            header.flags
+            and (
+                self.deflate is None
+                or header.opcode not in (self.OPCODE_TEXT, self.OPCODE_BINARY)
+            )
+        ):
             raise WebSocketError
         if not header.length:
-            return header, ""
+            return header, b""
         try:
             payload = self.stream.read(header.length)
         except socket_error:
-            payload = ""
+            payload = b""
         except Exception as e:
             logger.debug("{}: {}".format(type(e), str(e)))
-            payload = ""
+            payload = b""
         if len(payload) != header.length:
             raise WebSocketError("Unexpected EOF reading frame payload")
         if header.mask:
@@ -166,7 +268,9 @@ class WebSocket:
         if an exception is called. Use `receive` instead.
         """
         opcode = None
-        message = ""
+        compressed = False
+        # fragments are accumulated as bytes and decoded once, when the last frame is received
+        message = bytearray()
         while True:
             header, payload = self.read_frame()
             f_opcode = header.opcode
@@ -181,6 +285,7 @@ class WebSocket:
                 self.utf8validator.reset()
                 self.utf8validate_last = (True, True, 0, 0)
                 opcode = f_opcode
+                compressed = bool(header.flags)
             elif f_opcode == self.OPCODE_CONTINUATION:
                 if not opcode:
                     raise WebSocketError("Unexpected frame with opcode=0")
@@ -195,15 +300,20 @@ class WebSocket:
                 return
             else:
                 raise WebSocketError("Unexpected opcode={0!r}".format(f_opcode))
-            if opcode == self.OPCODE_TEXT:
-                payload = payload.decode("utf-8")
+            if opcode == self.OPCODE_TEXT and not compressed:
+                # invalid text frames are rejected as soon as they are received
+                self.validate_utf8(payload)
             message += payload
             if header.fin:
                 break
+        if compressed:
+            try:
+                message = self.deflate.decompress(message)
+            except zlib.error:
+                raise WebSocketError("Invalid compressed message")
         if opcode == self.OPCODE_TEXT:
-            return message
-        else:
-            return bytearray(message)
+            return message.decode("utf-8")
+        return message
 
     def receive(self):
         """
@@ -239,7 +349,15 @@ class WebSocket:
             message = self._encode_bytes(message)
         elif opcode == self.OPCODE_BINARY:
             message = bytes(message)
-        header = Header.encode_header(True, opcode, "", len(message), 0)
+        flags = 0
+        if (
+            self.deflate is not None
+            and opcode in (self.OPCODE_TEXT, self.OPCODE_BINARY)
+            and len(message) >= self.deflate.threshold
+        ):
+            message = self.deflate.compress(message)
+            flags = Header.RSV0_MASK
+        header = Header.encode_header(True, opcode, "", len(message), flags)
         try:
             self.stream.write(header + message)
         except socket_error:
@@ -301,11 +419,13 @@ class Header:
         self.length = length
 
     def mask_payload(self, payload):
-        payload = bytearray(payload)
-        mask = bytearray(self.mask)
-        for i in range(self.length):
-            payload[i] ^= mask[i % 4]
-        return bytes(payload)
+        # XOR the whole payload at once with the repeated mask, using Python big integers
+        length = len(payload)
+        if not length:
+            return b""
+        mask = (bytes(self.mask) * (length // 4 + 1))[:length]
+        result = int.from_bytes(payload, "big") ^ int.from_bytes(mask, "big")
+        return result.to_bytes(length, "big")
 
     # it's the same operation
     unmask_payload = mask_payload
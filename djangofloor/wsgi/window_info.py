@@ -17,8 +17,13 @@ The list of used middlewares is defined by the `WINDOW_INFO_MIDDLEWARES` setting
 Designed to be instanciated from a :class:`django.http.request.HttpRequest` and reused across signals
 (when a signal calls another one). However, a blank :class:`WindowInfo` can also be directly instanciated.
 
+:class:`CompactWindowInfo` is a variant with a smaller memory footprint, that only runs the middlewares
+when their attributes are required. Websocket servers and Celery workers use the class
+defined by `settings.WINDOW_INFO_CLASS`.
+
 """
 import logging
+from functools import lru_cache
 
 from django.conf import settings
 from django.template.loader import render_to_string as raw_render_to_string
@@ -34,14 +39,10 @@ class Session:
         self.key = key
 
 
-class WindowInfo:
-    """ Built to store the username and the window key and must be supplied to any Python signal call.
-    All attributes are set by "WindowInfoMiddleware"'s.
+class BaseWindowInfo:
+    """Common methods of :class:`WindowInfo` and :class:`CompactWindowInfo`."""
 
-    Can be constructed from a standard :class:`django.http.HttpRequest` or from a dict.
-    Like the request, you should check the installed middlewares to obtain the full list of attributes.
-    The default ones are provided by :mod:`djangofloor.middleware`.
-    """
+    __slots__ = ()
 
     def __init__(self, init=True):
         if init:
@@ -83,18 +84,150 @@ class WindowInfo:
         :return: a valid request
         :rtype: :class:`djangofloor.wsgi.window_info.WindowInfo`
         """
-        if isinstance(request, WindowInfo):
+        if isinstance(request, BaseWindowInfo):
             return request
         elif request is None:
-            return WindowInfo()
+            return cls()
         window_info = cls(init=False)
         for mdw in middlewares:
             mdw.from_request(request, window_info)
         return window_info
 
 
+class WindowInfo(BaseWindowInfo):
+    """ Built to store the username and the window key and must be supplied to any Python signal call.
+    All attributes are set by "WindowInfoMiddleware"'s.
+
+    Can be constructed from a standard :class:`django.http.HttpRequest` or from a dict.
+    Like the request, you should check the installed middlewares to obtain the full list of attributes.
+    The default ones are provided by :mod:`djangofloor.middleware`.
+    """
+
+
+class _Pending:
+    """Dict used by :meth:`CompactWindowInfo.from_dict`, kept until all middlewares have been run."""
+
+    __slots__ = ("values", "loaded")
+
+    def __init__(self, values):
+        self.values = values
+        self.loaded = 0  # number of middlewares already run
+
+
+def _lazy_field_property(slot, name, middleware_index):
+    get = slot.__get__
+
+    def getter(self):
+        try:
+            return get(self)
+        except AttributeError:
+            pass
+        self.load(middleware_index + 1)
+        try:
+            return get(self)
+        except AttributeError:  # not set by its middleware
+            raise AttributeError(name) from None
+
+    return property(getter, slot.__set__, slot.__delete__)
+
+
+class BaseCompactWindowInfo(BaseWindowInfo):
+    """Variant of :class:`WindowInfo` without instance dict: only the attributes declared by the middlewares
+    (:attr:`djangofloor.middleware.WindowInfoMiddleware.fields`) can be set, and they are stored in slots.
+
+    When built by :meth:`from_dict`, middlewares are only run when one of their attributes is read
+    (for example, the user is not fetched from the database if the signal does not use it).
+    Until then, the object belongs to a subclass whose attributes are properties (an empty slot means that
+    its middleware has not been run yet), and the dict is kept in the `_pending` slot.
+    Once all middlewares have been run, the object gets back its class (with plain slots).
+    """
+
+    __slots__ = ("_pending",)
+    extra_fields = ("celery_request",)  # attributes that are not set by middlewares
+    # set by :meth:`with_fields`
+    _lazy_class = None  # subclass used by from_dict
+    _shared_fields = ()  # _shared_fields[i]: fields of the i-th middleware that belong to a next one
+
+    @classmethod
+    def from_dict(cls, values):
+        if values is None:
+            return None
+        window_info = cls(init=False)
+        window_info._pending = _Pending(values)
+        window_info.__class__ = cls._lazy_class
+        return window_info
+
+    def load(self, count):
+        """Run the `from_dict` method of the `count` first middlewares (if not already run), in order."""
+        pending = self._pending
+        if pending is None or pending.loaded >= count:
+            return
+        # middlewares set plain slots, much faster than properties
+        self.__class__ = self._lazy_class.__base__
+        while pending.loaded < count:
+            index = pending.loaded
+            pending.loaded += 1
+            middlewares[index].from_dict(self, values=pending.values)
+            # attributes that are also set by a next middleware stay empty
+            for field in self._shared_fields[index]:
+                if hasattr(self, field):
+                    delattr(self, field)
+        if pending.loaded < len(middlewares):
+            self.__class__ = self._lazy_class
+        else:
+            self._pending = None
+
+    def _lazy_to_dict(self):
+        # all attributes are required
+        self.load(len(middlewares))
+        return self.to_dict()
+
+    @classmethod
+    def with_fields(cls, name):
+        """Create a subclass with a slot for each attribute declared by the middlewares,
+        and its lazy variant where slots are wrapped in properties that run the required middlewares on first access.
+        """
+        middleware_indices = {}
+        for index, mdw in enumerate(middlewares):
+            for field in mdw.fields:
+                # the value of a field is set by the last middleware that declares it
+                middleware_indices[field] = index
+        for field in cls.extra_fields:
+            middleware_indices.setdefault(field, -1)
+        namespace = {
+            "__slots__": tuple(middleware_indices),
+            "__module__": cls.__module__,
+            "__doc__": cls.__doc__,
+        }
+        new_cls = type(name, (cls,), namespace)
+        new_cls._shared_fields = tuple(
+            tuple(x for x in mdw.fields if middleware_indices[x] > index)
+            for (index, mdw) in enumerate(middlewares)
+        )
+        namespace = {
+            "__slots__": (),
+            "__module__": cls.__module__,
+            "to_dict": cls._lazy_to_dict,
+        }
+        for field, index in middleware_indices.items():
+            if index >= 0:
+                namespace[field] = _lazy_field_property(
+                    new_cls.__dict__[field], field, index
+                )
+        new_cls._lazy_class = type("Lazy%s" % name, (new_cls,), namespace)
+        return new_cls
+
+
+CompactWindowInfo = BaseCompactWindowInfo.with_fields("CompactWindowInfo")
 for mdw_ in middlewares:
     mdw_.install_methods(WindowInfo)
+    mdw_.install_methods(CompactWindowInfo)
+
+
+@lru_cache()
+def get_window_info_class():
+    """Return the class defined by `settings.WINDOW_INFO_CLASS`."""
+    return import_string(settings.WINDOW_INFO_CLASS)
 
 
 def get_window_context(window_info):
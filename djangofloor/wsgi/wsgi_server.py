@@ -1,8 +1,7 @@
 """
-Structure of the redis database, with `prefix = settings.WEBSOCKET_REDIS_PREFIX`:
-
-  * pubsub topics "{prefix}{topic}" where topic-key is given by the user-defined function
-  * HSET "{prefix}topics-{window-key}" to list of topics with EXPIRE
+Topics are given by the user-defined function `settings.WEBSOCKET_TOPIC_SERIALIZER` and prefixed
+by `settings.WEBSOCKET_REDIS_PREFIX`. Messages are sent and topics are stored by the transport
+defined in `settings.WEBSOCKET_TRANSPORT` (see :mod:`djangofloor.wsgi.transports`).
 
 
 """
@@ -24,8 +23,9 @@ from djangofloor.decorators import REGISTERED_FUNCTIONS
 # noinspection PyProtectedMember
 from djangofloor.tasks import (
     SERVER,
+    WINDOW,
+    _call_function,
     _call_signal,
-    _server_function_call,
     get_websocket_redis_connection,
     import_signals_and_functions,
 )
@@ -34,7 +34,8 @@ from djangofloor.wsgi.exceptions import (
     UpgradeRequiredError,
     WebSocketError,
 )
-from djangofloor.wsgi.window_info import WindowInfo
+from djangofloor.wsgi.transports import get_transport
+from djangofloor.wsgi.window_info import WindowInfo, get_window_info_class
 from djangofloor.middleware import unsign_token
 
 __author__ = "Matthieu Gallet"
@@ -47,13 +48,21 @@ def get_websocket_topics(request):
     signed_token = request.GET.get("token", "")
     session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
     try:
-        window_key, __, __ = unsign_token(session_key, signed_token)
+        window_key, __, topics = unsign_token(session_key, signed_token)
     except signing.BadSignature:
         return []
-    redis_key = "%s%s" % (settings.WEBSOCKET_REDIS_PREFIX, window_key)
-    connection = get_websocket_redis_connection()
-    topics = connection.lrange(redis_key, 0, -1)
-    return [x.decode("utf-8") for x in topics]
+    if topics is not None:
+        return [settings.WEBSOCKET_REDIS_PREFIX + x for x in topics]
+    prefix = settings.WEBSOCKET_REDIS_PREFIX
+    topics = get_transport().get_topics(window_key)
+    if topics is None:
+        return []
+    window_info = WindowInfo()
+    window_info.window_key = window_key
+    window_topic = topic_serializer(window_info, WINDOW)
+    if window_topic is not None:
+        topics.append(prefix + window_topic)
+    return topics
 
 
 class WebsocketWSGIServer:
@@ -92,7 +101,7 @@ class WebsocketWSGIServer:
             engine = import_module(settings.SESSION_ENGINE)
             request.session = engine.SessionStore(session_key)
             # request.user = get_user(request)  # avoid a sync call
-        window_info = WindowInfo.from_request(request)
+        window_info = get_window_info_class().from_request(request)
         signed_token = request.GET.get("token", "")
         try:
             window_key, user_pk, __ = unsign_token(session_key, signed_token)
@@ -109,7 +118,11 @@ class WebsocketWSGIServer:
         return channels, echo_message
 
     @staticmethod
-    def publish_message(window_info, message):
+    def publish_message(window_info, message, reply=None):
+        """Process a message sent by the client.
+
+        :param reply: callable that directly sends a serialized message to the client, used by inline functions
+        """
         if isinstance(message, bytes):
             message = message.decode("utf-8")
         if not message:
@@ -140,11 +153,8 @@ class WebsocketWSGIServer:
                 result_id = unserialized_message["result_id"]
                 import_signals_and_functions()
                 if function_name in REGISTERED_FUNCTIONS:
-                    fn = REGISTERED_FUNCTIONS[function_name]
-                    queue = fn.get_queue(window_info, kwargs)
-                    _server_function_call.apply_async(
-                        [function_name, window_info.to_dict(), result_id, kwargs],
-                        queue=queue,
+                    _call_function(
+                        window_info, function_name, result_id, kwargs, reply=reply
                     )
                 else:
                     logger.warning(
@@ -229,18 +239,15 @@ class WebsocketWSGIServer:
     def process_websocket(self, window_info, websocket, channels):
         websocket_fd = self.get_ws_file_descriptor(websocket)
         listening_fds = [websocket_fd]
-        redis_fd, pubsub = None, None
+        subscription_fds, subscription = [], None
         try:
             if channels:
-                pubsub = self._redis_connection.pubsub()
-                pubsub.subscribe(*channels)
+                subscription = get_transport().subscribe(channels)
                 logger.debug(
                     "Subscribed to channels: {0}".format(", ".join(map(repr, channels)))
                 )
-                # noinspection PyProtectedMember
-                redis_fd = pubsub.connection._sock.fileno()
-                if redis_fd:
-                    listening_fds.append(redis_fd)
+                subscription_fds = [x for x in subscription.filenos() if x]
+                listening_fds += subscription_fds
             # subscriber.send_persited_messages(websocket)
             while websocket and not websocket.closed:
                 selected_fds = self.select(listening_fds, [], [], 10.0)
@@ -251,12 +258,17 @@ class WebsocketWSGIServer:
                 for fd in ready:
                     if fd == websocket_fd:
                         message = self.ws_receive_bytes(websocket)
-                        self.publish_message(window_info, message)
-                    elif fd == redis_fd:
-                        kind, topic, message = pubsub.parse_response()
-                        kind = kind.decode("utf-8")
-                        if kind == "message":
-                            self.ws_send_bytes(websocket, message)
+                        self.publish_message(
+                            window_info,
+                            message,
+                            reply=lambda x: self.ws_send_bytes(
+                                websocket, x.encode("utf-8")
+                            ),
+                        )
+                    elif fd in subscription_fds:
+                        published = subscription.get_message(fd)
+                        if published is not None:
+                            self.ws_send_bytes(websocket, published[1])
                     else:
                         logger.error("Invalid file descriptor: {0}".format(fd))
                 # Check again that the websocket is closed before sending the heartbeat,
@@ -266,5 +278,5 @@ class WebsocketWSGIServer:
                         websocket, settings.WEBSOCKET_HEARTBEAT.encode("utf-8")
                     )
         finally:
-            if pubsub:
-                pubsub.close()
+            if subscription:
+                subscription.close()